@@ -7,12 +7,13 @@ import numpy as np
 
 from longitudinal_model import LongitudinalModel
 from lateral_model import LateralModel
+from lateral_controllers import StanleyController, route_state
 
 from utils.cutils import CUtils
 
 
 class Controller2D:
-  def __init__(self, waypoints):
+  def __init__(self, waypoints, lateral_controller=None):
     self.vars = CUtils()
     self._current_x = 0
     self._current_y = 0
@@ -25,13 +26,18 @@ class Controller2D:
     self._set_throttle = 0
     self._set_brake = 0
     self._set_steer = 0
-    self._waypoints = waypoints
+    self._waypoints = np.asarray(waypoints, dtype=float)
+    self._route = None
+    self._route_state = None
     self._conv_rad_to_steer = 180.0 / 70.0 / np.pi
     self._pi = np.pi
     self._2pi = 2.0 * np.pi
 
     self.longitudinal_model = LongitudinalModel()
     self.lateral_model = LateralModel()
+    self.lateral_model.set_waypoints(self._waypoints)
+    # Lateral controller used along the route, see lateral_controllers.
+    self.lateral_controller = lateral_controller or StanleyController()
 
   def update_values(self, x, y, yaw, speed, timestamp, frame):
     self._current_x = x
@@ -44,24 +50,31 @@ class Controller2D:
       self._start_control_loop = True
 
   def update_desired_speed(self):
-    min_idx = 0
-    min_dist = float("inf")
-    desired_speed = 0
-    for i in range(len(self._waypoints)):
-      dist = np.linalg.norm(np.array([
-          self._waypoints[i][0] - self._current_x,
-          self._waypoints[i][1] - self._current_y]))
-      if dist < min_dist:
-        min_dist = dist
-        min_idx = i
-    if min_idx < len(self._waypoints) - 1:
-      desired_speed = self._waypoints[min_idx][2]
-    else:
-      desired_speed = self._waypoints[-1][2]
-    self._desired_speed = desired_speed
-
-  def update_waypoints(self, new_waypoints):
-    self._waypoints = new_waypoints
+    if self._route is not None:
+      s, _ = self._route.project(self._current_x, self._current_y)
+      self._desired_speed = float(self._route.speed(s))
+      return
+    min_idx, _ = self.lateral_model.get_nearest_index(self._current_x,
+                                                      self._current_y)
+    self._desired_speed = self._waypoints[min_idx, 2]
+
+  def update_waypoints(self, new_waypoints, start_index=None):
+    """Sets the waypoints to follow, converted to an array once here
+    instead of on every control update.
+
+    args:
+        new_waypoints: Waypoints in the format [[x0, y0, v0], ...], or an
+            array of shape (N, 3).
+        start_index: Optional index of the first waypoint in the full
+            waypoint array, see LateralModel.set_waypoints().
+    """
+    self._waypoints = np.asarray(new_waypoints, dtype=float)
+    self.lateral_model.set_waypoints(self._waypoints, start_index)
+
+  def update_route(self, route):
+    """Tracks a SplineRoute instead of the waypoints, see
+    utils.spline_route."""
+    self._route = route
 
   def get_commands(self):
     return self._set_throttle, self._set_steer, self._set_brake
@@ -87,11 +100,14 @@ class Controller2D:
     self.update_desired_speed()
     v_desired = self._desired_speed
     t = self._current_timestamp
-    waypoints = self._waypoints
 
     if self._start_control_loop:
       throttle_output, brake_output = self.longitudinal_model.compute_control(v_desired, v, t)
-      steer_output = self.lateral_model.compute_control(waypoints, x, y, yaw, v)
+      if self._route is not None:
+        self._route_state = route_state(self._route, x, y, yaw, v)
+        steer_output = self.lateral_controller.compute_control(self._route_state)
+      else:
+        steer_output = self.lateral_model.compute_control(None, x, y, yaw, v)
 
       self.set_throttle(throttle_output)
       self.set_steer(steer_output)
@@ -0,0 +1,220 @@
+"""
+Lateral controllers tracking a SplineRoute, selectable by name.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
+MAX_STEER = 1.22  # Steering angle limit (rad)
+
+# State of the vehicle relative to a SplineRoute, see route_state().
+RouteState = namedtuple('RouteState',
+                        'route s lateral heading_error x y yaw v')
+
+
+def _wrap_angle(angle):
+  return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+def route_state(route, x, y, yaw, v):
+  """Projects the vehicle onto a route.
+
+  args:
+      route: SplineRoute being tracked, see utils.spline_route.
+      x, y: Position (m) of the vehicle.
+      yaw: Heading (rad) of the vehicle.
+      v: Speed (m/s) of the vehicle.
+  returns:
+      route_state: RouteState where s is the arc length (m) of the closest
+          point of the route, lateral the signed distance (m) from the route
+          to the vehicle (positive to the left) and heading_error the
+          heading of the vehicle relative to the route (rad).
+  """
+  s, lateral = route.project(x, y)
+  heading_error = _wrap_angle(yaw - float(route.heading(s)))
+  return RouteState(route, s, lateral, heading_error, x, y, yaw, v)
+
+
+class StanleyController:
+  """Stanley controller, which steers to cancel the heading error plus a
+  term proportional to the arctangent of the crosstrack error over speed.
+
+  args:
+      k_e: Crosstrack error gain.
+  """
+
+  def __init__(self, k_e=0.3):
+    self.k_e = k_e
+
+  def compute_control(self, state):
+    """Computes the steering angle (rad) for a RouteState."""
+    # A vehicle to the left of the route has a negative crosstrack error.
+    yaw_diff_crosstrack = np.arctan(-self.k_e * state.lateral /
+                                    (state.v + 1e-5))
+    steer_expect = _wrap_angle(yaw_diff_crosstrack - state.heading_error)
+    return np.clip(steer_expect, -MAX_STEER, MAX_STEER)
+
+
+class PurePursuitController:
+  """Pure pursuit controller, which steers along the circular arc through a
+  lookahead point on the route.
+
+  args:
+      wheelbase: Distance (m) between the front and rear axles.
+      lookahead_gain: Lookahead time (s), the lookahead distance grows with
+          speed.
+      min_lookahead: Minimum lookahead distance (m).
+  """
+
+  def __init__(self, wheelbase=3.0, lookahead_gain=0.8, min_lookahead=4.0):
+    self.wheelbase = wheelbase
+    self.lookahead_gain = lookahead_gain
+    self.min_lookahead = min_lookahead
+
+  def compute_control(self, state):
+    """Computes the steering angle (rad) for a RouteState."""
+    lookahead = max(self.min_lookahead, self.lookahead_gain * state.v)
+    target_x, target_y = state.route.position(
+        min(state.s + lookahead, state.route.length))
+    alpha = _wrap_angle(np.arctan2(target_y - state.y, target_x - state.x) -
+                        state.yaw)
+    steer_expect = np.arctan2(2.0 * self.wheelbase * np.sin(alpha), lookahead)
+    return np.clip(steer_expect, -MAX_STEER, MAX_STEER)
+
+
+class MpcController:
+  """Linear model predictive controller.
+
+  The kinematic bicycle model is linearized about the route, with the state
+  [lateral error, heading error] and the steering angle relative to the
+  curvature feedforward atan(wheelbase * curvature) as input. The input
+  sequence over the horizon minimizes a quadratic cost on the state and the
+  input, subject to the steering limits, which is a small box constrained QP
+  solved with ADMM.
+
+  The QP matrices only depend on the speed, so they and the Cholesky
+  factorization ADMM solves with are cached per speed band, and every solve
+  is warm started from the previous solution shifted by one step.
+
+  args:
+      wheelbase: Distance (m) between the front and rear axles.
+      horizon: Number of steps of the prediction horizon.
+      dt: Duration (s) of a step.
+      q_lateral: Cost weight of the lateral error.
+      q_heading: Cost weight of the heading error.
+      r_steer: Cost weight of the steering input.
+      rho: ADMM penalty parameter.
+      max_iter: Maximum number of ADMM iterations per solve.
+      tolerance: ADMM primal and dual residual tolerance.
+      speed_resolution: Width (m/s) of the speed bands the QP matrices are
+          cached for.
+  """
+
+  def __init__(self, wheelbase=3.0, horizon=10, dt=0.1, q_lateral=1.0,
+               q_heading=1.0, r_steer=1.0, rho=1.0, max_iter=50,
+               tolerance=1e-4, speed_resolution=0.5):
+    self.wheelbase = wheelbase
+    self.horizon = int(horizon)
+    self.dt = dt
+    self.q_lateral = q_lateral
+    self.q_heading = q_heading
+    self.r_steer = r_steer
+    self.rho = rho
+    self.max_iter = int(max_iter)
+    self.tolerance = tolerance
+    self.speed_resolution = speed_resolution
+    self._qp_cache = {}
+    self._z = np.zeros(self.horizon)
+    self._w = np.zeros(self.horizon)
+
+  def _qp_matrices(self, v):
+    # Speeds are rounded up to their band, and kept away from zero where
+    # the steering has no effect.
+    band = max(int(np.ceil(v / self.speed_resolution)), 1)
+    matrices = self._qp_cache.get(band)
+    if matrices is not None:
+      return matrices
+
+    v = band * self.speed_resolution
+    n = self.horizon
+    a = np.array([[1.0, v * self.dt], [0.0, 1.0]])
+    b = np.array([0.0, v * self.dt / self.wheelbase])
+    # Predicted states E = phi e0 + gamma U over the horizon, of shape
+    # (2 n,).
+    phi = np.zeros((2 * n, 2))
+    gamma = np.zeros((2 * n, n))
+    power = np.eye(2)
+    powers_b = []
+    for k in range(n):
+      powers_b.append(power @ b)
+      power = a @ power
+      phi[2 * k:2 * k + 2] = power
+    for k in range(n):
+      for j in range(k + 1):
+        gamma[2 * k:2 * k + 2, j] = powers_b[k - j]
+    q = np.tile([self.q_lateral, self.q_heading], n)
+    hessian = gamma.T @ (q[:, None] * gamma) + self.r_steer * np.eye(n)
+    matrices = (cho_factor(hessian + self.rho * np.eye(n)),
+                gamma.T @ (q[:, None] * phi))
+    self._qp_cache[band] = matrices
+    return matrices
+
+  def reset(self):
+    """Forgets the previous solution the next solve is warm started from."""
+    self._z[:] = 0.0
+    self._w[:] = 0.0
+
+  def compute_control(self, state):
+    """Computes the steering angle (rad) for a RouteState."""
+    factor, linear = self._qp_matrices(state.v)
+    gradient = linear @ np.array([state.lateral, state.heading_error])
+
+    # Feedforward over the horizon, the input bounds are relative to it.
+    s = np.minimum(state.s + max(state.v, 0.0) * self.dt *
+                   np.arange(self.horizon), state.route.length)
+    feedforward = np.arctan(self.wheelbase * state.route.curvature(s))
+    lower = -MAX_STEER - feedforward
+    upper = MAX_STEER - feedforward
+
+    # Warm start from the previous solution, shifted by one step.
+    z = self._z
+    w = self._w
+    z[:-1] = z[1:]
+    w[:-1] = w[1:]
+    np.clip(z, lower, upper, out=z)
+    for _ in range(self.max_iter):
+      u = cho_solve(factor, self.rho * (z - w) - gradient)
+      z_previous = z.copy()
+      np.clip(u + w, lower, upper, out=z)
+      w += u - z
+      if (np.max(np.abs(u - z)) < self.tolerance and
+          self.rho * np.max(np.abs(z - z_previous)) < self.tolerance):
+        break
+
+    return np.clip(z[0] + feedforward[0], -MAX_STEER, MAX_STEER)
+
+
+LATERAL_CONTROLLERS = {
+    'stanley': StanleyController,
+    'pure_pursuit': PurePursuitController,
+    'mpc': MpcController,
+}
+
+
+def make_lateral_controller(name, params=None):
+  """Creates a lateral controller by name.
+
+  args:
+      name: Name of the controller, one of LATERAL_CONTROLLERS.
+      params: Optional mapping of constructor arguments to values, which may
+          be strings as read from options.cfg.
+  returns:
+      controller: Controller with a compute_control(route_state) method.
+  """
+  if name not in LATERAL_CONTROLLERS:
+    raise ValueError("Unknown lateral controller '%s', expected one of %s." %
+                     (name, ', '.join(sorted(LATERAL_CONTROLLERS))))
+  params = {key: float(value) for key, value in (params or {}).items()}
+  return LATERAL_CONTROLLERS[name](**params)
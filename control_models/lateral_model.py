@@ -1,32 +1,116 @@
-
 import numpy as np
 
 
 class LateralModel:
-  def __init__(self):
+  """Stanley lateral controller.
+
+  The waypoints are converted to an array once in set_waypoints(), and the
+  nearest waypoint is tracked from tick to tick by searching only a window
+  of waypoints around the last nearest one, using preallocated buffers.
+  While the closest waypoint of the window is on its edge, the window moves
+  on to be centered on it, so the search follows the vehicle over densely
+  interpolated waypoints however far it moved since the last tick.
+
+  args:
+      window: Number of waypoints searched on each side of the last nearest
+          waypoint.
+      max_steps: Number of times the window may move before falling back to
+          a search over all of the waypoints.
+  """
+
+  def __init__(self, window=64, max_steps=8):
     self.k_e = 0.3
+    self._window = window
+    self._max_steps = max_steps
+    self._waypoints = np.zeros((0, 3))
+    self._source = None
+    self._start_index = None
+    self._nearest_index = None
+    self._diffs = np.empty((2 * window + 1, 2))
+    self._dists = np.empty(2 * window + 1)
+
+  def set_waypoints(self, waypoints, start_index=None):
+    """Sets the waypoints to track.
+
+    args:
+        waypoints: Waypoints in the format [[x0, y0, v0], [x1, y1, v1], ...],
+            or an array of shape (N, 3). An array is used without a copy.
+        start_index: Optional index of the first waypoint in a larger array
+            the waypoints are a window of. When consecutive windows of the
+            same array are given, the nearest waypoint keeps being tracked
+            instead of being searched for again.
+    """
+    self._source = waypoints
+    self._waypoints = np.asarray(waypoints, dtype=float)
+    if (start_index is not None and self._start_index is not None and
+        self._nearest_index is not None):
+      self._nearest_index += self._start_index - start_index
+      if not 0 <= self._nearest_index < len(self._waypoints):
+        self._nearest_index = None
+    else:
+      self._nearest_index = None
+    self._start_index = start_index
+
+  def reset(self):
+    """Forgets the nearest waypoint, so the next search covers all of the
+    waypoints."""
+    self._nearest_index = None
+
+  def get_nearest_index(self, x, y):
+    waypoints = self._waypoints
+    num_points = len(waypoints)
+    index = self._nearest_index
+    for _ in range(self._max_steps if index is not None else 0):
+      lo = max(index - self._window, 0)
+      hi = min(index + self._window + 1, num_points)
+      diffs = self._diffs[:hi - lo]
+      dists = self._dists[:hi - lo]
+      np.subtract(waypoints[lo:hi, :2], (x, y), out=diffs)
+      np.hypot(diffs[:, 0], diffs[:, 1], out=dists)
+      index = lo + int(np.argmin(dists))
+      # The nearest waypoint may lie past the window if it is on its edge,
+      # in which case the window moves on to be centered on it.
+      if (index > lo or lo == 0) and (index < hi - 1 or hi == num_points):
+        self._nearest_index = index
+        return index, dists[index - lo]
+
+    dists = np.hypot(waypoints[:, 0] - x, waypoints[:, 1] - y)
+    index = int(np.argmin(dists))
+    self._nearest_index = index
+    return index, dists[index]
 
   def calculate_crosstrack_error(self, waypoints, current_pos):
-    waypoints = np.array(waypoints)
-    diffs = waypoints[:, :2] - current_pos
-    dists = np.hypot(diffs[:, 0], diffs[:, 1])
-    min_dist_index = np.argmin(dists)
-    nearest_waypoint = waypoints[min_dist_index]
-    return dists[min_dist_index], nearest_waypoint
+    if waypoints is not self._source:
+      self.set_waypoints(waypoints)
+    index, dist = self.get_nearest_index(current_pos[0], current_pos[1])
+    return dist, self._waypoints[index]
 
   def compute_control(self, waypoints, x, y, yaw, v):
-    current_pos = np.array([x, y])
-    crosstrack_error, nearest_waypoint = self.calculate_crosstrack_error(waypoints, current_pos)
+    """Computes the steering angle with the Stanley control law.
+
+    args:
+        waypoints: Waypoints to track, or None to track the ones given to
+            set_waypoints().
+        x, y: Position (m) of the vehicle.
+        yaw: Heading (rad) of the vehicle.
+        v: Speed (m/s) of the vehicle.
+    returns:
+        steer_expect: Steering angle (rad).
+    """
+    if waypoints is not None and waypoints is not self._source:
+      self.set_waypoints(waypoints)
+    index, crosstrack_error = self.get_nearest_index(x, y)
+    nearest_x, nearest_y = self._waypoints[index, 0], self._waypoints[index, 1]
 
     yaw_path = np.arctan2(
-        nearest_waypoint[1] - waypoints[0][1],
-        nearest_waypoint[0] - waypoints[0][0]
+        nearest_y - self._waypoints[0, 1],
+        nearest_x - self._waypoints[0, 0]
     )
 
     yaw_diff_heading = yaw_path - yaw
     yaw_diff_heading = (yaw_diff_heading + np.pi) % (2 * np.pi) - np.pi
 
-    yaw_cross_track = np.arctan2(y - nearest_waypoint[1], x - nearest_waypoint[0])
+    yaw_cross_track = np.arctan2(y - nearest_y, x - nearest_x)
     yaw_path2ct = yaw_path - yaw_cross_track
     yaw_path2ct = (yaw_path2ct + np.pi) % (2 * np.pi) - np.pi
 
@@ -1,33 +1,180 @@
-
 import numpy as np
 
 
+class FeedforwardTable:
+  """Throttle/brake feedforward table indexed by (target acceleration,
+  speed), bilinearly interpolated.
+
+  Commands are in [-1, 1], where positive values are throttle and negative
+  values are brake.
+
+  args:
+      accelerations: Increasing grid of target accelerations (m/s^2), of
+          shape (A,).
+      speeds: Increasing grid of speeds (m/s), of shape (S,).
+      commands: Commands at the grid points, of shape (A, S).
+  """
+
+  def __init__(self, accelerations, speeds, commands):
+    self.accelerations = np.asarray(accelerations, dtype=float)
+    self.speeds = np.asarray(speeds, dtype=float)
+    self.commands = np.asarray(commands, dtype=float)
+    self._da = self.accelerations[1] - self.accelerations[0]
+    self._dv = self.speeds[1] - self.speeds[0]
+    self._uniform = (np.allclose(np.diff(self.accelerations), self._da) and
+                     np.allclose(np.diff(self.speeds), self._dv))
+
+  @classmethod
+  def from_model(cls, accelerations=np.arange(-8.0, 4.01, 0.5),
+                 speeds=np.arange(0.0, 30.01, 2.5), max_accel=4.0,
+                 max_accel_speed_slope=0.08, max_decel=8.0, rolling=0.1,
+                 drag=0.0008):
+    """Builds a table from a simple vehicle model, where the throttle
+    acceleration fades with speed and rolling and air resistance slow the
+    vehicle down. Used until a table is fitted from logged runs."""
+    a, v = np.meshgrid(accelerations, speeds, indexing='ij')
+    effort = a + rolling + drag * v**2
+    throttle_accel = np.maximum(max_accel - max_accel_speed_slope * v, 1.0)
+    commands = np.where(effort >= 0, effort / throttle_accel, effort / max_decel)
+    return cls(accelerations, speeds, np.clip(commands, -1.0, 1.0))
+
+  @classmethod
+  def fit(cls, accelerations, speeds, commands, accel_grid, speed_grid):
+    """Fits a table to logged samples.
+
+    Each sample is assigned to its nearest grid point, and the command at
+    a grid point is the mean of its samples. Grid points without samples
+    take the command of the nearest acceleration with samples at the same
+    speed, or of the nearest speed if the speed has no samples at all.
+
+    args:
+        accelerations: Measured accelerations (m/s^2) of the samples.
+        speeds: Measured speeds (m/s) of the samples.
+        commands: Commands of the samples, throttle minus brake.
+        accel_grid: Increasing, uniform acceleration grid (m/s^2).
+        speed_grid: Increasing, uniform speed grid (m/s).
+    returns:
+        table: FeedforwardTable fitted to the samples.
+    """
+    accel_grid = np.asarray(accel_grid, dtype=float)
+    speed_grid = np.asarray(speed_grid, dtype=float)
+    i = np.clip(np.rint((np.asarray(accelerations) - accel_grid[0]) /
+                        (accel_grid[1] - accel_grid[0])).astype(int),
+                0, len(accel_grid) - 1)
+    j = np.clip(np.rint((np.asarray(speeds) - speed_grid[0]) /
+                        (speed_grid[1] - speed_grid[0])).astype(int),
+                0, len(speed_grid) - 1)
+    shape = (len(accel_grid), len(speed_grid))
+    sums = np.zeros(shape)
+    counts = np.zeros(shape)
+    np.add.at(sums, (i, j), commands)
+    np.add.at(counts, (i, j), 1)
+    if not np.any(counts):
+      raise ValueError("Cannot fit a feedforward table without samples.")
+
+    table = np.zeros(shape)
+    filled = counts > 0
+    table[filled] = sums[filled] / counts[filled]
+    grid_index = np.arange(len(accel_grid))
+    for col in range(len(speed_grid)):
+      rows = np.flatnonzero(filled[:, col])
+      if len(rows) > 0:
+        nearest = rows[np.argmin(np.abs(grid_index[:, None] - rows), axis=1)]
+        table[:, col] = table[nearest, col]
+    cols = np.flatnonzero(np.any(filled, axis=0))
+    nearest = cols[np.argmin(np.abs(np.arange(len(speed_grid))[:, None] - cols),
+                             axis=1)]
+    table = table[:, nearest]
+    return cls(accel_grid, speed_grid, np.clip(table, -1.0, 1.0))
+
+  def lookup(self, acceleration, speed):
+    """Returns the command for a target acceleration (m/s^2) at a speed
+    (m/s), clamped to the table's range."""
+    if not self._uniform:
+      row = np.array([np.interp(acceleration, self.accelerations, column)
+                      for column in self.commands.T])
+      return float(np.interp(speed, self.speeds, row))
+
+    # Uniform grids, the cell is found by a division.
+    x = min(max((acceleration - self.accelerations[0]) / self._da, 0.0),
+            len(self.accelerations) - 1.0)
+    y = min(max((speed - self.speeds[0]) / self._dv, 0.0),
+            len(self.speeds) - 1.0)
+    i = min(int(x), len(self.accelerations) - 2)
+    j = min(int(y), len(self.speeds) - 2)
+    x -= i
+    y -= j
+    c = self.commands
+    return float((1 - x) * ((1 - y) * c[i, j] + y * c[i, j + 1]) +
+                 x * ((1 - y) * c[i + 1, j] + y * c[i + 1, j + 1]))
+
+
 class LongitudinalModel:
-  def __init__(self):
-    self.kp = 1.0
-    self.ki = 0.2
-    self.kd = 0.01
+  """Speed controller.
+
+  A PID on the speed error, whose gains are interpolated over speed bands,
+  demands an acceleration, which the feedforward table turns into a
+  throttle or brake command. The integral is not updated while the demanded
+  acceleration is saturated in the direction of the error (anti-windup).
+
+  args:
+      feedforward_table: FeedforwardTable mapping (target acceleration,
+          speed) to a command, FeedforwardTable.from_model() by default.
+      gain_speeds: Speeds (m/s) of the gain schedule.
+      kp, ki, kd: Gains at each of the gain_speeds.
+      min_accel, max_accel: Limits (m/s^2) of the demanded acceleration.
+  """
+
+  def __init__(self, feedforward_table=None,
+               gain_speeds=(0.0, 5.0, 10.0, 20.0),
+               kp=(1.2, 1.0, 0.8, 0.6), ki=(0.3, 0.2, 0.15, 0.1),
+               kd=(0.02, 0.01, 0.01, 0.01), min_accel=-6.0, max_accel=3.0):
+    self.feedforward_table = feedforward_table or FeedforwardTable.from_model()
+    self.gain_speeds = np.asarray(gain_speeds, dtype=float)
+    self.kp = np.asarray(kp, dtype=float)
+    self.ki = np.asarray(ki, dtype=float)
+    self.kd = np.asarray(kd, dtype=float)
+    self.min_accel = min_accel
+    self.max_accel = max_accel
     self.vars = {
         'v_previous': 0.0,
         't_previous': 0.0,
         'error_previous': 0.0,
         'integral_error_previous': 0.0,
-        'throttle_previous': 0.0
+        'throttle_previous': 0.0,
+        'brake_previous': 0.0
     }
 
+  def gains(self, v):
+    """Returns the (kp, ki, kd) gains scheduled at speed v (m/s)."""
+    return (np.interp(v, self.gain_speeds, self.kp),
+            np.interp(v, self.gain_speeds, self.ki),
+            np.interp(v, self.gain_speeds, self.kd))
+
   def compute_control(self, v_desired, v, t):
+    """Computes the throttle and brake commands, both in [0, 1]."""
     st = t - self.vars['t_previous']
     if st <= 0:
       st = 1e-5  # Small threshold to prevent division by zero
 
+    kp, ki, kd = self.gains(v)
     e_v = v_desired - v
-    max_integral = 10.0
-    inte_v = np.clip(self.vars['integral_error_previous'] + e_v * st, -max_integral, max_integral)
-    derivate = (v - self.vars['v_previous']) / st
+    inte_v = self.vars['integral_error_previous'] + e_v * st
+    # Derivative on the measurement, so steps of the desired speed do not
+    # kick the output.
+    derivate = -(v - self.vars['v_previous']) / st
 
-    acc = self.kp * e_v + self.ki * inte_v + self.kd * derivate
+    accel = kp * e_v + ki * inte_v + kd * derivate
+    if not self.min_accel <= accel <= self.max_accel:
+      # Anti-windup: only integrate when it pulls out of saturation.
+      if (accel > self.max_accel) == (e_v > 0):
+        inte_v = self.vars['integral_error_previous']
+        accel = kp * e_v + ki * inte_v + kd * derivate
+      accel = min(max(accel, self.min_accel), self.max_accel)
 
-    throttle_output = (np.tanh(acc) + 1) / 2 if acc > 0 else 0
+    command = self.feedforward_table.lookup(accel, v)
+    throttle_output = max(command, 0.0)
+    brake_output = max(-command, 0.0)
     if throttle_output - self.vars['throttle_previous'] > 0.1:
       throttle_output = self.vars['throttle_previous'] + 0.1
 
@@ -36,5 +183,6 @@ class LongitudinalModel:
     self.vars['error_previous'] = e_v
     self.vars['integral_error_previous'] = inte_v
     self.vars['throttle_previous'] = throttle_output
+    self.vars['brake_previous'] = brake_output
 
-    return throttle_output, 0  # Returning throttle_output and brake_output (not used)
+    return throttle_output, brake_output
@@ -0,0 +1,93 @@
+import numpy as np
+import unittest
+
+from longitudinal_model import FeedforwardTable, LongitudinalModel
+
+
+class FeedforwardTableTest(unittest.TestCase):
+
+  def setUp(self):
+    self.accelerations = np.array([-2.0, 0.0, 2.0])
+    self.speeds = np.array([0.0, 10.0])
+    self.commands = np.array([[-0.5, -0.4],
+                              [0.0, 0.1],
+                              [0.5, 0.7]])
+    self.table = FeedforwardTable(self.accelerations, self.speeds,
+                                  self.commands)
+
+  def test_lookup(self):
+    # Grid points.
+    self.assertAlmostEqual(self.table.lookup(2.0, 10.0), 0.7)
+    self.assertAlmostEqual(self.table.lookup(-2.0, 0.0), -0.5)
+    # Bilinear interpolation.
+    self.assertAlmostEqual(self.table.lookup(1.0, 5.0),
+                           0.25 * (0.0 + 0.1 + 0.5 + 0.7))
+    # Clamped to the range of the table.
+    self.assertAlmostEqual(self.table.lookup(10.0, 50.0), 0.7)
+    self.assertAlmostEqual(self.table.lookup(-10.0, -5.0), -0.5)
+
+  def test_lookup_non_uniform(self):
+    table = FeedforwardTable([-2.0, 0.0, 3.0], self.speeds, self.commands)
+    self.assertAlmostEqual(table.lookup(1.5, 5.0),
+                           0.5 * (0.05 + 0.6))
+
+  def test_fit(self):
+    # Two noisy samples around each grid point of the top and bottom rows.
+    a, v = np.meshgrid(self.accelerations[[0, 2]], self.speeds,
+                       indexing='ij')
+    commands = self.commands[[0, 2]]
+    samples = [(a + 0.1, v - 0.5, commands + 0.01),
+               (a - 0.1, v + 0.5, commands - 0.01)]
+    table = FeedforwardTable.fit(
+        np.concatenate([s[0].ravel() for s in samples]),
+        np.concatenate([s[1].ravel() for s in samples]),
+        np.concatenate([s[2].ravel() for s in samples]),
+        self.accelerations, self.speeds)
+
+    np.testing.assert_allclose(table.commands[[0, 2]], commands)
+    # The row without samples takes the nearest row with samples.
+    np.testing.assert_allclose(table.commands[1], commands[0])
+
+  def test_fit_without_samples(self):
+    with self.assertRaises(ValueError):
+      FeedforwardTable.fit([], [], [], self.accelerations, self.speeds)
+
+
+class LongitudinalModelTest(unittest.TestCase):
+
+  def test_brake(self):
+    model = LongitudinalModel()
+    model.vars['t_previous'] = 0.0
+    model.vars['v_previous'] = 15.0
+    throttle, brake = model.compute_control(5.0, 15.0, 0.1)
+    self.assertEqual(throttle, 0.0)
+    self.assertGreater(brake, 0.0)
+    self.assertLessEqual(brake, 1.0)
+
+  def test_throttle_rate_limit(self):
+    model = LongitudinalModel()
+    throttle, brake = model.compute_control(20.0, 0.0, 0.1)
+    self.assertAlmostEqual(throttle, 0.1)
+    self.assertEqual(brake, 0.0)
+
+  def test_anti_windup(self):
+    model = LongitudinalModel()
+    # A large speed error saturates the demanded acceleration, so the
+    # integral is not accumulated.
+    for k in range(1, 50):
+      model.compute_control(30.0, 0.0, 0.1 * k)
+    self.assertEqual(model.vars['integral_error_previous'], 0.0)
+
+    # Unsaturated, the integral accumulates the speed error.
+    model.compute_control(0.5, 0.0, 5.0)
+    self.assertAlmostEqual(model.vars['integral_error_previous'], 0.05)
+
+  def test_gains(self):
+    model = LongitudinalModel(gain_speeds=(0.0, 10.0), kp=(1.0, 0.5),
+                              ki=(0.2, 0.1), kd=(0.0, 0.0))
+    np.testing.assert_allclose(model.gains(5.0), (0.75, 0.15, 0.0))
+    np.testing.assert_allclose(model.gains(20.0), (0.5, 0.1, 0.0))
+
+
+if __name__ == '__main__':
+  unittest.main()
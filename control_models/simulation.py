@@ -31,7 +31,10 @@ from carla.client import make_carla_client, VehicleControl
 from carla import sensor
 import configparser
 import controller_2d
+from lateral_controllers import make_lateral_controller
 import utils.live_plotter as lv
+from utils.waypoints import densify
+from utils.spline_route import SplineRoute
 
 
 """
@@ -239,6 +242,26 @@ def write_trajectory_file(x_list, y_list, v_list, t_list):
                             (x_list[i], y_list[i], v_list[i], t_list[i]))
 
 
+def write_controller_metrics(controller_name, control_times,
+                             crosstrack_errors):
+  """Writes the CPU time per control update and the crosstrack error of
+  a run, to compare the lateral controllers."""
+  CONTROLLER_OUTPUT_FOLDER = create_controller_output_dir()
+  file_name = os.path.join(CONTROLLER_OUTPUT_FOLDER, 'controller_metrics.txt')
+  control_times = np.asarray(control_times) * 1000.0
+  crosstrack_errors = np.abs(crosstrack_errors)
+
+  with open(file_name, 'w') as metrics_file:
+    metrics_file.write('lateral controller: %s\n' % controller_name)
+    if len(control_times) > 0:
+      metrics_file.write('control time per tick (ms): mean %.4f, max %.4f\n' %
+                         (np.mean(control_times), np.max(control_times)))
+    if len(crosstrack_errors) > 0:
+      metrics_file.write('crosstrack error (m): rms %.4f, max %.4f\n' %
+                         (np.sqrt(np.mean(crosstrack_errors**2)),
+                          np.max(crosstrack_errors)))
+
+
 def exec_waypoint_nav_demo(args):
   """ Executes waypoint navigation demo.
   """
@@ -282,6 +305,12 @@ def exec_waypoint_nav_demo(args):
     enable_live_plot = demo_opt.get('live_plotting', 'true').capitalize()
     enable_live_plot = enable_live_plot == 'True'
     live_plot_period = float(demo_opt.get('live_plotting_period', 0))
+    use_spline_route = config.getboolean('Lateral Controller', 'spline_route',
+                                         fallback=False)
+    lateral_controller_name = config.get('Lateral Controller', 'controller',
+                                         fallback='stanley')
+    lateral_controller_params = dict(config[lateral_controller_name]) \
+        if config.has_section(lateral_controller_name) else {}
 
     # Set options
     live_plot_timer = Timer(live_plot_period)
@@ -317,50 +346,26 @@ def exec_waypoint_nav_demo(args):
 
     # Linear interpolation computations
     # Compute a list of distances between waypoints
-    wp_distance = []   # distance array
-    for i in range(1, waypoints_np.shape[0]):
-      wp_distance.append(
-          np.sqrt((waypoints_np[i, 0] - waypoints_np[i - 1, 0])**2 +
-                  (waypoints_np[i, 1] - waypoints_np[i - 1, 1])**2))
-    wp_distance.append(0)  # last distance is 0 because it is the distance
+    wp_distance = np.append(np.hypot(np.diff(waypoints_np[:, 0]),
+                                     np.diff(waypoints_np[:, 1])), 0)
+    # last distance is 0 because it is the distance
     # from the last waypoint to the last waypoint
 
-    # Linearly interpolate between waypoints and store in a list
-    wp_interp = []    # interpolated values
+    # Linearly interpolate between waypoints. wp_interp_hash is a hash table
+    # which indexes waypoints_np to the index of the waypoint in wp_interp
     # (rows = waypoints, columns = [x, y, v])
-    wp_interp_hash = []    # hash table which indexes waypoints_np
-    # to the index of the waypoint in wp_interp
-    interp_counter = 0     # counter for current interpolated point index
-    for i in range(waypoints_np.shape[0] - 1):
-      # Add original waypoint to interpolated waypoints list (and append
-      # it to the hash table)
-      wp_interp.append(list(waypoints_np[i]))
-      wp_interp_hash.append(interp_counter)
-      interp_counter += 1
-
-      # Interpolate to the next waypoint. First compute the number of
-      # points to interpolate based on the desired resolution and
-      # incrementally add interpolated points until the next waypoint
-      # is about to be reached.
-      num_pts_to_interp = int(np.floor(wp_distance[i] /
-                                       float(INTERP_DISTANCE_RES)) - 1)
-      wp_vector = waypoints_np[i + 1] - waypoints_np[i]
-      wp_uvector = wp_vector / np.linalg.norm(wp_vector)
-      for j in range(num_pts_to_interp):
-        next_wp_vector = INTERP_DISTANCE_RES * float(j + 1) * wp_uvector
-        wp_interp.append(list(waypoints_np[i] + next_wp_vector))
-        interp_counter += 1
-    # add last waypoint at the end
-    wp_interp.append(list(waypoints_np[-1]))
-    wp_interp_hash.append(interp_counter)
-    interp_counter += 1
+    wp_interp, wp_interp_hash = densify(waypoints_np, INTERP_DISTANCE_RES)
 
     #############################################
     # Controller 2D Class Declaration
     #############################################
     # This is where we take the controller2d.py class
     # and apply it to the simulator
-    controller = controller_2d.Controller2D(waypoints)
+    controller = controller_2d.Controller2D(
+        waypoints, make_lateral_controller(lateral_controller_name,
+                                           lateral_controller_params))
+    if use_spline_route:
+      controller.update_route(SplineRoute(waypoints_np))
 
     #############################################
     # Determine simulation average timestep (and total frames)
@@ -412,6 +417,8 @@ def exec_waypoint_nav_demo(args):
     yaw_history = [start_yaw]
     time_history = [0]
     speed_history = [0]
+    control_time_history = []
+    crosstrack_history = []
 
     #############################################
     # Vehicle Trajectory Live Plotting Setup
@@ -599,13 +606,18 @@ def exec_waypoint_nav_demo(args):
       new_waypoints = \
           wp_interp[wp_interp_hash[waypoint_subset_first_index]:
                     wp_interp_hash[waypoint_subset_last_index] + 1]
-      controller.update_waypoints(new_waypoints)
+      controller.update_waypoints(
+          new_waypoints, wp_interp_hash[waypoint_subset_first_index])
 
       # Update the other controller values and controls
       controller.update_values(current_x, current_y, current_yaw,
                                current_speed,
                                current_timestamp, frame)
+      control_start_time = time.perf_counter()
       controller.update_controls()
+      control_time_history.append(time.perf_counter() - control_start_time)
+      if controller._route_state is not None:
+        crosstrack_history.append(controller._route_state.lateral)
       cmd_throttle, cmd_steer, cmd_brake = controller.get_commands()
 
       # Skip the first frame (so the controller has proper outputs)
@@ -680,6 +692,8 @@ def exec_waypoint_nav_demo(args):
     store_trajectory_plot(steer_fig.fig, 'steer_output.png')
     write_trajectory_file(x_history, y_history,
                           speed_history, time_history)
+    write_controller_metrics(lateral_controller_name, control_time_history,
+                             crosstrack_history)
 
 
 def main():
@@ -7,6 +7,8 @@
 
 import numpy as np
 import math
+from route import Route
+from stop_fence_index import StopFenceIndex
 
 
 # State machine states
@@ -17,6 +19,14 @@ STAY_STOPPED = 2
 STOP_THRESHOLD = 0.02
 # Number of cycles before moving from stop sign.
 STOP_COUNTS = 10
+# Lane width (m).
+LANE_WIDTH = 3.5
+# Maximum distance (m) of a lead vehicle from the route, i.e. from the lane
+# center. Vehicles in the adjacent lanes are further away.
+LEAD_VEHICLE_MAX_LANE_OFFSET = 0.5 * LANE_WIDTH
+# Speed (m/s) above which an agent is known to be driving. Agents never seen
+# driving, i.e. parked vehicles, are not followed.
+LEAD_VEHICLE_MIN_SPEED = 0.5
 
 
 # In[ ]:
@@ -26,12 +36,17 @@ class BehaviouralPlanner:
   def __init__(self, lookahead, stopsign_fences, lead_vehicle_lookahead):
     self._lookahead = lookahead
     self._stopsign_fences = stopsign_fences
+    self._stop_fence_index = StopFenceIndex(stopsign_fences)
+    self._first_stop_crossings = None
     self._follow_lead_vehicle_lookahead = lead_vehicle_lookahead
     self._state = FOLLOW_LANE
     self._follow_lead_vehicle = False
+    self._lead_vehicle_id = None
+    self._driving_agent_ids = set()
     self._goal_state = [0.0, 0.0, 0.0]
     self._goal_index = 0
     self._stop_count = 0
+    self._route = None
 
   def set_lookahead(self, lookahead):
     self._lookahead = lookahead
@@ -88,7 +103,7 @@ class BehaviouralPlanner:
     # complete, and examine the check_for_stop_signs() function to
     # understand it.
     if self._state == FOLLOW_LANE:
-      closest_len, closest_index = get_closest_index(waypoints, ego_state)
+      closest_len, closest_index = self.get_closest_index(waypoints, ego_state)
 
       goal_index = self.get_goal_index(waypoints, ego_state, closest_len, closest_index)
 
@@ -120,7 +135,7 @@ class BehaviouralPlanner:
       # You should use the get_closest_index(), get_goal_index(), and
       # check_for_stop_signs() helper functions.
       if self._stop_count == STOP_COUNTS:
-        closest_len, closest_index = get_closest_index(waypoints, ego_state)
+        closest_len, closest_index = self.get_closest_index(waypoints, ego_state)
         goal_index = self.get_goal_index(waypoints, ego_state, closest_len, closest_index)
 
         # We've stopped for the required amount of time, so the new goal
@@ -142,6 +157,25 @@ class BehaviouralPlanner:
     else:
       raise ValueError('Invalid state value.')
 
+  def get_route(self, waypoints):
+    """Returns the Route of the waypoints, which is only built again when
+    a different waypoint list is given.
+    """
+    if self._route is None or self._route.waypoints is not waypoints:
+      self._route = Route(waypoints)
+      self._first_stop_crossings = \
+          self._stop_fence_index.first_crossings(waypoints)
+    return self._route
+
+  def get_closest_index(self, waypoints, ego_state):
+    """Incremental version of get_closest_index().
+
+    Searches around the closest index of the previous call, see
+    WaypointTracker. Arguments and return values are the same as for
+    get_closest_index().
+    """
+    return self.get_route(waypoints).get_closest_index(ego_state[0], ego_state[1])
+
   def get_goal_index(self, waypoints, ego_state, closest_len, closest_index):
     """Gets the goal index for the vehicle. 
 
@@ -176,28 +210,13 @@ class BehaviouralPlanner:
             i.e. waypoints[wp_index] gives the goal waypoint
     """
     # Find the farthest point along the path that is within the
-    # lookahead distance of the ego vehicle.
+    # lookahead distance of the ego vehicle, with a binary search in the
+    # cumulative arc length of the route.
     # Take the distance from the ego vehicle to the closest waypoint into
     # consideration.
-    arc_length = closest_len
-    wp_index = closest_index
-
-    # In this case, reaching the closest waypoint is already far enough for
-    # the planner.  No need to check additional waypoints.
-    if arc_length > self._lookahead:
-      return wp_index
-
-    # We are already at the end of the path.
-    if wp_index == len(waypoints) - 1:
-      return wp_index
-
-    while wp_index < len(waypoints) - 1:
-      wp_index += 1
-      arc_length += math.sqrt((waypoints[wp_index][0] - waypoints[wp_index - 1][0])**2 + (waypoints[wp_index][1] - waypoints[wp_index - 1][1])**2)
-      if arc_length >= self._lookahead:
-        break
-
-    return wp_index
+    return self.get_route(waypoints).lookahead_index(closest_index,
+                                                     closest_len,
+                                                     self._lookahead)
 
   # Checks the given segment of the waypoint list to see if it
   # intersects with a stop line. If any index does, return the
@@ -233,46 +252,15 @@ class BehaviouralPlanner:
                 i.e. waypoints[goal_index] gives the goal waypoint
             stop_sign_found: Boolean flag for whether a stop sign was found or not
     """
-    for i in range(closest_index, goal_index):
-      # Check to see if path segment crosses any of the stop lines.
-      intersect_flag = False
-      for stopsign_fence in self._stopsign_fences:
-        wp_1 = np.array(waypoints[i][0:2])
-        wp_2 = np.array(waypoints[i + 1][0:2])
-        s_1 = np.array(stopsign_fence[0:2])
-        s_2 = np.array(stopsign_fence[2:4])
-
-        v1 = np.subtract(wp_2, wp_1)
-        v2 = np.subtract(s_1, wp_2)
-        sign_1 = np.sign(np.cross(v1, v2))
-        v2 = np.subtract(s_2, wp_2)
-        sign_2 = np.sign(np.cross(v1, v2))
-
-        v1 = np.subtract(s_2, s_1)
-        v2 = np.subtract(wp_1, s_2)
-        sign_3 = np.sign(np.cross(v1, v2))
-        v2 = np.subtract(wp_2, s_2)
-        sign_4 = np.sign(np.cross(v1, v2))
-
-        # Check if the line segments intersect.
-        if (sign_1 != sign_2) and (sign_3 != sign_4):
-          intersect_flag = True
-
-        # Check if the collinearity cases hold.
-        if (sign_1 == 0) and pointOnSegment(wp_1, s_1, wp_2):
-          intersect_flag = True
-        if (sign_2 == 0) and pointOnSegment(wp_1, s_2, wp_2):
-          intersect_flag = True
-        if (sign_3 == 0) and pointOnSegment(s_1, wp_1, s_2):
-          intersect_flag = True
-        if (sign_3 == 0) and pointOnSegment(s_1, wp_2, s_2):
-          intersect_flag = True
-
-        # If there is an intersection with a stop line, update
-        # the goal state to stop before the goal line.
-        if intersect_flag:
-          goal_index = i
-          return goal_index, True
+    # The first stop line crossing along the route from every waypoint is
+    # precomputed, see StopFenceIndex.
+    self.get_route(waypoints)
+    if closest_index < goal_index:
+      stop_index = int(self._first_stop_crossings[closest_index])
+      # If there is an intersection with a stop line, update
+      # the goal state to stop before the goal line.
+      if stop_index < goal_index:
+        return stop_index, True
 
     return goal_index, False
 
@@ -336,6 +324,132 @@ class BehaviouralPlanner:
 
       self._follow_lead_vehicle = False
 
+  def select_lead_vehicle(self, ego_state, agent_positions, agent_speeds=None,
+                          agent_ids=None):
+    """Selects the lead vehicle to follow among all of the other agents.
+
+    Multi-agent version of check_for_lead_vehicle(). The distance, bearing
+    and projection along the ego heading of every agent are computed at
+    once. An agent is followed once it is within the lookahead distance
+    and within +/- 45 degrees of the ego heading, as long as it is in the
+    ego lane, i.e. within LEAD_VEHICLE_MAX_LANE_OFFSET of the route ahead
+    (or of the line along the ego heading before a route is set), and has
+    been seen driving faster than LEAD_VEHICLE_MIN_SPEED, which leaves out
+    parked vehicles. It is followed until it is both more than a 15m buffer
+    past the lookahead distance and out of that field of view, or until it
+    leaves the lane, unless another agent that can be followed is closer
+    ahead. A followed vehicle which stops, e.g. in traffic, is still
+    followed.
+
+    args:
+        ego_state: ego state vector for the vehicle. (global frame)
+            format: [ego_x, ego_y, ego_yaw, ego_open_loop_speed]
+                ego_x and ego_y     : position (m)
+                ego_yaw             : top-down orientation [-pi to pi]
+                ego_open_loop_speed : open loop speed (m/s)
+        agent_positions: The [x, y] positions of the other agents, as a
+            list or an array of shape (K, 2).
+            Lengths are in meters, and it is in the global frame.
+        agent_speeds: Optional speeds (m/s) of the other agents. Without
+            them, every agent is assumed to be driving.
+        agent_ids: Optional ids identifying the agents across calls.
+            Defaults to their index in agent_positions.
+    sets:
+        self._follow_lead_vehicle: Boolean flag on whether the ego vehicle
+            should follow (true) the lead car or not (false).
+        self._lead_vehicle_id: id of the followed agent, or None.
+    returns:
+        lead_car_state: the followed lead vehicle state, or None.
+            Format: [lead_car_x, lead_car_y, lead_car_speed]
+    """
+    positions = np.asarray(agent_positions, dtype=float).reshape(-1, 2)
+    if agent_ids is None:
+      agent_ids = range(len(positions))
+    agent_ids = list(agent_ids)
+
+    # Relative geometry of every agent with respect to the ego vehicle.
+    delta = positions - (ego_state[0], ego_state[1])
+    distance = np.hypot(delta[:, 0], delta[:, 1])
+    along = delta[:, 0] * math.cos(ego_state[2]) + \
+        delta[:, 1] * math.sin(ego_state[2])
+    bearing = np.ones(len(positions))
+    np.divide(along, distance, out=bearing, where=distance > 0)
+
+    in_lane = self._lane_offsets(ego_state, positions, delta) <= \
+        LEAD_VEHICLE_MAX_LANE_OFFSET
+
+    if agent_speeds is None:
+      driving = np.ones(len(positions), dtype=bool)
+    else:
+      self._driving_agent_ids.update(
+          agent_ids[i] for i in np.flatnonzero(
+              np.abs(agent_speeds) > LEAD_VEHICLE_MIN_SPEED))
+      driving = np.array([agent_id in self._driving_agent_ids
+                          for agent_id in agent_ids], dtype=bool)
+
+    in_view = bearing >= 1 / math.sqrt(2)
+    candidates = in_view & in_lane & driving & \
+        (distance <= self._follow_lead_vehicle_lookahead)
+    # Add a 15m buffer to prevent oscillations for the distance check.
+    kept = in_lane & ((bearing > 1 / math.sqrt(2)) |
+                      (distance < self._follow_lead_vehicle_lookahead + 15))
+
+    lead_index = None
+    if self._follow_lead_vehicle and self._lead_vehicle_id in agent_ids:
+      index = agent_ids.index(self._lead_vehicle_id)
+      if kept[index]:
+        lead_index = index
+    # Switch to the closest agent ahead that can be followed, if it is
+    # closer than the one followed so far.
+    if np.any(candidates):
+      closest = int(np.flatnonzero(candidates)[np.argmin(along[candidates])])
+      if lead_index is None or along[closest] < along[lead_index]:
+        lead_index = closest
+
+    self._follow_lead_vehicle = lead_index is not None
+    if lead_index is None:
+      self._lead_vehicle_id = None
+      return None
+    self._lead_vehicle_id = agent_ids[lead_index]
+    lead_car_speed = 0.0 if agent_speeds is None else agent_speeds[lead_index]
+    return [float(positions[lead_index, 0]), float(positions[lead_index, 1]),
+            lead_car_speed]
+
+  def _lane_offsets(self, ego_state, positions, delta):
+    # Distance of each agent from the route ahead of the ego vehicle, up to
+    # the lead vehicle lookahead and its buffer, or from the line along the
+    # ego heading if there is no route yet.
+    if self._route is None or len(self._route) < 2:
+      return np.abs(delta[:, 1] * math.cos(ego_state[2]) -
+                    delta[:, 0] * math.sin(ego_state[2]))
+    closest_len, closest_index = self._route.get_closest_index(ego_state[0],
+                                                               ego_state[1])
+    last_index = self._route.lookahead_index(
+        closest_index, closest_len, self._follow_lead_vehicle_lookahead + 15)
+    first_index = max(closest_index - 1, 0)
+    last_index = max(last_index, first_index + 1)
+    points = np.asarray(self._route.waypoints[first_index:last_index + 1],
+                        dtype=float)[:, :2]
+    return distance_to_polyline(positions, points)
+
+
+def distance_to_polyline(points, polyline):
+  """Distance from each point to the closest segment of a polyline.
+
+  args:
+      points: Array of shape (K, 2) of [x, y] points.
+      polyline: Array of shape (N, 2) of the polyline vertices, N >= 2.
+  returns:
+      distances: Array of shape (K,) of the distances.
+  """
+  start = polyline[:-1]
+  segment = polyline[1:] - start
+  length_sq = np.maximum(np.sum(segment**2, axis=1), 1e-12)
+  offset = points[:, None, :] - start[None, :, :]
+  ratio = np.clip(np.sum(offset * segment, axis=2) / length_sq, 0.0, 1.0)
+  closest = offset - ratio[:, :, None] * segment
+  return np.min(np.hypot(closest[:, :, 0], closest[:, :, 1]), axis=1)
+
 
 def get_closest_index(waypoints, ego_state):
   """Gets closest index a given list of waypoints to the vehicle position.
@@ -366,18 +480,15 @@ def get_closest_index(waypoints, ego_state):
           closest_index: index of the waypoint which is closest to the vehicle.
               i.e. waypoints[closest_index] gives the waypoint closest to the vehicle.
   """
-  closest_len = float('Inf')
-  closest_index = 0
-
-  for i in range(len(waypoints)):
-
-    dist = math.sqrt((ego_state[0] - waypoints[i][0])**2 + (ego_state[1] - waypoints[i][1])**2)
+  if len(waypoints) == 0:
+    return float('Inf'), 0
 
-    if dist <= closest_len:
-      closest_len = dist
-      closest_index = i
+  points = np.asarray(waypoints, dtype=float)[:, :2]
+  dists = np.hypot(points[:, 0] - ego_state[0], points[:, 1] - ego_state[1])
+  # Ties go to the last waypoint.
+  closest_index = len(dists) - 1 - int(np.argmin(dists[::-1]))
 
-  return closest_len, closest_index
+  return float(dists[closest_index]), closest_index
 
 # Checks if p2 lies on segment p1-p3, if p1, p2, p3 are collinear.
 
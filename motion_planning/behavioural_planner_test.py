@@ -0,0 +1,76 @@
+import numpy as np
+import unittest
+
+import behavioural_planner
+
+
+class SelectLeadVehicleTest(unittest.TestCase):
+
+  def setUp(self):
+    self.bp = behavioural_planner.BehaviouralPlanner(8.0, [], 20.0)
+    self.ego_state = [0.0, 0.0, 0.0, 5.0]
+
+  def test_closest_in_lane_vehicle(self):
+    lead_car_state = self.bp.select_lead_vehicle(
+        self.ego_state, [[15.0, 0.3], [10.0, 0.0]], [4.0, 3.0], ['a', 'b'])
+    self.assertEqual(lead_car_state, [10.0, 0.0, 3.0])
+    self.assertEqual(self.bp._lead_vehicle_id, 'b')
+    self.assertTrue(self.bp._follow_lead_vehicle)
+
+  def test_adjacent_lane_vehicle(self):
+    # A closer vehicle in the adjacent lane is not followed.
+    lead_car_state = self.bp.select_lead_vehicle(
+        self.ego_state, [[8.0, 3.5], [15.0, 0.0]], [0.0, 4.0])
+    self.assertEqual(lead_car_state, [15.0, 0.0, 4.0])
+
+    lead_car_state = self.bp.select_lead_vehicle(
+        self.ego_state, [[8.0, 3.5], [12.0, -3.5]], [0.0, 0.0])
+    self.assertIsNone(lead_car_state)
+    self.assertFalse(self.bp._follow_lead_vehicle)
+
+  def test_lead_vehicle_leaves_lane(self):
+    self.bp.select_lead_vehicle(self.ego_state, [[10.0, 0.0]], [3.0], [7])
+    self.assertEqual(self.bp._lead_vehicle_id, 7)
+    lead_car_state = self.bp.select_lead_vehicle(self.ego_state,
+                                                 [[10.0, 3.5]], [3.0], [7])
+    self.assertIsNone(lead_car_state)
+
+  def test_lead_vehicle_off_center(self):
+    # A lead vehicle drifting towards the edge of the lane is still followed.
+    for y in [0.0, 0.8, 1.3, 0.8, 0.0]:
+      lead_car_state = self.bp.select_lead_vehicle(self.ego_state,
+                                                   [[12.0, y]], [4.0], [7])
+      self.assertEqual(lead_car_state, [12.0, y, 4.0])
+
+  def test_parked_vehicle(self):
+    # A vehicle parked on the edge of the lane is not followed, unlike one
+    # which stops after driving.
+    for speed in [0.0, 0.0, 0.0]:
+      lead_car_state = self.bp.select_lead_vehicle(
+          self.ego_state, [[10.0, 1.2], [18.0, 0.0]], [0.0, speed], [3, 7])
+      self.assertIsNone(lead_car_state)
+    for speed in [4.0, 2.0, 0.0]:
+      lead_car_state = self.bp.select_lead_vehicle(
+          self.ego_state, [[10.0, 1.2], [18.0, 0.0]], [0.0, speed], [3, 7])
+      self.assertEqual(lead_car_state, [18.0, 0.0, speed])
+      self.assertEqual(self.bp._lead_vehicle_id, 7)
+
+  def test_curved_route(self):
+    # A left turn of radius 30 m, the ego vehicle at its start.
+    angles = np.linspace(0.0, np.pi / 2, 50)
+    waypoints = np.column_stack((30.0 * np.sin(angles),
+                                 30.0 - 30.0 * np.cos(angles),
+                                 np.full(50, 5.0))).tolist()
+    self.bp.get_route(waypoints)
+
+    # Along the route, a vehicle 18 m ahead is 5 m left of the ego heading.
+    on_route = [30.0 * np.sin(0.6), 30.0 - 30.0 * np.cos(0.6)]
+    outside = [33.5 * np.sin(0.5), 30.0 - 33.5 * np.cos(0.5)]
+    lead_car_state = self.bp.select_lead_vehicle(
+        self.ego_state, [outside, on_route], [0.0, 4.0])
+    self.assertAlmostEqual(lead_car_state[0], on_route[0])
+    self.assertEqual(lead_car_state[2], 4.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
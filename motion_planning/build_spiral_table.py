@@ -0,0 +1,50 @@
+"""
+Builds the precomputed spiral lookup table used by the local planner.
+
+Optimizes a spiral to every node of a regular (xf, yf, tf) goal grid in the
+vehicle frame and stores the resulting parameters as a .npy file that
+PathOptimizer memory-maps at run time (see path_optimizer.SpiralTable).
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import time
+
+from path_optimizer import SpiralTable
+
+
+def main():
+  argparser = argparse.ArgumentParser(description=__doc__)
+  argparser.add_argument(
+      '-o', '--output',
+      metavar='PATH',
+      default=os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           'params', 'spiral_table.npy'),
+      help='output table file (default: params/spiral_table.npy)')
+  argparser.add_argument(
+      '--x-range',
+      nargs=3, type=float, metavar=('MIN', 'MAX', 'COUNT'),
+      default=[1.0, 40.0, 40],
+      help='xf grid axis in m (default: 1 40 40)')
+  argparser.add_argument(
+      '--y-range',
+      nargs=3, type=float, metavar=('MIN', 'MAX', 'COUNT'),
+      default=[-12.0, 12.0, 49],
+      help='yf grid axis in m (default: -12 12 49)')
+  argparser.add_argument(
+      '--t-range',
+      nargs=3, type=float, metavar=('MIN', 'MAX', 'COUNT'),
+      default=[-1.5, 1.5, 31],
+      help='tf grid axis in rad (default: -1.5 1.5 31)')
+  args = argparser.parse_args()
+
+  start = time.time()
+  table = SpiralTable.build(args.x_range, args.y_range, args.t_range)
+  table.save(args.output)
+  print('Saved spiral table to %s in %.1f s' % (args.output, time.time() - start))
+
+
+if __name__ == '__main__':
+  main()
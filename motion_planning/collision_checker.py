@@ -6,21 +6,84 @@
 # Date: October 29, 2018
 
 import numpy as np
-from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 from math import sin, cos, pi, sqrt
+from path_set import PathSet
+
+
+class ObstacleIndex:
+  """KD-tree over the border points of a set of obstacles.
+
+  Built once per planning cycle and shared by the collision checks of every
+  candidate path, so that each circle only needs a nearest-neighbour lookup
+  bounded by its radius instead of distances to all obstacle points.
+  """
+
+  def __init__(self, obstacles):
+    obstacle_pts = [np.asarray(obstacle, dtype=float).reshape(-1, 2)
+                    for obstacle in obstacles]
+    obstacle_pts = [pts for pts in obstacle_pts if pts.shape[0] > 0]
+    if obstacle_pts:
+      self._points = np.concatenate(obstacle_pts)
+    else:
+      self._points = np.zeros((0, 2))
+    self._tree = cKDTree(self._points) if len(self._points) > 0 else None
+
+    # Axis-aligned bounding box [x_min, y_min, x_max, y_max] of each
+    # obstacle, used as the broad phase of the collision check.
+    self._boxes = np.array([np.concatenate((pts.min(axis=0), pts.max(axis=0)))
+                            for pts in obstacle_pts]).reshape(-1, 4)
+
+  def __len__(self):
+    return self._points.shape[0]
+
+  def overlaps(self, boxes):
+    """Returns which boxes overlap the bounding box of any obstacle.
+
+    args:
+        boxes: Array of shape (N, 4) of [x_min, y_min, x_max, y_max] boxes.
+    returns:
+        overlap: Boolean array of shape (N,).
+    """
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    overlap = (boxes[:, None, 0] <= self._boxes[None, :, 2]) & \
+              (boxes[:, None, 2] >= self._boxes[None, :, 0]) & \
+              (boxes[:, None, 1] <= self._boxes[None, :, 3]) & \
+              (boxes[:, None, 3] >= self._boxes[None, :, 1])
+    return np.any(overlap, axis=1)
+
+  def any_within(self, centers, radii):
+    """Returns whether any obstacle point lies strictly inside each circle.
+
+    args:
+        centers: Array of circle centers of shape (..., C, 2).
+        radii: Array of the C circle radii.
+    returns:
+        inside: Boolean array of shape (..., C).
+    """
+    radii = np.broadcast_to(np.asarray(radii, dtype=float), centers.shape[:-1])
+    if self._tree is None:
+      return np.zeros(centers.shape[:-1], dtype=bool)
+    dists, _ = self._tree.query(centers, k=1,
+                                distance_upper_bound=float(np.max(radii)))
+    return dists < radii
 
 
 class CollisionChecker:
-  def __init__(self, circle_offsets, circle_radii, weight):
+  def __init__(self, circle_offsets, circle_radii, weight, score_terms=()):
     self._circle_offsets = circle_offsets
     self._circle_radii = circle_radii
     self._weight = weight
+    # Additional path selection score terms, as a list of (weight, term)
+    # pairs. A term is called as term(paths, goal_state, prev_best_path)
+    # and returns one score per path.
+    self._score_terms = list(score_terms)
 
   def collision_check(self, paths, obstacles):
     """Returns a bool array on whether each path is collision free.
 
     args:
-        paths: A list of paths in the global frame.  
+        paths: A PathSet or a list of paths in the global frame.  
             A path is a list of points of the following format:
                 [x_points, y_points, t_points]:
                     x_points: List of x values (m)
@@ -28,13 +91,17 @@ class CollisionChecker:
                     t_points: List of yaw values (rad)
                 Example of accessing the ith path, jth point's t value:
                     paths[i][2][j]
-        obstacles: A list of [x, y] points that represent points along the
-            border of obstacles, in the global frame.
-            Format: [[x0, y0],
-                     [x1, y1],
-                     ...,
-                     [xn, yn]]
+            Invalid paths of a PathSet are reported as not collision-free.
+        obstacles: A list of obstacles, each given as a list of [x, y]
+            points that represent points along the border of the obstacle,
+            in the global frame.
+            Format: [[[x0, y0],
+                      [x1, y1],
+                      ...,
+                      [xn, yn]], ...]
             , where n is the number of obstacle points and units are [m, m]
+            An ObstacleIndex from build_obstacle_index() may be passed
+            instead, to reuse it across calls.
 
     returns:
         collision_check_array: A list of boolean values which classifies
@@ -42,59 +109,82 @@ class CollisionChecker:
             ith index in the collision_check_array list corresponds to the
             ith path in the paths list.
     """
-    collision_check_array = np.zeros(len(paths), dtype=bool)
-    for i in range(len(paths)):
-      collision_free = True
-      path = paths[i]
-
-      # Iterate over the points in the path.
-      for j in range(len(path[0])):
-        # Compute the circle locations along this point in the path.
-        # These circle represent an approximate collision
-        # border for the vehicle, which will be used to check
-        # for any potential collisions along each path with obstacles.
-
-        # The circle offsets are given by self._circle_offsets.
-        # The circle offsets need to placed at each point along the path,
-        # with the offset rotated by the yaw of the vehicle.
-        # Each path is of the form [[x_values], [y_values],
-        # [theta_values]], where each of x_values, y_values, and
-        # theta_values are in sequential order.
-
-        # Thus, we need to compute:
-        # circle_x = point_x + circle_offset*cos(yaw)
-        # circle_y = point_y circle_offset*sin(yaw)
-        # for each point along the path.
-        # point_x is given by path[0][j], and point _y is given by
-        # path[1][j].
-        circle_locations = np.zeros((len(self._circle_offsets), 2))
-
-        circle_locations[:, 0] = [i * int(cos(path[2][j])) for i in self._circle_offsets] + path[0][j]
-        circle_locations[:, 1] = [i * int(sin(path[2][j])) for i in self._circle_offsets] + path[1][j]
-
-        # Assumes each obstacle is approximated by a collection of
-        # points of the form [x, y].
-        # Here, we will iterate through the obstacle points, and check
-        # if any of the obstacle points lies within any of our circles.
-        # If so, then the path will collide with an obstacle and
-        # the collision_free flag should be set to false for this flag
-        for k in range(len(obstacles)):
-          collision_dists = cdist(obstacles[k],
-                                  circle_locations)
-          collision_dists = np.subtract(collision_dists,
-                                        self._circle_radii)
-          collision_free = collision_free and not np.any(collision_dists < 0)
-
-          if not collision_free:
-            break
-        if not collision_free:
-          break
-
-      collision_check_array[i] = collision_free
+    if isinstance(paths, PathSet):
+      collision_check_array = paths.valid.copy()
+    else:
+      collision_check_array = np.ones(len(paths), dtype=bool)
+    if not isinstance(obstacles, ObstacleIndex):
+      obstacles = ObstacleIndex(obstacles)
+    if len(paths) == 0 or len(obstacles) == 0:
+      return collision_check_array
+
+    # Flatten every point of every path into one (P, 3) array, remembering
+    # which path each point belongs to.
+    if isinstance(paths, PathSet):
+      path_lengths = np.full(len(paths), paths.num_points)
+      path_points = paths.paths.transpose(0, 2, 1).reshape(-1, 3)
+    else:
+      path_lengths = np.array([len(path[0]) for path in paths])
+      path_points = np.concatenate([np.asarray(path, dtype=float).reshape(3, -1).T
+                                    for path in paths])
+    path_index = np.repeat(np.arange(len(paths)), path_lengths)
+
+    # Place the circle offsets at each point along the paths, rotated by
+    # the yaw of the vehicle at that point:
+    #   circle_x = point_x + circle_offset*cos(yaw)
+    #   circle_y = point_y + circle_offset*sin(yaw)
+    # The trig terms are truncated towards zero, as they always have been,
+    # so that the result matches the original per-point implementation.
+    # The circle locations are of shape (P, C, 2).
+    offsets = np.asarray(self._circle_offsets, dtype=float)
+    circle_locations = np.empty((path_points.shape[0], offsets.shape[0], 2))
+    circle_locations[:, :, 0] = path_points[:, 0:1] + \
+        offsets * np.trunc(np.cos(path_points[:, 2:3]))
+    circle_locations[:, :, 1] = path_points[:, 1:2] + \
+        offsets * np.trunc(np.sin(path_points[:, 2:3]))
+
+    # Broad phase: bound the circles of each path by a box inflated by the
+    # circle radii. Only paths whose box overlaps the box of an obstacle
+    # can collide, so the others are free without further checks.
+    starts = np.cumsum(path_lengths) - path_lengths
+    nonempty = np.flatnonzero(path_lengths)
+    lower = np.minimum.reduceat(circle_locations.min(axis=1), starts[nonempty])
+    upper = np.maximum.reduceat(circle_locations.max(axis=1), starts[nonempty])
+    max_radius = float(np.max(self._circle_radii))
+    path_boxes = np.hstack((lower - max_radius, upper + max_radius))
+    candidates = np.zeros(len(paths), dtype=bool)
+    candidates[nonempty] = obstacles.overlaps(path_boxes)
+    candidates &= collision_check_array
+    if not np.any(candidates):
+      return collision_check_array
+
+    # Narrow phase: a point collides if any obstacle point lies within any
+    # of its circles.
+    narrow = candidates[path_index]
+    point_collides = np.zeros(path_points.shape[0], dtype=bool)
+    point_collides[narrow] = np.any(
+        obstacles.any_within(circle_locations[narrow], self._circle_radii),
+        axis=1)
+
+    # A path is collision-free if none of its points collide.
+    collisions = np.bincount(path_index, weights=point_collides,
+                             minlength=len(paths))
+    collision_check_array &= collisions == 0
 
     return collision_check_array
 
-  def select_best_path_index(self, paths, collision_check_array, goal_state):
+  def build_obstacle_index(self, obstacles):
+    """Builds an ObstacleIndex to be reused by collision_check() calls.
+
+    args:
+        obstacles: A list of obstacles in the format of collision_check().
+    returns:
+        obstacle_index: An ObstacleIndex over all of the obstacle points.
+    """
+    return ObstacleIndex(obstacles)
+
+  def select_best_path_index(self, paths, collision_check_array, goal_state,
+                             prev_best_path=None):
     """Returns the path index which is best suited for the vehicle to
     traverse.
 
@@ -102,7 +192,7 @@ class CollisionChecker:
     away from collision paths.
 
     args:
-        paths: A list of paths in the global frame.  
+        paths: A PathSet or a list of paths in the global frame.  
             A path is a list of points of the following format:
                 [x_points, y_points, t_points]:
                     x_points: List of x values (m)
@@ -110,43 +200,90 @@ class CollisionChecker:
                     t_points: List of yaw values (rad)
                 Example of accessing the ith path, jth point's t value:
                     paths[i][2][j]
+            Invalid paths of a PathSet are never selected.
         collision_check_array: A list of boolean values which classifies
             whether the path is collision-free (true), or not (false). The
             ith index in the collision_check_array list corresponds to the
             ith path in the paths list.
         goal_state: Goal state for the vehicle to reach (centerline goal).
             format: [x_goal, y_goal, v_goal], unit: [m, m, m/s]
+        prev_best_path: The best path of the previous planning cycle, in
+            the same format as a path in paths, or None. Only used by
+            score terms that depend on it.
     useful variables:
         self._weight: Weight that is multiplied to the best index score.
+        self._score_terms: Additional (weight, term) score terms, see
+            curvature_score(), lateral_offset_score() and
+            prev_path_score().
     returns:
         best_index: The path index which is best suited for the vehicle to
             navigate with.
     """
-    best_index = None
-    best_score = float('Inf')
-    for i in range(len(paths)):
-      # Handle the case of collision-free paths.
-      if collision_check_array[i]:
-
-        score = sqrt((goal_state[0] - paths[i][0][-1])**2 + (goal_state[1] - paths[i][1][-1])**2)
-
-        # Compute the "proximity to other colliding paths" score and
-        # add it to the "distance from centerline" score.
-        # The exact choice of objective function is up to you.
-        for j in range(len(paths)):
-          if j == i:
-            continue
-          else:
-            if not collision_check_array[j]:
-              score += self._weight * sqrt((paths[j][0][-1] - paths[i][0][-1])**2 + (paths[j][0][-1] - paths[i][1][-1])**2)
-
-      # Handle the case of colliding paths.
-      else:
-        score = float('Inf')
-
-      # Set the best index to be the path index with the lowest score
-      if score < best_score:
-        best_score = score
-        best_index = i
-
-    return best_index
+    if len(paths) == 0:
+      return None
+    collision_free = np.asarray(collision_check_array, dtype=bool)
+    # Invalid paths are left out of every score term, as if they were not
+    # in the set.
+    if isinstance(paths, PathSet):
+      valid = paths.valid
+      endpoints = paths.endpoints()[valid, :2]
+      valid_paths = paths.paths[valid]
+    else:
+      valid = np.ones(len(paths), dtype=bool)
+      endpoints = np.array([[path[0][-1], path[1][-1]] for path in paths],
+                           dtype=float)
+      valid_paths = paths
+    collision_free = collision_free[valid]
+    if not np.any(collision_free):
+      return None
+
+    # Distance from the centerline goal.
+    score = np.hypot(goal_state[0] - endpoints[:, 0],
+                     goal_state[1] - endpoints[:, 1])
+
+    # Add the "proximity to other colliding paths" score, computed from the
+    # pairwise endpoint distance matrix.
+    deltas = endpoints[:, None, :] - endpoints[None, :, :]
+    endpoint_dists = np.hypot(deltas[:, :, 0], deltas[:, :, 1])
+    score += self._weight * endpoint_dists[:, ~collision_free].sum(axis=1)
+
+    for weight, term in self._score_terms:
+      score += weight * term(valid_paths, goal_state, prev_best_path)
+
+    # Colliding paths are never selected.
+    score[~collision_free] = np.inf
+    return int(np.flatnonzero(valid)[np.argmin(score)])
+
+
+def curvature_score(paths, goal_state, prev_best_path):
+  """Score term penalizing the mean absolute curvature of each path.
+
+  This and the other score terms expect every path to have the same number
+  of points, as the paths from LocalPlanner.plan_paths() do.
+  """
+  paths = np.asarray(paths, dtype=float)
+  arc_length = np.sum(np.hypot(np.diff(paths[:, 0], axis=1),
+                               np.diff(paths[:, 1], axis=1)), axis=1)
+  turning = np.sum(np.abs(np.diff(np.unwrap(paths[:, 2], axis=1), axis=1)),
+                   axis=1)
+  return turning / np.maximum(arc_length, 1e-6)
+
+
+def lateral_offset_score(paths, goal_state, prev_best_path):
+  """Score term penalizing the lateral offset of each path's endpoint from
+  the goal, measured perpendicular to the path's final heading."""
+  ends = np.asarray(paths, dtype=float)[:, :, -1]
+  return np.abs(-(ends[:, 0] - goal_state[0]) * np.sin(ends[:, 2]) +
+                (ends[:, 1] - goal_state[1]) * np.cos(ends[:, 2]))
+
+
+def prev_path_score(paths, goal_state, prev_best_path):
+  """Score term penalizing the mean distance between each path and the
+  previous best path, sampled at the same relative positions."""
+  paths = np.asarray(paths, dtype=float)
+  if prev_best_path is None or len(prev_best_path[0]) == 0:
+    return np.zeros(paths.shape[0])
+  prev = np.asarray(prev_best_path, dtype=float)
+  idx = np.linspace(0, prev.shape[1] - 1, paths.shape[2]).astype(int)
+  return np.mean(np.hypot(paths[:, 0] - prev[0, idx],
+                          paths[:, 1] - prev[1, idx]), axis=1)
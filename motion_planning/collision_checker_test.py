@@ -0,0 +1,136 @@
+import numpy as np
+import unittest
+
+import collision_checker
+import path_set
+
+
+class CollisionCheckerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.checker = collision_checker.CollisionChecker([-1.0, 1.0, 3.0],
+                                                      [1.5, 1.5, 1.5],
+                                                      10)
+
+  def straight_path(self, y, yaw=0.0, num_points=50):
+    x_points = np.linspace(0.0, 20.0, num_points)
+    return [x_points, np.full(num_points, y), np.full(num_points, yaw)]
+
+  def test_collision_check(self):
+    paths = [self.straight_path(-6.0),
+             self.straight_path(0.0),
+             self.straight_path(6.0)]
+    # A box of obstacle points straddling the middle path.
+    obstacles = [[[10.0, -1.0], [10.0, 1.0], [12.0, -1.0], [12.0, 1.0]]]
+
+    collision_check_array = self.checker.collision_check(paths, obstacles)
+
+    np.testing.assert_array_equal(collision_check_array,
+                                  [True, False, True])
+
+  def test_collision_check_multiple_obstacles(self):
+    paths = [self.straight_path(-6.0),
+             self.straight_path(0.0),
+             self.straight_path(6.0)]
+    obstacles = [np.array([[5.0, -6.5]]), np.array([[15.0, 5.5]])]
+
+    collision_check_array = self.checker.collision_check(paths, obstacles)
+
+    np.testing.assert_array_equal(collision_check_array,
+                                  [False, True, False])
+
+  def test_collision_check_circle_offsets(self):
+    # Only the forward circle (offset 3 m) reaches past the path end.
+    paths = [self.straight_path(0.0)]
+    obstacles = [[[24.0, 0.0]]]
+    self.assertFalse(self.checker.collision_check(paths, obstacles)[0])
+
+    obstacles = [[[24.6, 0.0]]]
+    self.assertTrue(self.checker.collision_check(paths, obstacles)[0])
+
+  def test_collision_check_obstacle_index(self):
+    paths = [self.straight_path(-6.0),
+             self.straight_path(0.0),
+             self.straight_path(6.0)]
+    obstacles = [np.array([[5.0, -6.5]]), np.array([[15.0, 5.5]])]
+    obstacle_index = self.checker.build_obstacle_index(obstacles)
+
+    np.testing.assert_array_equal(
+        self.checker.collision_check(paths, obstacle_index),
+        self.checker.collision_check(paths, obstacles))
+    np.testing.assert_array_equal(
+        self.checker.collision_check(paths[1:], obstacle_index),
+        [True, False])
+
+  def test_collision_check_broad_phase(self):
+    # The obstacle is outside the path's box, but within reach of a circle
+    # placed at its last point.
+    paths = [self.straight_path(0.0), self.straight_path(20.0)]
+    obstacles = [[[23.0, 1.4]], [[100.0, 100.0], [101.0, 101.0]]]
+
+    np.testing.assert_array_equal(
+        self.checker.collision_check(paths, obstacles), [False, True])
+
+  def test_collision_check_no_obstacles(self):
+    paths = [self.straight_path(0.0), self.straight_path(3.0)]
+
+    np.testing.assert_array_equal(self.checker.collision_check(paths, []),
+                                  [True, True])
+    np.testing.assert_array_equal(self.checker.collision_check(paths, [[]]),
+                                  [True, True])
+
+  def test_select_best_path_index(self):
+    paths = [self.straight_path(y) for y in (-3.0, -1.5, 0.0, 1.5, 3.0)]
+    goal_state = [20.0, 0.0, 10.0]
+
+    best_index = self.checker.select_best_path_index(
+        paths, [True, True, True, True, True], goal_state)
+    self.assertEqual(best_index, 2)
+
+    # Colliding paths are never selected.
+    best_index = self.checker.select_best_path_index(
+        paths, [True, True, False, True, True], goal_state)
+    self.assertIn(best_index, (1, 3))
+
+    best_index = self.checker.select_best_path_index(
+        paths, [False, False, False, False, False], goal_state)
+    self.assertIsNone(best_index)
+
+  def test_select_best_path_index_invalid_paths(self):
+    ys = [-3.0, -2.0, -1.0, 0.0, 1.0, 2.0, 40.0]
+    paths = path_set.PathSet([self.straight_path(y) for y in ys],
+                             [True] * 6 + [False])
+    goal_state = [20.0, 0.5, 10.0]
+
+    # The invalid path neither attracts nor repels the selection.
+    best_index = self.checker.select_best_path_index(
+        paths, [True] * 7, goal_state)
+    self.assertEqual(best_index, 3)
+
+    # Indices still refer to the full set.
+    paths.valid[:4] = False
+    best_index = self.checker.select_best_path_index(
+        paths, [True] * 7, goal_state)
+    self.assertEqual(best_index, 4)
+
+  def test_select_best_path_index_score_terms(self):
+    checker = collision_checker.CollisionChecker(
+        [-1.0, 1.0, 3.0], [1.5, 1.5, 1.5], 10,
+        [(100.0, collision_checker.prev_path_score)])
+    paths = [self.straight_path(y) for y in (-1.5, 0.0, 1.5)]
+    goal_state = [20.0, 0.0, 10.0]
+
+    best_index = checker.select_best_path_index(
+        paths, [True, True, True], goal_state, prev_best_path=paths[2])
+    self.assertEqual(best_index, 2)
+
+    np.testing.assert_allclose(
+        collision_checker.lateral_offset_score(paths, goal_state, None),
+        [1.5, 0.0, 1.5])
+    np.testing.assert_allclose(
+        collision_checker.curvature_score(paths, goal_state, None),
+        [0.0, 0.0, 0.0])
+
+
+if __name__ == '__main__':
+  unittest.main()
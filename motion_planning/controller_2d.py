@@ -4,6 +4,7 @@
 import numpy as np
 
 from utils.cutils import CUtils
+from route import Route
 
 
 class Controller2D(object):
@@ -22,6 +23,7 @@ class Controller2D(object):
     self._set_brake = 0
     self._set_steer = 0
     self._waypoints = waypoints
+    self._route = Route(waypoints)
     self._conv_rad_to_steer = 180.0 / 70.0 / np.pi
     self._pi = np.pi
     self._2pi = 2.0 * np.pi
@@ -37,42 +39,19 @@ class Controller2D(object):
       self._start_control_loop = True
 
   def get_lookahead_index(self, lookahead_distance):
-    min_idx = 0
-    min_dist = float("inf")
-    for i in range(len(self._waypoints)):
-      dist = np.linalg.norm(np.array([
-          self._waypoints[i][0] - self._current_x,
-          self._waypoints[i][1] - self._current_y]))
-      if dist < min_dist:
-        min_dist = dist
-        min_idx = i
-
-    total_dist = min_dist
-    lookahead_idx = min_idx
-    for i in range(min_idx + 1, len(self._waypoints)):
-      if total_dist >= lookahead_distance:
-        break
-      total_dist += np.linalg.norm(np.array([
-          self._waypoints[i][0] - self._waypoints[i - 1][0],
-          self._waypoints[i][1] - self._waypoints[i - 1][1]]))
-      lookahead_idx = i
-    return lookahead_idx
+    min_dist, min_idx = self._route.get_closest_index(self._current_x,
+                                                     self._current_y)
+    return self._route.lookahead_index(min_idx, min_dist, lookahead_distance)
 
   def update_desired_speed(self):
-    min_idx = 0
-    min_dist = float("inf")
-    desired_speed = 0
-    for i in range(len(self._waypoints)):
-      dist = np.linalg.norm(np.array([
-          self._waypoints[i][0] - self._current_x,
-          self._waypoints[i][1] - self._current_y]))
-      if dist < min_dist:
-        min_dist = dist
-        min_idx = i
+    min_idx = self._route.get_closest_index(self._current_x,
+                                            self._current_y)[1]
     self._desired_speed = self._waypoints[min_idx][2]
 
   def update_waypoints(self, new_waypoints):
     self._waypoints = new_waypoints
+    # Each new local path starts at the vehicle.
+    self._route = Route(new_waypoints, index=0)
 
   def get_commands(self):
     return self._set_throttle, self._set_steer, self._set_brake
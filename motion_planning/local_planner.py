@@ -10,21 +10,24 @@ import copy
 import path_optimizer
 import collision_checker
 import velocity_planner
+from path_set import PathSet
 from math import sin, cos, pi, sqrt
 
 
 class LocalPlanner:
   def __init__(self, num_paths, path_offset, circle_offsets, circle_radii,
                path_select_weight, time_gap, a_max, slow_speed,
-               stop_line_buffer):
+               stop_line_buffer, spiral_table=None, path_score_terms=()):
     self._num_paths = num_paths
     self._path_offset = path_offset
-    self._path_optimizer = path_optimizer.PathOptimizer()
+    self._path_optimizer = path_optimizer.PathOptimizer(table=spiral_table)
     self._collision_checker = collision_checker.CollisionChecker(circle_offsets,
                                                                  circle_radii,
-                                                                 path_select_weight)
+                                                                 path_select_weight,
+                                                                 path_score_terms)
     self._velocity_planner = velocity_planner.VelocityPlanner(time_gap, a_max, slow_speed,
                                                               stop_line_buffer)
+    self._prev_best_path = None
 
   def get_goal_state_set(self, goal_index, goal_state, waypoints, ego_state):
     """Gets the goal states given a goal position.
@@ -139,7 +142,7 @@ class LocalPlanner:
 
   # Plans the path set using polynomial spiral optimization to
   # each of the goal states.
-  def plan_paths(self, goal_state_set):
+  def plan_paths(self, goal_state_set, num_points=None):
     """Plans the path set using the polynomial spiral optimization.
 
     Plans the path set using polynomial spiral optimization to each of the
@@ -158,46 +161,86 @@ class LocalPlanner:
               [x, y, t] are the position and yaw values at each goal
               v is the goal speed at the goal point.
               all units are in m, m/s and radians
+        num_points: Number of points sampled along each path. Defaults to
+            the sample count of the path optimizer.
     returns:
-        paths: A list of optimized spiral paths which satisfies the set of 
-            goal states. A path is a list of points of the following format:
+        paths: A PathSet of the optimized spiral paths to every goal state,
+            including the invalid ones (see path_validity). A path is of
+            the following format:
                 [x_points, y_points, t_points]:
-                    x_points: List of x values (m) along the spiral
-                    y_points: List of y values (m) along the spiral
-                    t_points: List of yaw values (rad) along the spiral
+                    x_points: Array of x values (m) along the spiral
+                    y_points: Array of y values (m) along the spiral
+                    t_points: Array of yaw values (rad) along the spiral
                 Example of accessing the ith path, jth point's t value:
                     paths[i][2][j]
             Note that this path is in the vehicle frame, since the
             optimize_spiral function assumes this to be the case.
-        path_validity: List of booleans classifying whether a path is valid
+        path_validity: Boolean array classifying whether a path is valid
             (true) or not (false) for the local planner to traverse. Each ith
-            path_validity corresponds to the ith path in the path list.
+            path_validity corresponds to the ith path in the path set, and
+            is the same array as paths.valid.
     """
-    paths = []
-    path_validity = []
-    for goal_state in goal_state_set:
-      path = self._path_optimizer.optimize_spiral(goal_state[0],
-                                                  goal_state[1],
-                                                  goal_state[2])
-      if np.linalg.norm([path[0][-1] - goal_state[0],
-                         path[1][-1] - goal_state[1],
-                         path[2][-1] - goal_state[2]]) > 0.1:
-        path_validity.append(False)
-      else:
-        paths.append(path)
-        path_validity.append(True)
-
-    return paths, path_validity
-
-
-def transform_paths(paths, ego_state):
+    # Optimize the spirals to every goal state at once.
+    goals = np.asarray(goal_state_set, dtype=float)[:, :3]
+    spirals = self._path_optimizer.optimize_spirals(goals[:, 0],
+                                                    goals[:, 1],
+                                                    goals[:, 2],
+                                                    num_points)
+
+    # A path is valid if its endpoint lands close enough to its goal state.
+    endpoint_errors = np.linalg.norm(spirals[:, :, -1] - goals, axis=1)
+    paths = PathSet(spirals, endpoint_errors <= 0.1)
+
+    return paths, paths.valid
+
+
+def transform_points(points, ego_state, out=None, inverse=False):
+  """Applies the rigid transform given by ego_state to a batch of paths.
+
+  args:
+      points: Array of shape (..., 3, M) of [x_points, y_points, t_points]
+          rows, e.g. a single (3, M) path or an (N, 3, M) path array.
+      ego_state: ego state vector for the vehicle, in the global frame.
+          format: [ego_x, ego_y, ego_yaw, ...]
+      out: Optional float array of the same shape as points to write the
+          result to. It may be points itself, to transform in place.
+      inverse: If true, converts from the global frame to the local
+          (vehicle) frame instead, so that transforming with
+          inverse=False and then inverse=True recovers the input.
+  returns:
+      out: Array of shape (..., 3, M) of the transformed points.
+  """
+  points = np.asarray(points, dtype=float)
+  if out is None:
+    out = np.empty_like(points)
+  cos_yaw = cos(ego_state[2])
+  sin_yaw = sin(ego_state[2])
+  x = points[..., 0, :]
+  y = points[..., 1, :]
+  if inverse:
+    dx = x - ego_state[0]
+    dy = y - ego_state[1]
+    x_transformed = dx * cos_yaw + dy * sin_yaw
+    out[..., 1, :] = dy * cos_yaw - dx * sin_yaw
+    out[..., 0, :] = x_transformed
+    np.subtract(points[..., 2, :], ego_state[2], out=out[..., 2, :])
+  else:
+    # x is computed before writing y, so that out may alias points.
+    x_transformed = ego_state[0] + x * cos_yaw - y * sin_yaw
+    out[..., 1, :] = ego_state[1] + x * sin_yaw + y * cos_yaw
+    out[..., 0, :] = x_transformed
+    np.add(points[..., 2, :], ego_state[2], out=out[..., 2, :])
+  return out
+
+
+def transform_paths(paths, ego_state, out=None, inverse=False):
   """ Converts the to the global coordinate frame.
 
   Converts the paths from the local (vehicle) coordinate frame to the
   global coordinate frame.
 
   args:
-      paths: A list of paths in the local (vehicle) frame.  
+      paths: A PathSet or a list of paths in the local (vehicle) frame.  
           A path is a list of points of the following format:
               [x_points, y_points, t_points]:
                   , x_points: List of x values (m)
@@ -210,8 +253,14 @@ def transform_paths(paths, ego_state):
               ego_x and ego_y     : position (m)
               ego_yaw             : top-down orientation [-pi to pi]
               ego_open_loop_speed : open loop speed (m/s)
+      out: Optional PathSet or (N, 3, M) array to write the transformed
+          paths to, only used when paths is a PathSet. Passing paths itself
+          transforms the set in place without allocating a new array.
+      inverse: If true, converts paths from the global frame back to the
+          local (vehicle) frame instead.
   returns:
-      transformed_paths: A list of transformed paths in the global frame.  
+      transformed_paths: The transformed paths in the global frame, as a
+          PathSet (with the same validity mask) if paths is a PathSet.
           A path is a list of points of the following format:
               [x_points, y_points, t_points]:
                   , x_points: List of x values (m)
@@ -221,17 +270,17 @@ def transform_paths(paths, ego_state):
               y value:
                   paths[i][1][j]
   """
-  transformed_paths = []
-  for path in paths:
-    x_transformed = []
-    y_transformed = []
-    t_transformed = []
-
-    for i in range(len(path[0])):
-      x_transformed.append(ego_state[0] + path[0][i] * cos(ego_state[2]) - path[1][i] * sin(ego_state[2]))
-      y_transformed.append(ego_state[1] + path[0][i] * sin(ego_state[2]) + path[1][i] * cos(ego_state[2]))
-      t_transformed.append(path[2][i] + ego_state[2])
-
-    transformed_paths.append([x_transformed, y_transformed, t_transformed])
+  if isinstance(paths, PathSet):
+    if out is None:
+      return PathSet(transform_points(paths.paths, ego_state, inverse=inverse),
+                     paths.valid)
+    if isinstance(out, PathSet):
+      transform_points(paths.paths, ego_state, out=out.paths, inverse=inverse)
+      out.valid = paths.valid.copy()
+      return out
+    transform_points(paths.paths, ego_state, out=out, inverse=inverse)
+    return PathSet(out, paths.valid)
 
-  return transformed_paths
+  # Paths of a list may differ in length, so transform them one at a time.
+  return [transform_points(path, ego_state, inverse=inverse).tolist()
+          for path in paths]
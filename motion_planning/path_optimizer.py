@@ -6,16 +6,244 @@
 # Date: October 29, 2018
 
 import numpy as np
+from collections import OrderedDict
 from math import sin, cos, pi, sqrt
 from scipy.optimize import Bounds, minimize
-from scipy.integrate import cumtrapz
+
+# Composite Simpson's rule over 8 intervals of the normalized arc length
+# u = s / sf. These are the same nodes and weights the symbolic fxf/fyf
+# expressions below are built on, with the 1/3 * (1/8) step folded in.
+SIMPSON_U = np.linspace(0.0, 1.0, 9)
+SIMPSON_W = np.array([1.0, 4.0, 2.0, 4.0, 2.0, 4.0, 2.0, 4.0, 1.0]) / 24.0
+
+
+def spiral_basis(u):
+  """Integrated cubic spiral basis in the normalized arc length u = s / sf.
+
+  With p0 = p3 = 0, theta(u) = sf * (p1 * g1(u) + p2 * g2(u)).
+  """
+  u2 = u * u
+  u3 = u2 * u
+  u4 = u3 * u
+  g1 = 4.5 * u2 - 7.5 * u3 + 3.375 * u4
+  g2 = -2.25 * u2 + 6.0 * u3 - 3.375 * u4
+  return g1, g2
+
+
+SIMPSON_G1, SIMPSON_G2 = spiral_basis(SIMPSON_U)
+
+
+class SpiralSampler:
+  """Closed-form sampling kernel for a fixed number of points per spiral.
+
+  The basis powers of the normalized arc length u = s / sf and the
+  cumulative trapezoid weights only depend on the sample count, so they are
+  computed once. Sampling a batch of spirals is then two matrix products:
+  theta = sf * [p1, p2] @ basis, and x, y = h * [cos, sin](theta) @ weights,
+  where h = sf / (num_points - 1) is the arc length step.
+  """
+
+  def __init__(self, num_points=50):
+    if num_points < 2:
+      raise ValueError("num_points must be at least 2.")
+    self.num_points = num_points
+    self.u = np.linspace(0.0, 1.0, num_points)
+    # Rows of [u, u^2, u^3, u^4], mapped onto the p1 and p2 basis.
+    self._powers = self.u[None, :] ** np.arange(1, 5)[:, None]
+    self._basis = np.array([[0.0, 4.5, -7.5, 3.375],
+                            [0.0, -2.25, 6.0, -3.375]]) @ self._powers
+    # weights[j, k] is the weight of sample j in the trapezoid integral
+    # from 0 to the kth sample, in units of the arc length step.
+    weights = np.triu(np.ones((num_points, num_points)), 1)
+    weights[0, 1:] = 0.5
+    weights[np.arange(1, num_points), np.arange(1, num_points)] = 0.5
+    self._weights = weights
+
+  def sample(self, p):
+    """Samples a batch of spirals.
+
+    args:
+        p: Array of shape (N, 3) of [p1, p2, sf] optimization parameters.
+    returns:
+        spirals: Array of shape (N, 3, num_points), where spirals[i] is
+            [x_points, y_points, t_points] for the ith spiral.
+    """
+    p = np.asarray(p, dtype=float).reshape(-1, 3)
+    sf = p[:, 2:3]
+    spirals = np.empty((p.shape[0], 3, self.num_points))
+    t_points = spirals[:, 2]
+    np.multiply(sf, p[:, :2] @ self._basis, out=t_points)
+    step = sf / (self.num_points - 1)
+    np.multiply(step, np.cos(t_points) @ self._weights, out=spirals[:, 0])
+    np.multiply(step, np.sin(t_points) @ self._weights, out=spirals[:, 1])
+    return spirals
+
+
+class SpiralCache:
+  """Bounded LRU cache of converged spiral parameters.
+
+  Entries are keyed on the goal state (xf, yf, tf) quantized to a grid of
+  xy_resolution (m) and t_resolution (rad), and hold the exact goal state
+  together with the converged [p1, p2, sf] parameters. Consecutive planning
+  cycles produce nearly identical goal sets in the vehicle frame, so a goal
+  falling into the cell of a previous one can warm start the optimizer from
+  that solution, and a goal identical to the stored one reuses it directly.
+  """
+
+  def __init__(self, max_size=256, xy_resolution=0.1, t_resolution=0.01):
+    self._max_size = max_size
+    self._xy_resolution = xy_resolution
+    self._t_resolution = t_resolution
+    self._entries = OrderedDict()
+    self.hits = 0
+    self.exact_hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _key(self, xf, yf, tf):
+    return (int(round(xf / self._xy_resolution)),
+            int(round(yf / self._xy_resolution)),
+            int(round(tf / self._t_resolution)))
+
+  def lookup(self, xf, yf, tf):
+    """Returns (params, exact) for the goal's cell, or None on a miss.
+
+    params is the stored [p1, p2, sf] array, and exact is True if the
+    stored goal state is identical to the requested one.
+    """
+    key = self._key(xf, yf, tf)
+    entry = self._entries.get(key)
+    if entry is None:
+      self.misses += 1
+      return None
+    self._entries.move_to_end(key)
+    self.hits += 1
+    goal, params = entry
+    exact = goal == (xf, yf, tf)
+    if exact:
+      self.exact_hits += 1
+    return params, exact
+
+  def store(self, xf, yf, tf, params):
+    key = self._key(xf, yf, tf)
+    self._entries[key] = ((xf, yf, tf), np.array(params, dtype=float))
+    self._entries.move_to_end(key)
+    if len(self._entries) > self._max_size:
+      self._entries.popitem(last=False)
+
+  def stats(self):
+    """Returns the hit/miss counts and current size of the cache."""
+    return {'hits': self.hits, 'exact_hits': self.exact_hits,
+            'misses': self.misses, 'size': len(self._entries)}
+
+  def clear(self):
+    self._entries.clear()
+    self.hits = 0
+    self.exact_hits = 0
+    self.misses = 0
+
+
+class SpiralTable:
+  """Lookup table of optimal spiral parameters over a regular goal grid.
+
+  The table covers a grid of goal states (xf, yf, tf) in the vehicle frame
+  and is stored as a single .npy file, so that it can be memory-mapped
+  instead of read into memory. Its first three rows hold the grid
+  specification [min, max, count] of the x, y and t axes, and the remaining
+  nx * ny * nt rows hold the optimized [p1, p2, sf] at every grid node in
+  C order. Parameters in between nodes are trilinearly interpolated.
+  """
+
+  def __init__(self, grid, params):
+    self._grid = np.asarray(grid, dtype=float)
+    self._shape = tuple(int(n) for n in self._grid[:, 2])
+    self._params = params.reshape(self._shape + (3,))
+    self._lower = self._grid[:, 0]
+    self._step = (self._grid[:, 1] - self._grid[:, 0]) / \
+        np.maximum(self._grid[:, 2] - 1, 1)
+
+  @classmethod
+  def load(cls, filename, mmap_mode='r'):
+    data = np.load(filename, mmap_mode=mmap_mode)
+    return cls(np.array(data[:3]), data[3:])
+
+  def save(self, filename):
+    np.save(filename, np.concatenate((self._grid,
+                                      self._params.reshape(-1, 3))))
+
+  @classmethod
+  def build(cls, x_range, y_range, t_range, batch_size=4096):
+    """Builds a table by optimizing a spiral to every grid node.
+
+    args:
+        x_range, y_range, t_range: (min, max, count) specification of the
+            xf (m), yf (m) and tf (rad) grid axes.
+        batch_size: Number of grid nodes optimized per batch.
+    returns:
+        table: The resulting SpiralTable.
+    """
+    grid = np.array([x_range, y_range, t_range], dtype=float)
+    axes = [np.linspace(lo, hi, int(n)) for lo, hi, n in grid]
+    goals = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    optimizer = PathOptimizer(cache_size=0)
+    params = np.empty_like(goals)
+    for start in range(0, goals.shape[0], batch_size):
+      batch = goals[start:start + batch_size]
+      params[start:start + batch_size] = optimizer.optimize_spiral_params(
+          batch[:, 0], batch[:, 1], batch[:, 2])
+    return cls(grid, params)
+
+  def interpolate(self, xf, yf, tf):
+    """Interpolates the spiral parameters for a set of goal states.
+
+    args:
+        xf, yf, tf: Arrays of final x (m), y (m) and yaw (rad) values.
+    returns:
+        [p, inside]:
+            p: Array of shape (N, 3) with the interpolated [p1, p2, sf].
+            inside: Boolean array, false for goals outside of the table
+                (those are interpolated from the clamped goal state).
+    """
+    goals = np.column_stack((xf, yf, tf))
+    upper = np.array(self._shape) - 1
+    u = (goals - self._lower) / self._step
+    inside = np.all((u >= 0.0) & (u <= upper), axis=1)
+    u = np.clip(u, 0, upper)
+    i0 = np.minimum(np.floor(u).astype(int), np.maximum(upper - 1, 0))
+    frac = u - i0
+    i1 = np.minimum(i0 + 1, upper)
+
+    p = np.zeros((goals.shape[0], 3))
+    for corner in range(8):
+      bits = [(corner >> axis) & 1 for axis in range(3)]
+      idx = [np.where(bits[axis], i1[:, axis], i0[:, axis]) for axis in range(3)]
+      w = np.prod([np.where(bits[axis], frac[:, axis], 1.0 - frac[:, axis])
+                   for axis in range(3)], axis=0)
+      p += w[:, None] * self._params[idx[0], idx[1], idx[2]]
+    return p, inside
 
 
 class PathOptimizer:
-  def __init__(self):
+  def __init__(self, cache_size=256, table=None, table_tolerance=0.05,
+               table_seed=True, num_points=50):
     self._xf = 0.0
     self._yf = 0.0
     self._tf = 0.0
+    # Sampling kernels by sample count, num_points being the default.
+    self._num_points = num_points
+    self._samplers = {}
+    # Warm start cache of converged spiral parameters (disabled if 0).
+    self._cache = SpiralCache(cache_size) if cache_size > 0 else None
+    # Optional precomputed SpiralTable. Interpolated parameters are used
+    # directly if the spiral endpoint lands within table_tolerance of the
+    # goal, otherwise the optimizer runs, seeded from the table if
+    # table_seed is set.
+    self._table = table
+    self._table_tolerance = table_tolerance
+    self._table_seed = table_seed
 
   def optimize_spiral(self, xf, yf, tf):
     """Optimization function used for finding the optimization parameters.
@@ -54,6 +282,15 @@ class PathOptimizer:
     # the initial and final points) to be zero.
     p0 = [0.0, 0.0, sf_0]
 
+    # Warm start from a previous solution to a nearby goal, or reuse it
+    # outright if it was computed for this exact goal.
+    if self._cache is not None:
+      entry = self._cache.lookup(xf, yf, tf)
+      if entry is not None:
+        if entry[1]:
+          return self.sample_spiral(entry[0])
+        p0 = [entry[0][0], entry[0][1], max(entry[0][2], sf_0)]
+
     # Here we will set the bounds [lower, upper] for each optimization
     # variable.
     # The first two variables correspond to the curvature 1/3rd of the
@@ -70,10 +307,172 @@ class PathOptimizer:
     # variables for the optimizer are set by p0. You should use the L-BFGS-B
     # optimization methods.
     res = minimize(self.objective, p0, method='L-BFGS-B', jac=self.objective_grad, bounds=bounds)
+    if self._cache is not None:
+      self._cache.store(xf, yf, tf, res.x)
 
     spiral = self.sample_spiral(res.x)
     return spiral
 
+  def optimize_spirals(self, xf, yf, tf, num_points=None):
+    """Batched version of optimize_spiral() for a whole goal state set.
+
+    All N spirals are optimized together. The objective is a sum of
+    independent per-spiral terms, so each spiral keeps its own 3x3 BFGS
+    inverse Hessian approximation and line search step, but the objective,
+    gradient, updates and sampling are evaluated as NumPy array expressions
+    over the whole batch in lock-step.
+
+    args:
+        xf: Array of final x positions (m), one per goal state.
+        yf: Array of final y positions (m), one per goal state.
+        tf: Array of final yaw values (rad), one per goal state.
+        num_points: Number of points M sampled along each spiral. Defaults
+            to the sample count the optimizer was constructed with.
+
+    returns:
+        spirals: Array of shape (N, 3, M) holding the sampled spirals, where
+            spirals[i] is [x_points, y_points, t_points] for the ith goal.
+    """
+    xf = np.asarray(xf, dtype=float)
+    yf = np.asarray(yf, dtype=float)
+    tf = np.asarray(tf, dtype=float)
+    n = xf.shape[0]
+    p = np.column_stack((np.zeros(n), np.zeros(n), np.hypot(xf, yf)))
+    solve = np.ones(n, dtype=bool)
+
+    # Cached solutions either replace the optimization (exact hits) or
+    # serve as its initial guess.
+    warm = np.zeros(n, dtype=bool)
+    if self._cache is not None:
+      for i in range(n):
+        entry = self._cache.lookup(xf[i], yf[i], tf[i])
+        if entry is not None:
+          p[i] = entry[0]
+          solve[i] = not entry[1]
+          warm[i] = True
+
+    # Take the remaining spirals from the lookup table where it is accurate
+    # enough, and fall back to the optimizer for the others.
+    if self._table is not None and np.any(solve):
+      idx = np.flatnonzero(solve)
+      p_table, inside = self._table.interpolate(xf[idx], yf[idx], tf[idx])
+      endpoints = self.sample_spirals(p_table)[:, :, -1]
+      errors = np.linalg.norm(endpoints - np.column_stack((xf[idx], yf[idx], tf[idx])), axis=1)
+      accepted = inside & (errors <= self._table_tolerance)
+      p[idx[accepted]] = p_table[accepted]
+      solve[idx[accepted]] = False
+      if self._table_seed:
+        seed = inside & ~accepted & ~warm[idx]
+        p[idx[seed]] = p_table[seed]
+
+    if np.any(solve):
+      p[solve] = self.optimize_spiral_params(xf[solve], yf[solve], tf[solve],
+                                             p0=p[solve])
+      if self._cache is not None:
+        for i in np.flatnonzero(solve):
+          self._cache.store(xf[i], yf[i], tf[i], p[i])
+
+    return self.sample_spirals(p, num_points)
+
+  def optimize_spiral_params(self, xf, yf, tf, p0=None, max_iter=200,
+                             gtol=1e-5):
+    """Returns the optimized [p1, p2, sf] parameters for a goal state set.
+
+    Solves the bound constrained problems of optimize_spiral() with a
+    batched projected BFGS method: variables sitting on an active bound are
+    held fixed for the step, and each spiral backtracks along its own search
+    direction until the Armijo condition holds. Spirals whose projected
+    gradient falls below gtol drop out of the active batch.
+
+    args:
+        xf, yf, tf: Arrays of final x (m), y (m) and yaw (rad) values.
+        p0: Optional (N, 3) array of initial [p1, p2, sf] guesses. Defaults
+            to straight lines with the goal's straight line arc length.
+        max_iter: Maximum number of BFGS iterations.
+        gtol: Tolerance on the infinity norm of the projected gradient.
+
+    returns:
+        p: Array of shape (N, 3) with the optimized [p1, p2, sf] per goal.
+    """
+    n = xf.shape[0]
+    sf_0 = np.hypot(xf, yf)
+    lower = np.column_stack((np.full(n, -0.5), np.full(n, -0.5), sf_0))
+    upper = np.column_stack((np.full(n, 0.5), np.full(n, 0.5), np.full(n, np.inf)))
+    if p0 is None:
+      p = np.column_stack((np.zeros(n), np.zeros(n), sf_0))
+    else:
+      p = np.clip(np.array(p0, dtype=float), lower, upper)
+
+    f, g = self.objective_batch(p, xf, yf, tf)
+    h_inv = np.tile(np.eye(3), (n, 1, 1))
+    active = np.arange(n)
+
+    for _ in range(max_iter):
+      # Variables on a bound whose gradient pushes further out are fixed.
+      fixed = ((p[active] <= lower[active]) & (g[active] > 0.0)) | \
+              ((p[active] >= upper[active]) & (g[active] < 0.0))
+      g_free = np.where(fixed, 0.0, g[active])
+      converged = np.max(np.abs(g_free), axis=1) < gtol
+      active = active[~converged]
+      if active.size == 0:
+        break
+      fixed = fixed[~converged]
+      g_free = g_free[~converged]
+
+      d = -np.einsum('nij,nj->ni', h_inv[active], g_free)
+      d[fixed] = 0.0
+      # Fall back to steepest descent where BFGS lost positive definiteness.
+      uphill = np.einsum('ni,ni->n', d, g_free) >= 0.0
+      d[uphill] = -g_free[uphill]
+
+      p_a = p[active]
+      f_a = f[active]
+      step = np.ones(active.size)
+      p_new = p_a.copy()
+      f_new = f_a.copy()
+      g_new = g[active]
+      searching = np.ones(active.size, dtype=bool)
+      for _ in range(30):
+        idx = np.flatnonzero(searching)
+        trial = np.clip(p_a[idx] + step[idx, None] * d[idx],
+                        lower[active[idx]], upper[active[idx]])
+        f_trial, g_trial = self.objective_batch(trial, xf[active[idx]],
+                                                yf[active[idx]], tf[active[idx]])
+        decrease = np.einsum('ni,ni->n', g_free[idx], trial - p_a[idx])
+        accepted = f_trial <= f_a[idx] + 1e-4 * decrease
+        acc = idx[accepted]
+        p_new[acc] = trial[accepted]
+        f_new[acc] = f_trial[accepted]
+        g_new[acc] = g_trial[accepted]
+        searching[acc] = False
+        step[idx[~accepted]] *= 0.5
+        if not np.any(searching):
+          break
+
+      # Spirals whose line search failed cannot make further progress.
+      moved = ~searching
+      s_k = p_new - p_a
+      y_k = g_new - g[active]
+      p[active] = p_new
+      f[active] = f_new
+      g[active] = g_new
+
+      # Batched BFGS update of the inverse Hessian approximations.
+      sy = np.einsum('ni,ni->n', s_k, y_k)
+      update = moved & (sy > 1e-10)
+      if np.any(update):
+        s_u = s_k[update]
+        y_u = y_k[update]
+        rho = 1.0 / sy[update]
+        h_u = h_inv[active[update]]
+        eye = np.eye(3)
+        v = eye - rho[:, None, None] * s_u[:, :, None] * y_u[:, None, :]
+        h_inv[active[update]] = v @ h_u @ np.transpose(v, (0, 2, 1)) + \
+            rho[:, None, None] * s_u[:, :, None] * s_u[:, None, :]
+      active = active[moved]
+
+    return p
+
   def thetaf(self, a, b, c, d, s):
     # This function computes the theta values for a given list of
     # arc lengths, and spiral parameters a, b, c, d.
@@ -88,7 +487,7 @@ class PathOptimizer:
     #         d - the fourth term of kappa(s).
     return [a * x + b * x**2 / 2 + c * x**3 / 3 + d * x**4 / 4 for x in s]
 
-  def sample_spiral(self, p):
+  def sample_spiral(self, p, num_points=None):
     """Samples a set of points along the spiral given the optimization
     parameters.
 
@@ -98,41 +497,36 @@ class PathOptimizer:
             Format: [p1, p2, sf], Unit: [1/m, 1/m, m]
             , where p1 and p2 are the curvatures at points p1 and p2
               and sf is the final arc length for the spiral.
+        num_points: Number of points sampled along the spiral. Defaults to
+            the sample count the optimizer was constructed with.
     returns:
         [x_points, y_points, t_points]:
             x_points: List of x values (m) along the spiral
             y_points: List of y values (m) along the spiral
             t_points: List of yaw values (rad) along the spiral
     """
-    # These equations map from the optimization parameter space
-    # to the spiral parameter space.
-    p = [0.0, p[0], p[1], 0.0, p[2]]    # recall p0 and p3 are set to 0
-    # and p4 is the final arc length
-    a = p[0]
-    b = -(11.0 * p[0] / 2.0 - 9.0 * p[1] + 9.0 * p[2] / 2.0 - p[3]) / p[4]
-    c = (9.0 * p[0] - 45.0 * p[1] / 2.0 + 18.0 * p[2] - 9.0 * p[3] / 2.0) / p[4]**2
-    d = -(9.0 * p[0] / 2.0 - 27.0 * p[1] / 2.0 + 27.0 * p[2] / 2.0 - 9.0 * p[3] / 2.0) / p[4]**3
-
-    # Set the s_points (list of s values along the spiral) to be from 0.0
-    # to p[4] (final arc length)
-    s_points = np.linspace(0.0, p[4])
-
-    # Compute the theta, x, and y points from the uniformly sampled
-    # arc length points s_points (p[4] is the spiral arc length).
-    # Use self.thetaf() to compute the theta values from the s values.
-    # Recall that x = integral cos(theta(s)) ds and
-    #             y = integral sin(theta(s)) ds.
-    # You will find the cumtrapz() function useful.
-    # Try to vectorize the code using numpy functions for speed if you can.
-
-    # Try to vectorize the code using numpy functions for speed if you can.
-    # TODO: INSERT YOUR CODE BETWEEN THE DASHED LINES
-    # ------------------------------------------------------------------
-    t_points = self.thetaf(a, b, c, d, s_points)
-    x_points = cumtrapz(np.cos(t_points), s_points, initial=0.0)
-    y_points = cumtrapz(np.sin(t_points), s_points, initial=0.0)
+    x_points, y_points, t_points = self.sample_spirals(
+        np.reshape(p, (1, 3)), num_points)[0]
     return [x_points, y_points, t_points]
-    # ------------------------------------------------------------------
+
+  def sample_spirals(self, p, num_points=None):
+    """Batched version of sample_spiral().
+
+    args:
+        p: Array of shape (N, 3) of [p1, p2, sf] optimization parameters.
+        num_points: Number of points sampled along each spiral. Defaults to
+            the sample count the optimizer was constructed with.
+    returns:
+        spirals: Array of shape (N, 3, num_points), where spirals[i] is
+            [x_points, y_points, t_points] for the ith spiral.
+    """
+    if num_points is None:
+      num_points = self._num_points
+    sampler = self._samplers.get(num_points)
+    if sampler is None:
+      sampler = SpiralSampler(num_points)
+      self._samplers[num_points] = sampler
+    return sampler.sample(p)
 
   def objective(self, p):
     """
@@ -150,6 +544,49 @@ class PathOptimizer:
     p = [0.0, p[0], p[1], 0.0, p[2]]
     return np.add(np.add(np.add(self.fbe_grad(p), np.multiply(25, self.fxf_grad(p))), np.multiply(25, self.fyf_grad(p))), np.multiply(30, self.ftf_grad(p)))
 
+  def objective_batch(self, p, xf, yf, tf):
+    """
+    Vectorized objective() and objective_grad() over a batch of spirals.
+    p is an (N, 3) array of [p1, p2, sf] values, and xf, yf and tf hold the
+    goal state of each spiral. Returns the (N,) objective values and the
+    (N, 3) gradients together, so that the trigonometric terms are only
+    evaluated once per iteration.
+    """
+    p1 = p[:, 0]
+    p2 = p[:, 1]
+    sf = p[:, 2]
+
+    # Theta at the Simpson nodes, and its derivative w.r.t. sf (theta / sf).
+    t_sf = p1[:, None] * SIMPSON_G1 + p2[:, None] * SIMPSON_G2
+    t = sf[:, None] * t_sf
+    cos_t = np.cos(t)
+    sin_t = np.sin(t)
+
+    cos_sum = cos_t @ SIMPSON_W
+    sin_sum = sin_t @ SIMPSON_W
+    ex = xf - sf * cos_sum
+    ey = yf - sf * sin_sum
+    et = tf - 0.375 * sf * (p1 + p2)
+    be = 324.0 * p1 * p1 + 324.0 * p2 * p2 - 81.0 * p1 * p2
+
+    value = sf * be / 840.0 + 25.0 * (ex * ex + ey * ey) + 30.0 * et * et
+
+    sf2 = sf * sf
+    grad = np.empty_like(p)
+    grad[:, 0] = (sf * (648.0 * p1 - 81.0 * p2) / 840.0
+                  - 50.0 * ex * -sf2 * ((sin_t * SIMPSON_G1) @ SIMPSON_W)
+                  - 50.0 * ey * sf2 * ((cos_t * SIMPSON_G1) @ SIMPSON_W)
+                  - 60.0 * et * 0.375 * sf)
+    grad[:, 1] = (sf * (648.0 * p2 - 81.0 * p1) / 840.0
+                  - 50.0 * ex * -sf2 * ((sin_t * SIMPSON_G2) @ SIMPSON_W)
+                  - 50.0 * ey * sf2 * ((cos_t * SIMPSON_G2) @ SIMPSON_W)
+                  - 60.0 * et * 0.375 * sf)
+    grad[:, 2] = (be / 840.0
+                  - 50.0 * ex * (cos_sum - sf * ((sin_t * t_sf) @ SIMPSON_W))
+                  - 50.0 * ey * (sin_sum + sf * ((cos_t * t_sf) @ SIMPSON_W))
+                  - 60.0 * et * 0.375 * (p1 + p2))
+    return value, grad
+
   def fxf(self, p):
     t2 = p[0] * (1.1E1 / 2.0)
     t3 = p[1] * 9.0
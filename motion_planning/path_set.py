@@ -0,0 +1,64 @@
+"""
+Array-backed set of candidate paths shared by the local planning pipeline.
+"""
+
+import numpy as np
+
+
+class PathSet:
+  """A set of N candidate paths stored in one contiguous (N, 3, M) array.
+
+  paths[i] is the ith path as a (3, M) view [x_points, y_points, t_points],
+  so code written against the [x_points, y_points, t_points] list format
+  keeps working, while the planning stages operate on the whole array at
+  once. Paths that failed to reach their goal state stay in the set and are
+  flagged in the valid mask, which keeps path indices aligned with the goal
+  state set.
+
+  attributes:
+      paths: Array of shape (N, 3, M) of x (m), y (m) and yaw (rad) values.
+      valid: Boolean array of shape (N,), true for valid paths.
+  """
+
+  def __init__(self, paths, valid=None):
+    self.paths = np.ascontiguousarray(paths, dtype=float)
+    if self.paths.ndim != 3 or self.paths.shape[1] != 3:
+      raise ValueError("paths must be of shape (N, 3, M).")
+    if valid is None:
+      self.valid = np.ones(self.paths.shape[0], dtype=bool)
+    else:
+      self.valid = np.asarray(valid, dtype=bool)
+
+  def __len__(self):
+    return self.paths.shape[0]
+
+  def __getitem__(self, index):
+    return self.paths[index]
+
+  def __iter__(self):
+    return iter(self.paths)
+
+  def __array__(self, dtype=None, copy=None):
+    if dtype is None:
+      return self.paths
+    return self.paths.astype(dtype)
+
+  @property
+  def num_points(self):
+    return self.paths.shape[2]
+
+  @property
+  def x(self):
+    return self.paths[:, 0]
+
+  @property
+  def y(self):
+    return self.paths[:, 1]
+
+  @property
+  def t(self):
+    return self.paths[:, 2]
+
+  def endpoints(self):
+    """Returns the (N, 3) array of the last [x, y, t] of every path."""
+    return self.paths[:, :, -1]
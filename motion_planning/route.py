@@ -0,0 +1,63 @@
+"""
+Waypoint route with a precomputed cumulative arc length.
+"""
+
+import numpy as np
+from waypoint_tracker import WaypointTracker
+
+
+class Route:
+  """Waypoint route whose cumulative arc length is computed once when
+  loaded, so that goal and lookahead indices are binary searches instead of
+  walks along the waypoints.
+
+  args:
+      waypoints: Waypoints in the format [[x0, y0, v0], [x1, y1, v1], ...].
+      index: Optional guess of the waypoint index closest to the vehicle,
+          see WaypointTracker.set_waypoints().
+
+  attributes:
+      waypoints: The waypoints the route was built from.
+      arc_length: Array of the arc length (m) along the route from the first
+          waypoint to each waypoint.
+  """
+
+  def __init__(self, waypoints, index=None):
+    self.waypoints = waypoints
+    self.arc_length = np.zeros(len(waypoints))
+    if len(waypoints) > 1:
+      points = np.asarray(waypoints, dtype=float)[:, :2]
+      np.cumsum(np.hypot(np.diff(points[:, 0]), np.diff(points[:, 1])),
+                out=self.arc_length[1:])
+    self._tracker = WaypointTracker()
+    self._tracker.set_waypoints(waypoints, index)
+
+  def __len__(self):
+    return len(self.arc_length)
+
+  def get_closest_index(self, x, y):
+    """Gets the index of the waypoint closest to a position.
+
+    See WaypointTracker.get_closest_index().
+    """
+    return self._tracker.get_closest_index(x, y)
+
+  def lookahead_index(self, closest_index, closest_len, lookahead):
+    """Gets the earliest waypoint index whose accumulated arc length from
+    the vehicle (including closest_len) is greater than or equal to the
+    lookahead distance, or the last index if the route is too short.
+
+    args:
+        closest_index: index of the waypoint which is closest to the vehicle.
+        closest_len: length (m) to the closest waypoint from the vehicle.
+        lookahead: lookahead distance (m) along the route.
+    returns:
+        lookahead_index: waypoint index at the lookahead distance.
+    """
+    last_index = len(self.arc_length) - 1
+    # In this case, reaching the closest waypoint is already far enough.
+    if closest_len >= lookahead or closest_index >= last_index:
+      return closest_index
+    target = self.arc_length[closest_index] + lookahead - closest_len
+    index = int(np.searchsorted(self.arc_length, target))
+    return min(max(index, closest_index + 1), last_index)
@@ -22,11 +22,13 @@ import csv
 import controller_2d as controller_2d
 import configparser
 import motion_planning.local_planner as local_planner
+import path_optimizer
 import behavioural_planner
 
 # Script level imports
 sys.path.append(os.path.abspath(sys.path[0] + '/..'))
 import utils.live_plotter as lv
+from utils.waypoints import densify
 from carla import sensor
 from carla.client import make_carla_client, VehicleControl
 from carla.settings import CarlaSettings
@@ -98,6 +100,10 @@ LP_FREQUENCY_DIVISOR = 2                # Frequency divisor to make the
 # frequency). Must be a natural
 # number.
 
+# Precomputed spiral lookup table (built by build_spiral_table.py). If the
+# file does not exist, every spiral is optimized online.
+SPIRAL_TABLE_FILE = 'motion_planning/params/spiral_table.npy'
+
 # Course 4 specific parameters
 
 C4_STOP_SIGN_FILE = './motion_planning/params/stop_sign_params.txt'
@@ -622,6 +628,9 @@ def exec_waypoint_nav_demo(args):
     wp_goal_index = 0
     local_waypoints = None
     path_validity = np.zeros((NUM_PATHS, 1), dtype=bool)
+    spiral_table = None
+    if os.path.exists(SPIRAL_TABLE_FILE):
+      spiral_table = path_optimizer.SpiralTable.load(SPIRAL_TABLE_FILE)
     lp = local_planner.LocalPlanner(NUM_PATHS,
                                     PATH_OFFSET,
                                     CIRCLE_OFFSETS,
@@ -630,7 +639,8 @@ def exec_waypoint_nav_demo(args):
                                     TIME_GAP,
                                     A_MAX,
                                     SLOW_SPEED,
-                                    STOP_LINE_BUFFER)
+                                    STOP_LINE_BUFFER,
+                                    spiral_table)
     bp = behavioural_planner.BehaviouralPlanner(BP_LOOKAHEAD_BASE,
                                                 stopsign_fences,
                                                 LEAD_VEHICLE_LOOKAHEAD)
@@ -695,6 +705,7 @@ def exec_waypoint_nav_demo(args):
       lead_car_pos = []
       lead_car_length = []
       lead_car_speed = []
+      lead_car_ids = []
       for agent in measurement_data.non_player_agents:
         agent_id = agent.id
         if agent.HasField('vehicle'):
@@ -703,6 +714,7 @@ def exec_waypoint_nav_demo(args):
                agent.vehicle.transform.location.y])
           lead_car_length.append(agent.vehicle.bounding_box.extent.x)
           lead_car_speed.append(agent.vehicle.forward_speed)
+          lead_car_ids.append(agent_id)
 
       if len(lead_car_pos) == 0:
         raise ValueError("No lead car information available.")
@@ -743,8 +755,8 @@ def exec_waypoint_nav_demo(args):
         #  # Perform a state transition in the behavioural planner.
         bp.transition_state(waypoints, ego_state, current_speed)
 
-        #  # Check to see if we need to follow the lead vehicle.
-        bp.check_for_lead_vehicle(ego_state, lead_car_pos[1])
+        #  # Check to see if we need to follow a lead vehicle, among all of the vehicles.
+        lead_car_state = bp.select_lead_vehicle(ego_state, lead_car_pos, lead_car_speed, lead_car_ids)
 
         #  # Compute the goal state set from the behavioural planner's computed goal state.
         goal_state_set = lp.get_goal_state_set(bp._goal_index, bp._goal_state, waypoints, ego_state)
@@ -752,65 +764,36 @@ def exec_waypoint_nav_demo(args):
         #  # Calculate planned paths in the local frame.
         paths, path_validity = lp.plan_paths(goal_state_set)
 
-        #  # Transform those paths back to the global frame.
-        paths = local_planner.transform_paths(paths, ego_state)
+        #  # Transform those paths back to the global frame, in place.
+        paths = local_planner.transform_paths(paths, ego_state, out=paths)
 
-        #  # Perform collision checking.
-        collision_check_array = lp._collision_checker.collision_check(paths, [parkedcar_box_pts])
+        #  # Perform collision checking against an obstacle index built once for this cycle.
+        obstacle_index = lp._collision_checker.build_obstacle_index([parkedcar_box_pts])
+        collision_check_array = lp._collision_checker.collision_check(paths, obstacle_index)
 
         #  # Compute the best local path.
-        best_index = lp._collision_checker.select_best_path_index(paths, collision_check_array, bp._goal_state)
+        best_index = lp._collision_checker.select_best_path_index(paths, collision_check_array, bp._goal_state, lp._prev_best_path)
         # If no path was feasible, continue to follow the previous best path.
         if best_index == None:
           best_path = lp._prev_best_path
         else:
-          best_path = paths[best_index]
+          # Copy the best path out of the path set, which may be reused.
+          best_path = paths[best_index].copy()
           lp._prev_best_path = best_path
 
         #  # Compute the velocity profile for the path, and compute the waypoints.
         #  # Use the lead vehicle to inform the velocity profile's dynamic obstacle handling.
-        #  # In this scenario, the only dynamic obstacle is the lead vehicle at index 1.
         desired_speed = bp._goal_state[2]
-        lead_car_state = [lead_car_pos[1][0], lead_car_pos[1][1], lead_car_speed[1]]
         decelerate_to_stop = bp._state == behavioural_planner.DECELERATE_TO_STOP
         local_waypoints = lp._velocity_planner.compute_velocity_profile(best_path, desired_speed, ego_state, current_speed, decelerate_to_stop, lead_car_state, bp._follow_lead_vehicle)
         # --------------------------------------------------------------
 
-        if local_waypoints != None:
+        if local_waypoints is not None:
           # Update the controller waypoint path with the best local path.
           # This controller is similar to that developed in Course 1 of this
           # specialization.  Linear interpolation computation on the waypoints
           # is also used to ensure a fine resolution between points.
-          wp_distance = []   # distance array
-          local_waypoints_np = np.array(local_waypoints)
-          for i in range(1, local_waypoints_np.shape[0]):
-            wp_distance.append(
-                np.sqrt((local_waypoints_np[i, 0] - local_waypoints_np[i - 1, 0])**2 +
-                        (local_waypoints_np[i, 1] - local_waypoints_np[i - 1, 1])**2))
-          wp_distance.append(0)  # last distance is 0 because it is the distance
-          # from the last waypoint to the last waypoint
-
-          # Linearly interpolate between waypoints and store in a list
-          wp_interp = []    # interpolated values
-          # (rows = waypoints, columns = [x, y, v])
-          for i in range(local_waypoints_np.shape[0] - 1):
-            # Add original waypoint to interpolated waypoints list (and append
-            # it to the hash table)
-            wp_interp.append(list(local_waypoints_np[i]))
-
-            # Interpolate to the next waypoint. First compute the number of
-            # points to interpolate based on the desired resolution and
-            # incrementally add interpolated points until the next waypoint
-            # is about to be reached.
-            num_pts_to_interp = int(np.floor(wp_distance[i] / float(INTERP_DISTANCE_RES)) - 1)
-            wp_vector = local_waypoints_np[i + 1] - local_waypoints_np[i]
-            wp_uvector = wp_vector / np.linalg.norm(wp_vector[0:2])
-
-            for j in range(num_pts_to_interp):
-              next_wp_vector = INTERP_DISTANCE_RES * float(j + 1) * wp_uvector
-              wp_interp.append(list(local_waypoints_np[i] + next_wp_vector))
-          # add last waypoint at the end
-          wp_interp.append(list(local_waypoints_np[-1]))
+          wp_interp, wp_interp_hash = densify(local_waypoints, INTERP_DISTANCE_RES)
 
           # Update the other controller values and controls
           controller.update_waypoints(wp_interp)
@@ -819,7 +802,7 @@ def exec_waypoint_nav_demo(args):
       ###
       # Controller Update
       ###
-      if local_waypoints != None and local_waypoints != []:
+      if local_waypoints is not None and len(local_waypoints) > 0:
         controller.update_values(current_x, current_y, current_yaw,
                                  current_speed,
                                  current_timestamp, frame)
@@ -833,15 +816,16 @@ def exec_waypoint_nav_demo(args):
       # Skip the first frame or if there exists no local paths
       if skip_first_frame and frame == 0:
         pass
-      elif local_waypoints == None:
+      elif local_waypoints is None:
         pass
       else:
         # Update live plotter with new feedback
         trajectory_fig.roll("trajectory", current_x, current_y)
         trajectory_fig.roll("car", current_x, current_y)
-        if lead_car_pos:    # If there exists a lead car, plot it
-          trajectory_fig.roll("leadcar", lead_car_pos[1][0],
-                              lead_car_pos[1][1])
+        if bp._lead_vehicle_id in lead_car_ids:    # If there exists a lead car, plot it
+          lead_car_index = lead_car_ids.index(bp._lead_vehicle_id)
+          trajectory_fig.roll("leadcar", lead_car_pos[lead_car_index][0],
+                              lead_car_pos[lead_car_index][1])
         forward_speed_fig.roll("forward_speed",
                                current_timestamp,
                                current_speed)
@@ -854,31 +838,28 @@ def exec_waypoint_nav_demo(args):
 
         # Local path plotter update
         if frame % LP_FREQUENCY_DIVISOR == 0:
-          path_counter = 0
           for i in range(NUM_PATHS):
             # If a path was invalid in the set, there is no path to plot.
             if path_validity[i]:
               # Colour paths according to collision checking.
-              if not collision_check_array[path_counter]:
+              if not collision_check_array[i]:
                 colour = 'r'
               elif i == best_index:
                 colour = 'k'
               else:
                 colour = 'b'
-              trajectory_fig.update("local_path " + str(i), paths[path_counter][0], paths[path_counter][1], colour)
-              path_counter += 1
+              trajectory_fig.update("local_path " + str(i), paths[i][0], paths[i][1], colour)
             else:
               trajectory_fig.update("local_path " + str(i), [ego_state[0]], [ego_state[1]], 'r')
         # When plotting lookahead path, only plot a number of points
         # (INTERP_MAX_POINTS_PLOT amount of points). This is meant
         # to decrease load when live plotting
-        wp_interp_np = np.array(wp_interp)
         path_indices = np.floor(np.linspace(0,
-                                            wp_interp_np.shape[0] - 1,
+                                            wp_interp.shape[0] - 1,
                                             INTERP_MAX_POINTS_PLOT))
         trajectory_fig.update("selected_path",
-                              wp_interp_np[path_indices.astype(int), 0],
-                              wp_interp_np[path_indices.astype(int), 1],
+                              wp_interp[path_indices.astype(int), 0],
+                              wp_interp[path_indices.astype(int), 1],
                               new_colour=[1, 0.5, 0.0])
 
         # Refresh the live plot based on the refresh rate
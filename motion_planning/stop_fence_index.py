@@ -0,0 +1,124 @@
+"""
+Static index of stop sign fences against the segments of a route.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def _cross_sign(v1, v2):
+  return np.sign(v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0])
+
+
+def _on_segment(p1, p2, p3):
+  # Checks if p2 lies on segment p1-p3, if p1, p2, p3 are collinear.
+  return ((p2[:, 0] <= np.maximum(p1[:, 0], p3[:, 0])) &
+          (p2[:, 0] >= np.minimum(p1[:, 0], p3[:, 0])) &
+          (p2[:, 1] <= np.maximum(p1[:, 1], p3[:, 1])) &
+          (p2[:, 1] >= np.minimum(p1[:, 1], p3[:, 1])))
+
+
+def segments_intersect(wp_1, wp_2, s_1, s_2):
+  """Vectorized segment intersection test of check_for_stop_signs().
+
+  args:
+      wp_1, wp_2: Arrays of shape (K, 2) of waypoint segment endpoints.
+      s_1, s_2: Arrays of shape (K, 2) of stop fence endpoints.
+  returns:
+      intersect: Boolean array of shape (K,), true where the kth waypoint
+          segment intersects the kth stop fence.
+  """
+  v1 = wp_2 - wp_1
+  sign_1 = _cross_sign(v1, s_1 - wp_2)
+  sign_2 = _cross_sign(v1, s_2 - wp_2)
+  v1 = s_2 - s_1
+  sign_3 = _cross_sign(v1, wp_1 - s_2)
+  sign_4 = _cross_sign(v1, wp_2 - s_2)
+
+  # Check if the line segments intersect, or if the collinearity cases hold.
+  return (((sign_1 != sign_2) & (sign_3 != sign_4)) |
+          ((sign_1 == 0) & _on_segment(wp_1, s_1, wp_2)) |
+          ((sign_2 == 0) & _on_segment(wp_1, s_2, wp_2)) |
+          ((sign_3 == 0) & _on_segment(s_1, wp_1, s_2)) |
+          ((sign_3 == 0) & _on_segment(s_1, wp_2, s_2)))
+
+
+class StopFenceIndex:
+  """Spatial index of stop sign fences.
+
+  The fences are bucketed in a KD-tree over their midpoints, so each route
+  segment is only tested against the fences close enough to reach it. As
+  both the route and the fences are static, the first fence crossing from
+  every waypoint onwards can be computed once per route, which turns the
+  stop sign check of a planning tick into a lookup.
+
+  args:
+      stopsign_fences: List of stop sign fences in the format
+          [[x0, y0, x1, y1], ...].
+  """
+
+  def __init__(self, stopsign_fences):
+    self._fences = np.asarray(stopsign_fences, dtype=float).reshape(-1, 4)
+    self._midpoints = 0.5 * (self._fences[:, 0:2] + self._fences[:, 2:4])
+    self._half_length = 0.5 * np.hypot(self._fences[:, 2] - self._fences[:, 0],
+                                       self._fences[:, 3] - self._fences[:, 1])
+    self._tree = cKDTree(self._midpoints) if len(self._fences) > 0 else None
+
+  def crossing_segments(self, waypoints):
+    """Returns which route segments cross a stop sign fence.
+
+    args:
+        waypoints: Waypoints in the format [[x0, y0, v0], [x1, y1, v1], ...].
+    returns:
+        crossing: Boolean array of shape (len(waypoints) - 1,), true where
+            the segment from waypoint i to waypoint i + 1 crosses a fence.
+    """
+    num_segments = max(len(waypoints) - 1, 0)
+    crossing = np.zeros(num_segments, dtype=bool)
+    if num_segments == 0 or self._tree is None:
+      return crossing
+
+    points = np.asarray(waypoints, dtype=float)[:, :2]
+    wp_1 = points[:-1]
+    wp_2 = points[1:]
+    midpoints = 0.5 * (wp_1 + wp_2)
+    half_length = 0.5 * np.hypot(wp_2[:, 0] - wp_1[:, 0],
+                                 wp_2[:, 1] - wp_1[:, 1])
+    # A fence can only cross a segment if their midpoints are closer than
+    # the sum of their half lengths. Older scipy versions only take a single
+    # query radius, so the candidates within the largest one are filtered.
+    candidates = self._tree.query_ball_point(
+        midpoints, np.max(half_length) + np.max(self._half_length) + 1e-9)
+    counts = np.array([len(c) for c in candidates])
+    if not np.any(counts):
+      return crossing
+    segment = np.repeat(np.arange(num_segments), counts)
+    fence = np.concatenate([c for c in candidates if c]).astype(int)
+    offsets = midpoints[segment] - self._midpoints[fence]
+    near = np.hypot(offsets[:, 0], offsets[:, 1]) <= \
+        half_length[segment] + self._half_length[fence] + 1e-9
+    segment = segment[near]
+    fence = fence[near]
+
+    intersect = segments_intersect(wp_1[segment], wp_2[segment],
+                                   self._fences[fence, 0:2],
+                                   self._fences[fence, 2:4])
+    crossing[segment[intersect]] = True
+    return crossing
+
+  def first_crossings(self, waypoints):
+    """Returns the first fence crossing from every waypoint onwards.
+
+    args:
+        waypoints: Waypoints in the format [[x0, y0, v0], [x1, y1, v1], ...].
+    returns:
+        first_crossing: Integer array of shape (len(waypoints),), where
+            first_crossing[i] is the smallest j >= i such that the segment
+            from waypoint j to waypoint j + 1 crosses a fence, or
+            len(waypoints) if there is none.
+    """
+    num_points = len(waypoints)
+    first_crossing = np.full(num_points, num_points, dtype=int)
+    crossing = self.crossing_segments(waypoints)
+    first_crossing[:-1][crossing] = np.flatnonzero(crossing)
+    return np.minimum.accumulate(first_crossing[::-1])[::-1]
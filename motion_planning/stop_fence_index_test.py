@@ -0,0 +1,77 @@
+import numpy as np
+import unittest
+
+import behavioural_planner
+from stop_fence_index import StopFenceIndex
+
+
+def cross(v1, v2):
+  return v1[0] * v2[1] - v1[1] * v2[0]
+
+
+def crossing_segments(waypoints, stopsign_fences):
+  # The double loop formerly in BehaviouralPlanner.check_for_stop_signs().
+  crossing = []
+  for i in range(len(waypoints) - 1):
+    intersect_flag = False
+    for stopsign_fence in stopsign_fences:
+      wp_1 = np.array(waypoints[i][0:2])
+      wp_2 = np.array(waypoints[i + 1][0:2])
+      s_1 = np.array(stopsign_fence[0:2])
+      s_2 = np.array(stopsign_fence[2:4])
+
+      v1 = np.subtract(wp_2, wp_1)
+      sign_1 = np.sign(cross(v1, np.subtract(s_1, wp_2)))
+      sign_2 = np.sign(cross(v1, np.subtract(s_2, wp_2)))
+      v1 = np.subtract(s_2, s_1)
+      sign_3 = np.sign(cross(v1, np.subtract(wp_1, s_2)))
+      sign_4 = np.sign(cross(v1, np.subtract(wp_2, s_2)))
+
+      if (sign_1 != sign_2) and (sign_3 != sign_4):
+        intersect_flag = True
+      if (sign_1 == 0) and behavioural_planner.pointOnSegment(wp_1, s_1, wp_2):
+        intersect_flag = True
+      if (sign_2 == 0) and behavioural_planner.pointOnSegment(wp_1, s_2, wp_2):
+        intersect_flag = True
+      if (sign_3 == 0) and behavioural_planner.pointOnSegment(s_1, wp_1, s_2):
+        intersect_flag = True
+      if (sign_3 == 0) and behavioural_planner.pointOnSegment(s_1, wp_2, s_2):
+        intersect_flag = True
+    crossing.append(intersect_flag)
+  return np.array(crossing, dtype=bool)
+
+
+class StopFenceIndexTest(unittest.TestCase):
+
+  def test_matches_double_loop(self):
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+      # Points on a coarse grid, so that fences often touch or are
+      # collinear with the route.
+      waypoints = np.column_stack((
+          np.cumsum(rng.randint(-2, 4, size=40)),
+          np.cumsum(rng.randint(-3, 4, size=40)),
+          np.full(40, 5.0))).astype(float)
+      fences = np.tile(rng.randint(-10, 60, size=(15, 2)), 2)
+      fences[:, 2:4] += rng.randint(-4, 5, size=(15, 2))
+      fences = fences.astype(float)
+      expected = crossing_segments(waypoints, fences)
+      np.testing.assert_array_equal(
+          StopFenceIndex(fences).crossing_segments(waypoints), expected)
+
+  def test_first_crossings(self):
+    waypoints = [[float(x), 0.0, 5.0] for x in range(10)]
+    index = StopFenceIndex([[2.5, -1.0, 2.5, 1.0], [6.0, -1.0, 6.0, 1.0]])
+    # The fence on waypoint 6 is crossed by the segments on either side.
+    np.testing.assert_array_equal(index.first_crossings(waypoints),
+                                  [2, 2, 2, 5, 5, 5, 6, 10, 10, 10])
+
+  def test_no_fences(self):
+    index = StopFenceIndex([])
+    np.testing.assert_array_equal(index.first_crossings([[0.0, 0.0, 5.0],
+                                                         [1.0, 0.0, 5.0]]),
+                                  [2, 2])
+
+
+if __name__ == '__main__':
+  unittest.main()
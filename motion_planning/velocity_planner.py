@@ -16,7 +16,8 @@ class VelocityPlanner:
     self._a_max = a_max
     self._slow_speed = slow_speed
     self._stop_line_buffer = stop_line_buffer
-    self._prev_trajectory = [[0.0, 0.0, 0.0]]
+    self._prev_trajectory = np.zeros((1, 3))
+    self._prev_arrival_times = np.zeros(1)
 
   # Computes an open loop speed estimate based on the previously planned
   # trajectory, and the timestep since the last planning cycle.
@@ -30,29 +31,41 @@ class VelocityPlanner:
     if timestep < 1e-4:
       return self._prev_trajectory[0][2]
 
-    for i in range(len(self._prev_trajectory) - 1):
-      distance_step = np.linalg.norm(np.subtract(self._prev_trajectory[i + 1][0:2],
-                                                 self._prev_trajectory[i][0:2]))
-      velocity = self._prev_trajectory[i][2]
-      time_delta = distance_step / velocity
-
-      # If time_delta exceeds the remaining time in our simulation timestep,
-      # interpolate between the velocity of the current step and the velocity
-      # of the next step to estimate the open loop velocity.
-      if time_delta > timestep:
-        v1 = self._prev_trajectory[i][2]
-        v2 = self._prev_trajectory[i + 1][2]
-        v_delta = v2 - v1
-        interpolation_ratio = timestep / time_delta
-        return v1 + interpolation_ratio * v_delta
-
-      # Otherwise, keep checking.
-      else:
-        timestep -= time_delta
-
-    # Simulation time step exceeded the length of the path, which means we have likely
-    # stopped. Return the end velocity of the trajectory.
-    return self._prev_trajectory[-1][2]
+    return float(self.get_open_loop_speeds(timestep))
+
+  def get_open_loop_speeds(self, timesteps):
+    """Batched open loop speed estimates along the previous trajectory.
+
+    Looks up the segment of the previously planned trajectory reached
+    after each timestep in its cumulative time of arrival, and interpolates
+    between the speeds at both ends of that segment.
+
+    args:
+        timesteps: Time (s) or array of times since the last planning cycle.
+    returns:
+        speeds: Open loop speed (m/s) at each of the timesteps, with the
+            shape of timesteps. Times past the end of the trajectory give
+            its end speed, which means we have likely stopped.
+    """
+    timesteps = np.asarray(timesteps, dtype=float)
+    speeds = self._prev_trajectory[:, 2]
+    if len(speeds) == 1:
+      return np.full(timesteps.shape, speeds[0])
+    arrival_times = self._prev_arrival_times
+    # Index of the segment each timestep falls into.
+    index = np.searchsorted(arrival_times[1:], timesteps, side='right')
+    segment = np.minimum(index, len(speeds) - 2)
+    start_times = arrival_times[segment]
+    durations = arrival_times[segment + 1] - start_times
+    # Segments that are never left (zero speed) hold their start speed.
+    with np.errstate(invalid='ignore'):
+      ratio = np.where(np.isfinite(durations),
+                       (timesteps - start_times) / durations, 0.0)
+    result = speeds[segment] + ratio * (speeds[segment + 1] - speeds[segment])
+    result = np.where(index >= len(speeds) - 1, speeds[-1], result)
+    # The start of the trajectory is used for very small timesteps.
+    result = np.where(timesteps < 1e-4, speeds[0], result)
+    return result
 
   def compute_velocity_profile(self, path, desired_speed, ego_state,
                                closed_loop_speed, decelerate_to_stop,
@@ -67,6 +80,7 @@ class VelocityPlanner:
                     t_points: List of yaw values (rad)
                 Example of accessing the ith point's y value:
                     paths[1][i]
+            A (3, M) path of a PathSet can be passed directly.
             It is assumed that the stop line is at the end of the path.
         desired_speed: speed which the vehicle should reach (m/s)
         ego_state: ego state vector for the vehicle, in the global frame.
@@ -94,7 +108,7 @@ class VelocityPlanner:
     returns:
         profile: Updated profile which contains the local path as well as
             the speed to be tracked by the controller (global frame).
-            Length and speed in m and m/s.
+            Length and speed in m and m/s, as an array of shape (M, 3).
             Format: [[x0, y0, v0],
                      [x1, y1, v1],
                      ...,
@@ -106,7 +120,6 @@ class VelocityPlanner:
                 profile[5]:
                 returns [x5, y5, v5] (6th point in the local path)
     """
-    profile = []
     # For our profile, use the open loop speed as our initial speed.
     start_speed = ego_state[3]
     # Generate a trapezoidal profile to decelerate to stop.
@@ -127,14 +140,12 @@ class VelocityPlanner:
     # This prevents the myopic controller from getting stuck at the zeroth
     # state.
     if len(profile) > 1:
-      interpolated_state = [(profile[1][0] - profile[0][0]) * 0.1 + profile[0][0],
-                            (profile[1][1] - profile[0][1]) * 0.1 + profile[0][1],
-                            (profile[1][2] - profile[0][2]) * 0.1 + profile[0][2]]
-      del profile[0]
-      profile.insert(0, interpolated_state)
+      profile[0] += (profile[1] - profile[0]) * 0.1
 
-    # Save the planned profile for open loop speed estimation.
+    # Save the planned profile and its time of arrival at each point for
+    # open loop speed estimation.
     self._prev_trajectory = profile
+    self._prev_arrival_times = arrival_times(profile)
 
     return profile
 
@@ -162,7 +173,7 @@ class VelocityPlanner:
     returns:
         profile: deceleration profile which contains the local path as well
             as the speed to be tracked by the controller (global frame).
-            Length and speed in m and m/s.
+            Length and speed in m and m/s, as an array of shape (M, 3).
             Format: [[x0, y0, v0],
                      [x1, y1, v1],
                      ...,
@@ -174,9 +185,10 @@ class VelocityPlanner:
                 profile[5]:
                 returns [x5, y5, v5] (6th point in the local path)
     """
-    profile = []
     slow_speed = self._slow_speed
     stop_line_buffer = self._stop_line_buffer
+    path_x, path_y, arc_length = path_arc_length(path)
+    path_length = arc_length[-1]
 
     # Using d = (v_f^2 - v_i^2) / (2 * a), compute the two distances
     # used in the trapezoidal stop behaviour. decel_distance goes from
@@ -185,47 +197,24 @@ class VelocityPlanner:
     decel_distance = calc_distance(start_speed, slow_speed, -self._a_max)
     brake_distance = calc_distance(slow_speed, 0, -self._a_max)
 
-    # compute total path length
-    path_length = 0.0
-    for i in range(len(path[0]) - 1):
-      path_length += np.linalg.norm([path[0][i + 1] - path[0][i],
-                                     path[1][i + 1] - path[1][i]])
-
-    stop_index = len(path[0]) - 1
-    temp_dist = 0.0
-    # Compute the index at which we should stop.
-    while (stop_index > 0) and (temp_dist < stop_line_buffer):
-      temp_dist += np.linalg.norm([path[0][stop_index] - path[0][stop_index - 1],
-                                   path[1][stop_index] - path[1][stop_index - 1]])
-      stop_index -= 1
+    # Compute the index at which we should stop, which is the last point
+    # at least stop_line_buffer away from the end of the path.
+    stop_index = last_index_before(arc_length, path_length - stop_line_buffer)
 
+    speeds = np.zeros(arc_length.shape[0])
     # If the brake distance exceeds the length of the path, then we cannot
     # perform a smooth deceleration and require a harder deceleration. Build
     # the path up in reverse to ensure we reach zero speed at the required
     # time.
     if brake_distance + decel_distance + stop_line_buffer > path_length:
-      speeds = []
-      vf = 0.0
-      # The speeds past the stop line buffer should be zero.
-      for i in reversed(range(stop_index, len(path[0]))):
-        speeds.insert(0, 0.0)
-      # The rest of the speeds should be a linear ramp from zero,
-      # decelerating at -self._a_max.
-      for i in reversed(range(stop_index)):
-        dist = np.linalg.norm([path[0][i + 1] - path[0][i],
-                               path[1][i + 1] - path[1][i]])
-        vi = calc_final_speed(vf, self._a_max, dist)
-        # We don't want to have points above the starting speed
-        # along our profile, so clamp to start_speed.
-        if vi > start_speed:
-          vi = start_speed
-
-        speeds.insert(0, vi)
-        vf = vi
-
-      # Generate the profile, given the computed speeds.
-      for i in range(len(speeds)):
-        profile.append([path[0][i], path[1][i], speeds[i]])
+      # The speeds past the stop line buffer should be zero, and the rest
+      # should be a linear ramp from zero, decelerating at -self._a_max
+      # towards the stop point. We don't want to have points above the
+      # starting speed along our profile, so clamp to start_speed.
+      speeds[:stop_index] = np.minimum(
+          calc_final_speeds(0.0, self._a_max,
+                            arc_length[stop_index] - arc_length[:stop_index]),
+          start_speed)
 
     # Otherwise, we will perform a full trapezoidal profile. The
     # brake_index will be the index of the path at which we start
@@ -233,60 +222,41 @@ class VelocityPlanner:
     # decelerating to our slow_speed. These two indices denote the
     # endpoints of the ramps in our trapezoidal profile.
     else:
-      brake_index = stop_index
-      temp_dist = 0.0
       # Compute the index at which to start braking down to zero.
-      while (brake_index > 0) and (temp_dist < brake_distance):
-        temp_dist += np.linalg.norm([path[0][brake_index] - path[0][brake_index - 1],
-                                     path[1][brake_index] - path[1][brake_index - 1]])
-        brake_index -= 1
-
-      # Compute the index to stop decelerating to the slow speed.  This is
-      # done by stepping through the points until accumulating
-      # decel_distance of distance to said index, starting from the the
-      # start of the path.
-      decel_index = 0
-      temp_dist = 0.0
-      while (decel_index < brake_index) and (temp_dist < decel_distance):
-        temp_dist += np.linalg.norm([path[0][decel_index + 1] - path[0][decel_index],
-                                     path[1][decel_index + 1] - path[1][decel_index]])
-        decel_index += 1
+      brake_index = last_index_before(arc_length[:stop_index + 1],
+                                      arc_length[stop_index] - brake_distance)
+
+      # Compute the index to stop decelerating to the slow speed, which is
+      # the first point at least decel_distance away from the start of the
+      # path.
+      decel_index = min(int(np.searchsorted(arc_length, decel_distance)),
+                        brake_index)
 
       # The speeds from the start to decel_index should be a linear ramp
       # from the current speed down to the slow_speed, decelerating at
-      # -self._a_max.
-      vi = start_speed
-      for i in range(decel_index):
-        dist = np.linalg.norm([path[0][i + 1] - path[0][i],
-                               path[1][i + 1] - path[1][i]])
-        vf = calc_final_speed(vi, -self._a_max, dist)
-        # We don't want to overshoot our slow_speed, so clamp it to that.
-        if vf < slow_speed:
-          vf = slow_speed
-
-        profile.append([path[0][i], path[1][i], vi])
-        vi = vf
+      # -self._a_max. We don't want to overshoot our slow_speed, so clamp
+      # it to that.
+      speeds[:decel_index + 1] = np.maximum(
+          calc_final_speeds(start_speed, -self._a_max,
+                            arc_length[:decel_index + 1]),
+          slow_speed)
+      speeds[0] = start_speed
 
       # In this portion of the profile, we are maintaining our slow_speed.
-      for i in range(decel_index, brake_index):
-        profile.append([path[0][i], path[1][i], vi])
+      speeds[decel_index:brake_index] = speeds[decel_index]
 
       # The speeds from the brake_index to stop_index should be a
       # linear ramp from the slow_speed down to the 0, decelerating at
       # -self._a_max.
-      for i in range(brake_index, stop_index):
-        dist = np.linalg.norm([path[0][i + 1] - path[0][i],
-                               path[1][i + 1] - path[1][i]])
-        vf = calc_final_speed(vi, -self._a_max, dist)
-        profile.append([path[0][i], path[1][i], vi])
-        vi = vf
+      speeds[brake_index:stop_index] = calc_final_speeds(
+          speeds[decel_index], -self._a_max,
+          arc_length[brake_index:stop_index] - arc_length[brake_index])
 
       # The rest of the profile consists of our stop_line_buffer, so
       # it contains zero speed for all points.
-      for i in range(stop_index, len(path[0])):
-        profile.append([path[0][i], path[1][i], 0.0])
+      speeds[stop_index:] = 0.0
 
-    return profile
+    return np.column_stack((path_x, path_y, speeds))
 
   # Computes a profile for following a lead vehicle..
   def follow_profile(self, path, start_speed, desired_speed, lead_car_state):
@@ -315,7 +285,7 @@ class VelocityPlanner:
         profile: Updated follow vehicle profile which contains the local
             path as well as the speed to be tracked by the controller 
             (global frame).
-            Length and speed in m and m/s.
+            Length and speed in m and m/s, as an array of shape (M, 3).
             Format: [[x0, y0, v0],
                      [x1, y1, v1],
                      ...,
@@ -327,59 +297,36 @@ class VelocityPlanner:
                 profile[5]:
                 returns [x5, y5, v5] (6th point in the local path)
     """
-    profile = []
     # Find the closest point to the lead vehicle on our planned path.
-    min_index = len(path[0]) - 1
-    min_dist = float('Inf')
-    for i in range(len(path)):
-      dist = np.linalg.norm([path[0][i] - lead_car_state[0],
-                             path[1][i] - lead_car_state[1]])
-      if dist < min_dist:
-        min_dist = dist
-        min_index = i
+    path_x, path_y, arc_length = path_arc_length(path)
+    lead_distances = np.hypot(path_x - lead_car_state[0],
+                              path_y - lead_car_state[1])
+    min_index = int(np.argmin(lead_distances))
+    min_dist = lead_distances[min_index]
 
     # Compute the time gap point, assuming our velocity is held constant at
     # the minimum of the desired speed and the ego vehicle's velocity, from
-    # the closest point to the lead vehicle on our planned path.
+    # the closest point to the lead vehicle on our planned path. Stepping
+    # back from min_index only increases the distance to the lead vehicle,
+    # so the ramp ends at min_index if it is within the distance gap, and at
+    # the start of the path otherwise.
     desired_speed = min(lead_car_state[2], desired_speed)
-    ramp_end_index = min_index
-    distance = min_dist
     distance_gap = desired_speed * self._time_gap
-    while (ramp_end_index > 0) and (distance > distance_gap):
-      distance += np.linalg.norm([path[0][ramp_end_index] - path[0][ramp_end_index - 1],
-                                  path[1][ramp_end_index] - path[1][ramp_end_index - 1]])
-      ramp_end_index -= 1
+    ramp_end_index = min_index if min_dist <= distance_gap else 0
 
     # We now need to reach the ego vehicle's speed by the time we reach the
     # time gap point, ramp_end_index, which therefore is the end of our ramp
-    # velocity profile.
-    decel_distance = 0.0
-    if desired_speed < start_speed:
-      decel_distance = calc_distance(start_speed, desired_speed, -self._a_max)
-    else:
-      decel_distance = calc_distance(start_speed, desired_speed, self._a_max)
-
-    # Here we will compute the speed profile from our initial speed to the
-    # end of the ramp.
-    vi = start_speed
-    for i in range(ramp_end_index + 1):
-      dist = np.linalg.norm([path[0][i + 1] - path[0][i],
-                             path[1][i + 1] - path[1][i]])
-      if desired_speed < start_speed:
-        vf = calc_final_speed(vi, -self._a_max, dist)
-      else:
-        vf = calc_final_speed(vi, self._a_max, dist)
-
-      profile.append([path[0][i], path[1][i], vi])
-      vi = vf
+    # velocity profile. Here we will compute the speed profile from our
+    # initial speed to the end of the ramp.
+    a = -self._a_max if desired_speed < start_speed else self._a_max
+    speeds = np.full(arc_length.shape[0], desired_speed, dtype=float)
+    speeds[:ramp_end_index + 1] = calc_final_speeds(
+        start_speed, a, arc_length[:ramp_end_index + 1])
 
     # Once we hit the time gap point, we need to be at the desired speed.
-    # If we can't get there using a_max, do an abrupt change in the profile
-    # to use the controller to decelerate more quickly.
-    for i in range(ramp_end_index + 1, len(path[0])):
-      profile.append([path[0][i], path[1][i], desired_speed])
-
-    return profile
+    # If we can't get there using a_max, the abrupt change in the profile
+    # makes the controller decelerate more quickly.
+    return np.column_stack((path_x, path_y, speeds))
 
   # Computes a profile for nominal speed tracking.
   def nominal_profile(self, path, start_speed, desired_speed):
@@ -401,7 +348,7 @@ class VelocityPlanner:
     returns:
         profile: Updated nominal speed profile which contains the local path
             as well as the speed to be tracked by the controller (global frame).
-            Length and speed in m and m/s.
+            Length and speed in m and m/s, as an array of shape (M, 3).
             Format: [[x0, y0, v0],
                      [x1, y1, v1],
                      ...,
@@ -413,48 +360,66 @@ class VelocityPlanner:
                 profile[5]:
                 returns [x5, y5, v5] (6th point in the local path)
     """
-    profile = []
-    # Compute distance travelled from start speed to desired speed using
-    # a constant acceleration.
+    path_x, path_y, arc_length = path_arc_length(path)
+
+    # Ramp from the start speed towards the desired speed at a_max. The
+    # ramp ends once the desired speed is reached, after which the profile
+    # is clamped to track the desired speed.
     if desired_speed < start_speed:
-      accel_distance = calc_distance(start_speed, desired_speed, -self._a_max)
+      speeds = np.maximum(
+          calc_final_speeds(start_speed, -self._a_max, arc_length),
+          desired_speed)
     else:
-      accel_distance = calc_distance(start_speed, desired_speed, self._a_max)
-
-    # Here we will compute the end of the ramp for our velocity profile.
-    # At the end of the ramp, we will maintain our final speed.
-    ramp_end_index = 0
-    distance = 0.0
-    while (ramp_end_index < len(path[0]) - 1) and (distance < accel_distance):
-      distance += np.linalg.norm([path[0][ramp_end_index + 1] - path[0][ramp_end_index],
-                                  path[1][ramp_end_index + 1] - path[1][ramp_end_index]])
-      ramp_end_index += 1
-
-    # Here we will actually compute the velocities along the ramp.
-    vi = start_speed
-    for i in range(ramp_end_index):
-      dist = np.linalg.norm([path[0][i + 1] - path[0][i],
-                             path[1][i + 1] - path[1][i]])
-      if desired_speed < start_speed:
-        vf = calc_final_speed(vi, -self._a_max, dist)
-        # clamp speed to desired speed
-        if vf < desired_speed:
-          vf = desired_speed
-      else:
-        vf = calc_final_speed(vi, self._a_max, dist)
-        # clamp speed to desired speed
-        if vf > desired_speed:
-          vf = desired_speed
-
-      profile.append([path[0][i], path[1][i], vi])
-      vi = vf
-
-    # If the ramp is over, then for the rest of the profile we should
-    # track the desired speed.
-    for i in range(ramp_end_index + 1, len(path[0])):
-      profile.append([path[0][i], path[1][i], desired_speed])
+      speeds = np.minimum(
+          calc_final_speeds(start_speed, self._a_max, arc_length),
+          desired_speed)
 
-    return profile
+    return np.column_stack((path_x, path_y, speeds))
+
+
+def path_arc_length(path):
+  """Returns the x, y and cumulative arc length arrays of a path.
+
+  args:
+      path: Path of the format [x_points, y_points, t_points], or a
+          (3, M) array.
+  returns:
+      path_x: Array of M x values (m).
+      path_y: Array of M y values (m).
+      arc_length: Array of M arc length values (m) from the first point.
+  """
+  path_x = np.asarray(path[0], dtype=float)
+  path_y = np.asarray(path[1], dtype=float)
+  arc_length = np.zeros(path_x.shape[0])
+  np.cumsum(np.hypot(np.diff(path_x), np.diff(path_y)), out=arc_length[1:])
+  return path_x, path_y, arc_length
+
+
+def arrival_times(profile):
+  """Returns the time of arrival at each point of a velocity profile.
+
+  Each segment is travelled at the speed of its first point, so segments
+  starting at zero speed are never left and take an infinite time.
+
+  args:
+      profile: Array of shape (M, 3) of [x, y, v] points.
+  returns:
+      times: Array of M times of arrival (s) from the first point.
+  """
+  _, _, arc_length = path_arc_length(profile.T)
+  speeds = profile[:-1, 2]
+  durations = np.full(speeds.shape[0], np.inf)
+  np.divide(np.diff(arc_length), speeds, out=durations, where=speeds > 0)
+  times = np.zeros(profile.shape[0])
+  np.cumsum(durations, out=times[1:])
+  return times
+
+
+def last_index_before(arc_length, distance):
+  """Returns the last index of an arc length array whose arc length is at
+  most distance, or 0 if there is none.
+  """
+  return max(int(np.searchsorted(arc_length, distance, side='right')) - 1, 0)
 
 
 def calc_distance(v_i, v_f, a):
@@ -486,3 +451,16 @@ def calc_final_speed(v_i, a, d):
   dist = v_i**2 + 2 * a * d
   v_f = sqrt(dist) if dist > 0 else 0
   return v_f
+
+
+def calc_final_speeds(v_i, a, d):
+  """Vectorized version of calc_final_speed() over an array of distances.
+
+  args:
+      v_i: initial speed (m/s)
+      a: acceleration (m/s^2)
+      d: array of distances to be travelled (m)
+  returns:
+      v_f: array of final speeds (m/s)
+  """
+  return np.sqrt(np.maximum(v_i**2 + 2 * a * np.asarray(d, dtype=float), 0.0))
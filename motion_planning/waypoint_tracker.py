@@ -0,0 +1,135 @@
+"""
+Incremental closest waypoint search shared by the planners and controller.
+"""
+
+import numpy as np
+from math import sqrt
+from scipy.spatial import cKDTree
+
+
+class WaypointTracker:
+  """Tracks the waypoint closest to the vehicle from one tick to the next.
+
+  The vehicle moves little between ticks, so the closest waypoint is
+  searched in a window of waypoints around the previous closest index. When
+  the closest waypoint in the window lies on its edge, the true closest may
+  be outside, and the window moves on to be centered on it, up to max_steps
+  times. The search falls back to all of the waypoints when there is no
+  previous index (after a reset), when the vehicle jumped by more than
+  jump_distance since the last query, or when the window ran out of steps.
+  Routes of at least tree_size waypoints are searched with a KD-tree, built
+  on the first fallback, and shorter ones with a vectorized scan.
+
+  Waypoints are compared by identity: pass a new waypoint list to
+  set_waypoints() rather than modifying the current one in place.
+
+  args:
+      waypoints: Optional waypoints to track, in the format
+          [[x0, y0, ...], [x1, y1, ...], ...].
+      window: Number of waypoints searched on either side of the previous
+          closest index.
+      max_steps: Number of times the window may move before falling back to
+          all of the waypoints.
+      jump_distance: Distance (m) travelled between two queries past which
+          the previous closest index is not trusted.
+      tree_size: Number of waypoints from which the fallback search uses a
+          KD-tree.
+  """
+
+  def __init__(self, waypoints=None, window=32, max_steps=8,
+               jump_distance=5.0, tree_size=5000):
+    self._window = window
+    self._max_steps = max_steps
+    self._jump_distance = jump_distance
+    self._tree_size = tree_size
+    self._source = None
+    self._points = np.zeros((0, 2))
+    self._tree = None
+    self._index = None
+    self._position = None
+    self._closest_len = float('Inf')
+    if waypoints is not None:
+      self.set_waypoints(waypoints)
+
+  def set_waypoints(self, waypoints, index=None):
+    """Sets the waypoints to track, unless they are already being tracked.
+
+    args:
+        waypoints: Waypoints in the format [[x0, y0, ...], [x1, y1, ...], ...].
+        index: Optional guess of the closest waypoint index to start the
+            windowed search from, e.g. 0 for a path starting at the vehicle.
+    """
+    if waypoints is self._source:
+      return
+    self._source = waypoints
+    if len(waypoints) == 0:
+      self._points = np.zeros((0, 2))
+    else:
+      self._points = np.ascontiguousarray(
+          np.asarray(waypoints, dtype=float)[:, :2])
+    self._tree = None
+    self._position = None
+    self._index = index if len(self._points) > 0 else None
+
+  def reset(self):
+    """Forgets the previous closest index, forcing a global search."""
+    self._index = None
+    self._position = None
+
+  def get_closest_index(self, x, y):
+    """Gets the index of the waypoint closest to a position.
+
+    args:
+        x: x position (m) of the vehicle.
+        y: y position (m) of the vehicle.
+    returns:
+        [closest_len, closest_index]:
+            closest_len: length (m) to the closest waypoint from the vehicle.
+            closest_index: index of the waypoint which is closest to the
+                vehicle, or 0 if there are no waypoints.
+    """
+    num_points = len(self._points)
+    if num_points == 0:
+      return float('Inf'), 0
+
+    # Queries at the same position in a tick share the result.
+    if self._position == (x, y) and self._index is not None:
+      return self._closest_len, self._index
+
+    index = self._index
+    if index is not None and self._position is not None and \
+        sqrt((x - self._position[0])**2 + (y - self._position[1])**2) > \
+        self._jump_distance:
+      index = None
+
+    for _ in range(self._max_steps if index is not None else 0):
+      lo = max(index - self._window, 0)
+      hi = min(index + self._window + 1, num_points)
+      offsets = self._points[lo:hi] - (x, y)
+      dists = np.einsum('ij,ij->i', offsets, offsets)
+      index = lo + int(np.argmin(dists))
+      # The closest waypoint may lie past the window if it is on its edge,
+      # in which case the window moves on to be centered on it.
+      if (index > lo or lo == 0) and (index < hi - 1 or hi == num_points):
+        closest_len = sqrt(dists[index - lo])
+        break
+    else:
+      closest_len, index = self._search_all(x, y)
+
+    self._index = index
+    self._closest_len = closest_len
+    self._position = (x, y)
+    return closest_len, index
+
+  def _search_all(self, x, y):
+    if len(self._points) < self._tree_size:
+      offsets = self._points - (x, y)
+      dists = np.einsum('ij,ij->i', offsets, offsets)
+      index = int(np.argmin(dists))
+      return sqrt(dists[index]), index
+
+    # The tree is only built for routes kept long enough to amortize it.
+    if self._tree is None:
+      self._tree = cKDTree(self._points)
+    closest_len, index = self._tree.query((x, y))
+    return float(closest_len), int(index)
@@ -0,0 +1,76 @@
+import numpy as np
+import unittest
+from unittest import mock
+
+import behavioural_planner
+from waypoint_tracker import WaypointTracker
+
+
+class WaypointTrackerTest(unittest.TestCase):
+
+  def setUp(self):
+    # A winding route of waypoints 1 m apart along x.
+    x_points = np.arange(200.0)
+    self.waypoints = np.column_stack((x_points,
+                                      10.0 * np.sin(x_points / 15.0),
+                                      np.full(200, 5.0))).tolist()
+
+  def check_closest_index(self, tracker, x, y):
+    closest_len, closest_index = tracker.get_closest_index(x, y)
+    expected_len, expected_index = behavioural_planner.get_closest_index(
+        self.waypoints, [x, y, 0.0, 0.0])
+    self.assertEqual(closest_index, expected_index)
+    self.assertAlmostEqual(closest_len, expected_len)
+
+  def test_follows_the_vehicle(self):
+    tracker = WaypointTracker(self.waypoints, window=3)
+    for x in np.linspace(-5.0, 205.0, 500):
+      self.check_closest_index(tracker, x, 10.0 * np.sin(x / 15.0) + 0.5)
+
+  def test_jumps_and_resets(self):
+    tracker = WaypointTracker(self.waypoints, window=3)
+    self.check_closest_index(tracker, 20.0, 8.0)
+    # Jump further along the route.
+    self.check_closest_index(tracker, 120.0, 9.0)
+    tracker.reset()
+    self.check_closest_index(tracker, 60.0, -7.0)
+
+  def test_new_waypoints(self):
+    tracker = WaypointTracker(self.waypoints)
+    self.check_closest_index(tracker, 50.0, 0.0)
+    self.waypoints = self.waypoints[40:]
+    tracker.set_waypoints(self.waypoints, index=0)
+    self.check_closest_index(tracker, 50.0, 0.0)
+
+  def test_dense_path(self):
+    # A local path densified every 0.01 m, which the vehicle passes about 30
+    # points at a time.
+    x_points = np.arange(0.0, 25.0, 0.01)
+    path = np.column_stack((x_points, 2.0 * np.sin(x_points / 5.0)))
+    tracker = WaypointTracker()
+    tracker.set_waypoints(path, index=0)
+    with mock.patch.object(WaypointTracker, '_search_all',
+                           wraps=tracker._search_all) as search_all:
+      for x in np.arange(0.0, 25.0, 0.3):
+        y = 2.0 * np.sin(x / 5.0) - 0.2
+        closest_len, closest_index = tracker.get_closest_index(x, y)
+        dists = np.hypot(path[:, 0] - x, path[:, 1] - y)
+        self.assertEqual(closest_index, np.argmin(dists))
+        self.assertAlmostEqual(closest_len, np.min(dists))
+      search_all.assert_not_called()
+
+  def test_tree_size(self):
+    tracker = WaypointTracker(self.waypoints, tree_size=1000)
+    self.check_closest_index(tracker, 50.0, 0.0)
+    self.assertIsNone(tracker._tree)
+    tracker = WaypointTracker(self.waypoints, tree_size=100)
+    self.check_closest_index(tracker, 50.0, 0.0)
+    self.assertIsNotNone(tracker._tree)
+
+  def test_no_waypoints(self):
+    tracker = WaypointTracker([])
+    self.assertEqual(tracker.get_closest_index(1.0, 2.0), (float('Inf'), 0))
+
+
+if __name__ == '__main__':
+  unittest.main()
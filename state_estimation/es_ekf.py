@@ -0,0 +1,159 @@
+# Streaming error-state EKF, fed one sensor event at a time.
+
+import heapq
+from collections import deque, namedtuple
+
+import numpy as np
+
+from kalman import Kalman
+
+# Estimate of the filter at time t.
+State = namedtuple('State', 't p v q p_cov')
+
+
+def merge_streams(streams):
+  """
+  Merge timestamped sensor streams into one time-ordered stream of events.
+
+  The streams are consumed lazily, so they may be live generators as long as
+  each of them is time-ordered. Events with the same timestamp are ordered
+  as their streams are listed.
+
+  :param streams: List of (name, stream) pairs, where each stream is an
+                  iterable of (t, data) pairs.
+  :return: Iterator of (t, name, data) events.
+  """
+  def events(order, name, stream):
+    for t, data in stream:
+      yield t, order, name, data
+
+  merged = heapq.merge(*[events(order, name, stream)
+                         for order, (name, stream) in enumerate(streams)],
+                       key=lambda event: event[:2])
+  for t, _, name, data in merged:
+    yield t, name, data
+
+
+class EsEkf(Kalman):
+  def __init__(self, g, l_jac, h_jac, var_imu_f, var_imu_w, var_lidar, var_gnss,
+               p_0, v_0, q_0, p_cov_0=None, history=0):
+    """
+    Streaming EKF, which keeps a constant amount of memory.
+
+    The state is propagated on every IMU sample. As in Kalman.predict(), a
+    GNSS or LIDAR measurement is applied at the first IMU sample at or after
+    its timestamp, one measurement per sensor and IMU sample, so feeding the
+    events of merge_streams() with the measurements listed before the IMU
+    gives the same estimates as the offline filter.
+
+    :param g: Gravity vector
+    :param l_jac: Jacobian of the motion model
+    :param h_jac: Jacobian of the measurement model
+    :param var_imu_f: Variance of the IMU specific force
+    :param var_imu_w: Variance of the IMU angular velocity
+    :param var_lidar: Variance of the LIDAR measurements
+    :param var_gnss: Variance of the GNSS measurements
+    :param p_0: Initial position
+    :param v_0: Initial velocity
+    :param q_0: Initial orientation as a wxyz quaternion
+    :param p_cov_0: Initial covariance, zero by default
+    :param history: Number of past estimates kept in a ring buffer, see history()
+    """
+    super().__init__(None, None, None, None, None, g, l_jac, h_jac,
+                     var_imu_f, var_imu_w, var_lidar, var_gnss)
+    self.t = None
+    self.p = np.array(p_0, dtype=float)
+    self.v = np.array(v_0, dtype=float)
+    self.q = np.array(q_0, dtype=float)
+    self.p_cov = np.zeros((9, 9)) if p_cov_0 is None else np.array(p_cov_0, dtype=float)
+    self._imu = None
+    self._gnss = deque()
+    self._lidar = deque()
+
+    self._history_size = history
+    self._history_count = 0
+    self._t_history = np.zeros(history)
+    self._p_history = np.zeros((history, 3))
+    self._v_history = np.zeros((history, 3))
+    self._q_history = np.zeros((history, 4))
+    self._p_cov_history = np.zeros((history, 9, 9))
+
+  def on_imu(self, t, f, w):
+    """
+    Propagate the state to the time of an IMU sample, with the previous
+    sample, then apply the measurements received up to then.
+
+    :param t: Timestamp
+    :param f: IMU specific force
+    :param w: IMU angular velocity
+    """
+    if self._imu is not None:
+      t_km, f_km, w_km = self._imu
+      self.p, self.v, self.q, self.p_cov = self.motion_update(
+          self.p, self.v, self.q, self.p_cov, f_km, w_km, t - t_km)
+
+      if self._gnss and t >= self._gnss[0][0]:
+        self._update(self.var_gnss, self._gnss.popleft()[1])
+      if self._lidar and t >= self._lidar[0][0]:
+        self._update(self.var_lidar, self._lidar.popleft()[1])
+
+    self._imu = (t, np.array(f, dtype=float), np.array(w, dtype=float))
+    self.t = t
+    self._record()
+
+  def on_gnss(self, t, p):
+    """
+    Receive a GNSS position measurement.
+    """
+    self._gnss.append((t, np.array(p, dtype=float)))
+
+  def on_lidar(self, t, p):
+    """
+    Receive a LIDAR position measurement, in the vehicle frame.
+    """
+    self._lidar.append((t, np.array(p, dtype=float)))
+
+  def on_event(self, t, name, data):
+    """
+    Receive an event of merge_streams(), from an 'imu' stream of
+    (t, (f, w)) or a 'gnss' or 'lidar' stream of (t, p).
+    """
+    if name == 'imu':
+      self.on_imu(t, *data)
+    elif name == 'gnss':
+      self.on_gnss(t, data)
+    elif name == 'lidar':
+      self.on_lidar(t, data)
+    else:
+      raise ValueError("Unknown sensor stream '%s'." % name)
+
+  def state(self):
+    """
+    Return a copy of the current estimate, as a State.
+    """
+    return State(self.t, self.p.copy(), self.v.copy(), self.q.copy(), self.p_cov.copy())
+
+  def history(self):
+    """
+    Return the last estimates kept in the ring buffer, oldest first, as a
+    State of arrays with a leading dimension of up to history entries.
+    """
+    count = min(self._history_count, self._history_size)
+    order = (np.arange(count) + self._history_count - count) % max(self._history_size, 1)
+    return State(self._t_history[order], self._p_history[order], self._v_history[order],
+                 self._q_history[order], self._p_cov_history[order])
+
+  def _update(self, sensor_var, y_k):
+    self.p, self.v, self.q, self.p_cov = self.measurement_update(
+        sensor_var, self.p_cov, y_k, self.p, self.v, self.q)
+
+  def _record(self):
+    if self._history_size == 0:
+      return
+    i = self._history_count % self._history_size
+    self._t_history[i] = self.t
+    self._p_history[i] = self.p
+    self._v_history[i] = self.v
+    self._q_history[i] = self.q
+    self._p_cov_history[i] = self.p_cov
+    self._history_count += 1
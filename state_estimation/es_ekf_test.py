@@ -0,0 +1,68 @@
+import numpy as np
+import unittest
+
+from es_ekf import EsEkf, merge_streams
+from kalman_test import make_kalman
+from rotations import quat_from_euler
+
+
+class MergeStreamsTest(unittest.TestCase):
+
+  def test_order(self):
+    events = merge_streams([('a', [(0.0, 1), (2.0, 2)]),
+                            ('b', iter([(0.0, 3), (1.0, 4), (2.0, 5)]))])
+    self.assertEqual(list(events), [(0.0, 'a', 1), (0.0, 'b', 3),
+                                    (1.0, 'b', 4), (2.0, 'a', 2),
+                                    (2.0, 'b', 5)])
+
+
+class EsEkfTest(unittest.TestCase):
+
+  def setUp(self):
+    self.kalman = make_kalman()
+
+  def make_es_ekf(self, history=0):
+    k = self.kalman
+    return EsEkf(k.g, k.l_jac, k.h_jac, k.var_imu_f, k.var_imu_w, k.var_lidar,
+                 k.var_gnss, k.gt.p[0], k.gt.v[0], quat_from_euler(k.gt.r[0]),
+                 history=history)
+
+  def run_es_ekf(self, es_ekf):
+    k = self.kalman
+    states = []
+    for t, name, data in merge_streams([
+        ('gnss', zip(k.gnss.t, k.gnss.data)),
+        ('lidar', zip(k.lidar.t, k.lidar.data)),
+        ('imu', zip(k.imu_f.t, zip(k.imu_f.data, k.imu_w.data)))]):
+      es_ekf.on_event(t, name, data)
+      if name == 'imu':
+        states.append(es_ekf.state())
+    return states
+
+  def test_matches_predict(self):
+    states = self.run_es_ekf(self.make_es_ekf())
+    p_est, v_est, q_est, p_cov = self.kalman.predict()
+    np.testing.assert_array_equal([s.t for s in states], self.kalman.imu_f.t)
+    np.testing.assert_allclose([s.p for s in states], p_est, rtol=0, atol=1e-12)
+    np.testing.assert_allclose([s.v for s in states], v_est, rtol=0, atol=1e-12)
+    np.testing.assert_allclose([s.q for s in states], q_est, rtol=0, atol=1e-12)
+    np.testing.assert_allclose([s.p_cov for s in states], p_cov, rtol=0,
+                               atol=1e-12)
+
+  def test_history(self):
+    es_ekf = self.make_es_ekf(history=50)
+    states = self.run_es_ekf(es_ekf)
+    history = es_ekf.history()
+    self.assertEqual(history.p.shape, (50, 3))
+    np.testing.assert_array_equal(history.t, [s.t for s in states[-50:]])
+    np.testing.assert_array_equal(history.p, [s.p for s in states[-50:]])
+    np.testing.assert_array_equal(history.p_cov,
+                                  [s.p_cov for s in states[-50:]])
+
+  def test_unknown_stream(self):
+    with self.assertRaises(ValueError):
+      self.make_es_ekf().on_event(0.0, 'radar', np.zeros(3))
+
+
+if __name__ == '__main__':
+  unittest.main()
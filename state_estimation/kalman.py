@@ -4,9 +4,9 @@
 # University of Toronto Institute for Aerospace Studies
 
 import numpy as np
-from numpy.linalg import inv
+from scipy.linalg.lapack import dpotrf, dpotrs
 from mpl_toolkits.mplot3d import Axes3D
-from rotations import Quaternion, skew_symmetric
+from rotations import quat_from_axis_angle, quat_from_euler, quat_mult, quat_to_mat
 
 
 class Kalman:
@@ -40,6 +40,17 @@ class Kalman:
     self.var_imu_w = var_imu_w
     self.var_lidar = var_lidar
     self.var_gnss = var_gnss
+    # A measurement model which observes the position only, H = [I 0], lets
+    # the updates slice P instead of multiplying by H.
+    self._h_selects_position = np.array_equal(
+        h_jac, np.eye(h_jac.shape[0], h_jac.shape[1]))
+    self._eye = np.eye(h_jac.shape[1])
+
+    # Buffers reused by every motion_update().
+    self._c_ns = np.empty((3, 3))
+    self._q_from_w = np.empty(4)
+    self._f_jac_km = np.eye(9)
+    self._l_q_l = self.motion_noise_cov()
 
   def wraptopi(self, x):
     """
@@ -55,9 +66,21 @@ class Kalman:
     """
     Measurement update function of EKF.
     """
-    # 3.1 Compute Kalman gain
-    r_cov = np.eye(3) * sensor_var
-    k_gain = p_cov_check @ self.h_jac.T @ np.linalg.inv(self.h_jac @ p_cov_check @ self.h_jac.T + r_cov)
+    # 3.1 Compute Kalman gain, K = P H^T S^-1, from a Cholesky solve with the
+    # innovation covariance S = H P H^T + R.
+    if self._h_selects_position:
+      ph_t = p_cov_check[:, :3]
+      s_cov = p_cov_check[:3, :3].copy()
+    else:
+      ph_t = p_cov_check @ self.h_jac.T
+      s_cov = self.h_jac @ ph_t
+    s_cov.flat[::len(s_cov) + 1] += sensor_var
+    # LAPACK is called directly, the scipy.linalg wrappers cost more than
+    # the solve itself at this size.
+    s_chol, info = dpotrf(s_cov)
+    if info != 0:
+      raise np.linalg.LinAlgError("Innovation covariance is not positive definite.")
+    k_gain = dpotrs(s_chol, ph_t.T)[0].T
 
     # 3.2 Compute error state
     x_error = k_gain @ (y_k - p_check) * 0.9
@@ -65,13 +88,64 @@ class Kalman:
     # 3.3 Correct predicted state
     p_hat = p_check + x_error[:3]
     v_hat = v_check + x_error[3:6]
-    q_hat = Quaternion(axis_angle=x_error[6:9]).quat_mult_left(q_check, out='Quaternion')
+    q_hat = quat_mult(quat_from_axis_angle(x_error[6:9]), q_check)
 
-    # 3.4 Compute corrected covariance
-    p_cov_hat = (np.eye(9) - k_gain @ self.h_jac) @ p_cov_check
+    # 3.4 Compute corrected covariance, in the Joseph form
+    # (I - K H) P (I - K H)^T + K R K^T, which keeps it symmetric and
+    # positive definite despite rounding.
+    if self._h_selects_position:
+      i_kh = self._eye.copy()
+      i_kh[:, :3] -= k_gain
+    else:
+      i_kh = self._eye - k_gain @ self.h_jac
+    p_cov_hat = i_kh @ p_cov_check @ i_kh.T + sensor_var * (k_gain @ k_gain.T)
 
     return p_hat, v_hat, q_hat, p_cov_hat
 
+  def motion_noise_cov(self):
+    """
+    Motion model noise covariance L Q L^T, per unit delta_t**2.
+    """
+    q_cov_km = np.zeros((6, 6))
+    q_cov_km[0:3, 0:3] = np.eye(3) * self.var_imu_f
+    q_cov_km[3:6, 3:6] = np.eye(3) * self.var_imu_w
+    return self.l_jac @ q_cov_km @ self.l_jac.T
+
+  def motion_update(self, p_km, v_km, q_km, p_cov_km, f_km, w_km, delta_t):
+    """
+    Motion update function of EKF, from one IMU sample.
+
+    :param p_km: Position, of shape (3,)
+    :param v_km: Velocity, of shape (3,)
+    :param q_km: Orientation as a wxyz quaternion, of shape (4,)
+    :param p_cov_km: Covariance, of shape (9, 9)
+    :param f_km: IMU specific force, of shape (3,)
+    :param w_km: IMU angular velocity, of shape (3,)
+    :param delta_t: Time step
+    :return: The predicted position, velocity, orientation and covariance.
+    """
+    # 1. Update state with IMU inputs
+    c_ns = quat_to_mat(q_km, out=self._c_ns)
+    c_ns_dot_f_km = c_ns @ f_km
+    p_check = p_km + delta_t * v_km + (delta_t**2 / 2) * (c_ns_dot_f_km + self.g)
+    v_check = v_km + delta_t * (c_ns_dot_f_km + self.g)
+    q_from_w = quat_from_axis_angle(w_km * delta_t, out=self._q_from_w)
+    q_check = quat_mult(q_km, q_from_w)
+
+    # 1.1 Linearize the motion model and compute Jacobians
+    f_jac_km = self._f_jac_km
+    f_jac_km[0:3, 3:6] = np.eye(3) * delta_t
+    # -skew_symmetric(c_ns_dot_f_km) * delta_t
+    f_x, f_y, f_z = c_ns_dot_f_km * delta_t
+    f_jac_km[3, 7], f_jac_km[3, 8] = f_z, -f_y
+    f_jac_km[4, 6], f_jac_km[4, 8] = -f_z, f_x
+    f_jac_km[5, 6], f_jac_km[5, 7] = f_y, -f_x
+
+    # 2. Propagate uncertainty
+    p_cov_check = f_jac_km @ p_cov_km @ f_jac_km.T + delta_t**2 * self._l_q_l
+
+    return p_check, v_check, q_check, p_cov_check
+
   def predict(self):
     """
     Implement the EKF prediction and update steps.
@@ -84,32 +158,18 @@ class Kalman:
     # Set initial values.
     p_est[0] = self.gt.p[0]
     v_est[0] = self.gt.v[0]
-    q_est[0] = Quaternion(euler=self.gt.r[0]).to_numpy()
+    q_est[0] = quat_from_euler(self.gt.r[0])
     p_cov[0] = np.zeros(9)  # covariance of estimate
     gnss_i = 0
     lidar_i = 0
 
+    self._l_q_l = self.motion_noise_cov()
+
     for k in range(1, self.imu_f.data.shape[0]):  # start at 1 b/c we have initial prediction from gt
       delta_t = self.imu_f.t[k] - self.imu_f.t[k - 1]
 
-      # 1. Update state with IMU inputs
-      c_ns = Quaternion(*q_est[k - 1]).to_mat()
-      c_ns_dot_f_km = np.dot(c_ns, self.imu_f.data[k - 1])
-      p_check = p_est[k - 1] + delta_t * v_est[k - 1] + (delta_t**2 / 2) * (c_ns_dot_f_km + self.g)
-      v_check = v_est[k - 1] + delta_t * (c_ns_dot_f_km + self.g)
-      q_from_w = Quaternion(axis_angle=self.imu_w.data[k - 1] * delta_t)
-      q_check = q_from_w.quat_mult_right(q_est[k - 1], out='Quaternion')
-
-      # 1.1 Linearize the motion model and compute Jacobians
-      f_jac_km = np.eye(9)
-      f_jac_km[0:3, 3:6] = np.eye(3) * delta_t
-      f_jac_km[3:6, 6:9] = -skew_symmetric(c_ns_dot_f_km) * delta_t
-
-      # 2. Propagate uncertainty
-      q_cov_km = np.zeros((6, 6))
-      q_cov_km[0:3, 0:3] = delta_t**2 * np.eye(3) * self.var_imu_f
-      q_cov_km[3:6, 3:6] = delta_t**2 * np.eye(3) * self.var_imu_w
-      p_cov_check = f_jac_km @ p_cov[k - 1] @ f_jac_km.T + self.l_jac @ q_cov_km @ self.l_jac.T
+      # 1. and 2. Update state with IMU inputs and propagate uncertainty
+      p_check, v_check, q_check, p_cov_check = self.motion_update(p_est[k - 1], v_est[k - 1], q_est[k - 1], p_cov[k - 1], self.imu_f.data[k - 1], self.imu_w.data[k - 1], delta_t)
 
       # 3. Check availability of GNSS and LIDAR measurements
       if gnss_i < self.gnss.data.shape[0] and self.imu_f.t[k] >= self.gnss.t[gnss_i]:
@@ -123,7 +183,132 @@ class Kalman:
       # Save updated state
       p_est[k] = p_check
       v_est[k] = v_check
-      q_est[k] = q_check.to_numpy()
+      q_est[k] = q_check
       p_cov[k] = p_cov_check
 
     return p_est, v_est, q_est, p_cov
+
+  def batch_measurement_update(self, sensor_var, p_cov_check, y_k, p_check, v_check, q_check):
+    """
+    Measurement update of batch_predict(), for K filters at once.
+
+    :param sensor_var: Sensor variance of each filter, of shape (K,)
+    :param p_cov_check: Predicted covariances, of shape (K, 9, 9)
+    :param y_k: Measurement shared by the filters, of shape (3,)
+    :param p_check: Predicted positions, of shape (K, 3)
+    :param v_check: Predicted velocities, of shape (K, 3)
+    :param q_check: Predicted orientations as wxyz quaternions, of shape (K, 4)
+    """
+    # 3.1 Compute Kalman gain
+    if self._h_selects_position:
+      ph_t = p_cov_check[:, :, :3]
+      s_cov = p_cov_check[:, :3, :3] + sensor_var[:, None, None] * np.eye(3)
+    else:
+      ph_t = p_cov_check @ self.h_jac.T
+      s_cov = self.h_jac @ ph_t + sensor_var[:, None, None] * np.eye(len(self.h_jac))
+    # S is symmetric, so K = P H^T S^-1 = (S^-1 H P)^T.
+    k_gain = np.linalg.solve(s_cov, ph_t.transpose(0, 2, 1)).transpose(0, 2, 1)
+
+    # 3.2 Compute error state
+    x_error = np.einsum('kij,kj->ki', k_gain, y_k - p_check) * 0.9
+
+    # 3.3 Correct predicted state
+    p_hat = p_check + x_error[:, :3]
+    v_hat = v_check + x_error[:, 3:6]
+    q_hat = quat_mult(quat_from_axis_angle(x_error[:, 6:9]), q_check)
+
+    # 3.4 Compute corrected covariance, in the Joseph form
+    i_kh = self._eye - k_gain @ self.h_jac
+    p_cov_hat = i_kh @ p_cov_check @ i_kh.transpose(0, 2, 1) + \
+        sensor_var[:, None, None] * (k_gain @ k_gain.transpose(0, 2, 1))
+
+    return p_hat, v_hat, q_hat, p_cov_hat
+
+  def batch_predict(self, var_imu_f=None, var_imu_w=None, var_lidar=None, var_gnss=None,
+                    keep_cov=True):
+    """
+    Run K filters with different sensor variances in lock-step over the same
+    sensor data, e.g. to grid search the variances in one pass.
+
+    Each variance is a scalar or an array of shape (K,), and defaults to the
+    one the filter was initialized with. With K = 1 and the initial variances
+    the results are those of predict().
+
+    :param var_imu_f: Variances of the IMU specific force
+    :param var_imu_w: Variances of the IMU angular velocity
+    :param var_lidar: Variances of the LIDAR measurements
+    :param var_gnss: Variances of the GNSS measurements
+    :param keep_cov: Return the covariance at every timestep, of shape
+                     (K, N, 9, 9), or only at the last one, of shape (K, 9, 9)
+    :return: Position, velocity and quaternion estimates of shapes (K, N, 3),
+             (K, N, 3) and (K, N, 4), and the covariances.
+    """
+    var_imu_f, var_imu_w, var_lidar, var_gnss = np.broadcast_arrays(*[
+        np.atleast_1d(np.asarray(default if var is None else var, dtype=float))
+        for var, default in ((var_imu_f, self.var_imu_f), (var_imu_w, self.var_imu_w),
+                             (var_lidar, self.var_lidar), (var_gnss, self.var_gnss))])
+    num_filters = len(var_imu_f)
+    num_steps = self.imu_f.data.shape[0]
+
+    p_est = np.zeros([num_filters, num_steps, 3])  # position estimates
+    v_est = np.zeros([num_filters, num_steps, 3])  # velocity estimates
+    q_est = np.zeros([num_filters, num_steps, 4])  # orientation estimates as quaternions
+    p_cov = np.zeros([num_filters, num_steps if keep_cov else 1, 9, 9])  # covariance matrices
+
+    # Set initial values.
+    p_est[:, 0] = self.gt.p[0]
+    v_est[:, 0] = self.gt.v[0]
+    q_est[:, 0] = quat_from_euler(self.gt.r[0])
+    p_cov_k = np.zeros([num_filters, 9, 9])  # covariance of estimate
+    gnss_i = 0
+    lidar_i = 0
+
+    # Motion model noise covariance L Q L^T of each filter, per unit delta_t**2.
+    q_cov_km = np.zeros([num_filters, 6, 6])
+    q_cov_km[:, 0:3, 0:3] = var_imu_f[:, None, None] * np.eye(3)
+    q_cov_km[:, 3:6, 3:6] = var_imu_w[:, None, None] * np.eye(3)
+    l_q_l = self.l_jac @ q_cov_km @ self.l_jac.T
+    f_jac_km = np.tile(np.eye(9), (num_filters, 1, 1))
+
+    for k in range(1, num_steps):  # start at 1 b/c we have initial prediction from gt
+      delta_t = self.imu_f.t[k] - self.imu_f.t[k - 1]
+
+      # 1. Update state with IMU inputs
+      c_ns = quat_to_mat(q_est[:, k - 1])
+      c_ns_dot_f_km = c_ns @ self.imu_f.data[k - 1]
+      p_check = p_est[:, k - 1] + delta_t * v_est[:, k - 1] + (delta_t**2 / 2) * (c_ns_dot_f_km + self.g)
+      v_check = v_est[:, k - 1] + delta_t * (c_ns_dot_f_km + self.g)
+      q_from_w = quat_from_axis_angle(self.imu_w.data[k - 1] * delta_t)
+      q_check = quat_mult(q_est[:, k - 1], q_from_w)
+
+      # 1.1 Linearize the motion model and compute Jacobians
+      f_jac_km[:, 0:3, 3:6] = np.eye(3) * delta_t
+      # -skew_symmetric(c_ns_dot_f_km) * delta_t for each filter.
+      f_x, f_y, f_z = (c_ns_dot_f_km * delta_t).T
+      f_jac_km[:, 3, 7], f_jac_km[:, 3, 8] = f_z, -f_y
+      f_jac_km[:, 4, 6], f_jac_km[:, 4, 8] = -f_z, f_x
+      f_jac_km[:, 5, 6], f_jac_km[:, 5, 7] = f_y, -f_x
+
+      # 2. Propagate uncertainty
+      p_cov_check = f_jac_km @ p_cov_k @ f_jac_km.transpose(0, 2, 1) + delta_t**2 * l_q_l
+
+      # 3. Check availability of GNSS and LIDAR measurements
+      if gnss_i < self.gnss.data.shape[0] and self.imu_f.t[k] >= self.gnss.t[gnss_i]:
+        p_check, v_check, q_check, p_cov_check = self.batch_measurement_update(var_gnss, p_cov_check, self.gnss.data[gnss_i], p_check, v_check, q_check)
+        gnss_i += 1
+
+      if lidar_i < self.lidar.data.shape[0] and self.imu_f.t[k] >= self.lidar.t[lidar_i]:
+        p_check, v_check, q_check, p_cov_check = self.batch_measurement_update(var_lidar, p_cov_check, self.lidar.data[lidar_i], p_check, v_check, q_check)
+        lidar_i += 1
+
+      # Save updated state
+      p_est[:, k] = p_check
+      v_est[:, k] = v_check
+      q_est[:, k] = q_check
+      p_cov_k = p_cov_check
+      if keep_cov:
+        p_cov[:, k] = p_cov_check
+
+    if not keep_cov:
+      p_cov = p_cov_k
+    return p_est, v_est, q_est, p_cov
@@ -0,0 +1,83 @@
+import numpy as np
+import unittest
+
+from kalman import Kalman
+
+
+class StampedData():
+  def __init__(self, t, data):
+    self.t = np.asarray(t)
+    self.data = np.asarray(data)
+
+
+class GroundTruth():
+  def __init__(self, p, v, r):
+    self.p = np.asarray(p)
+    self.v = np.asarray(v)
+    self.r = np.asarray(r)
+
+
+def make_data(num_steps=300, seed=0):
+  """Synthetic IMU, GNSS and LIDAR data of a vehicle accelerating while
+  turning. GNSS falls between IMU samples, LIDAR on IMU timestamps."""
+  rng = np.random.RandomState(seed)
+  t = np.arange(num_steps) * 0.01
+  imu_f = StampedData(t, np.array([0.5, 0.0, 9.81]) +
+                      0.1 * rng.normal(size=(num_steps, 3)))
+  imu_w = StampedData(t, np.array([0.0, 0.0, 0.2]) +
+                      0.01 * rng.normal(size=(num_steps, 3)))
+  gnss_t = np.arange(0.005, t[-1], 0.23)
+  gnss = StampedData(gnss_t, np.column_stack((
+      0.25 * gnss_t**2, 0.02 * gnss_t**3, np.zeros(len(gnss_t)))) +
+      0.5 * rng.normal(size=(len(gnss_t), 3)))
+  lidar_t = t[3::7]
+  lidar = StampedData(lidar_t, np.column_stack((
+      0.25 * lidar_t**2, 0.02 * lidar_t**3, np.zeros(len(lidar_t)))) +
+      0.1 * rng.normal(size=(len(lidar_t), 3)))
+  gt = GroundTruth(np.zeros((1, 3)), np.zeros((1, 3)), np.zeros((1, 3)))
+  return gt, imu_f, imu_w, gnss, lidar
+
+
+def make_kalman(var_imu_f=1.0, var_imu_w=1.0, var_lidar=0.5, var_gnss=25.0):
+  g = np.array([0, 0, -9.81])
+  l_jac = np.zeros([9, 6])
+  l_jac[3:, :] = np.eye(6)
+  h_jac = np.zeros([3, 9])
+  h_jac[:, :3] = np.eye(3)
+  return Kalman(*make_data(), g, l_jac, h_jac, var_imu_f, var_imu_w,
+                var_lidar, var_gnss)
+
+
+class KalmanTest(unittest.TestCase):
+
+  def assert_estimates_equal(self, estimates, expected):
+    for estimate, expected_estimate in zip(estimates, expected):
+      np.testing.assert_allclose(estimate, expected_estimate, rtol=0,
+                                 atol=1e-9)
+
+  def test_batch_predict_single(self):
+    kalman = make_kalman()
+    p_est, v_est, q_est, p_cov = kalman.batch_predict()
+    self.assertEqual(p_est.shape, (1, 300, 3))
+    self.assertEqual(p_cov.shape, (1, 300, 9, 9))
+    self.assert_estimates_equal((p_est[0], v_est[0], q_est[0], p_cov[0]),
+                                kalman.predict())
+
+  def test_batch_predict_variances(self):
+    variances = [(1.0, 1.0, 0.5, 25.0), (0.1, 2.0, 5.0, 1.0)]
+    p_est, v_est, q_est, p_cov = make_kalman().batch_predict(
+        *np.transpose(variances), keep_cov=False)
+    self.assertEqual(p_cov.shape, (2, 9, 9))
+    for k, variance in enumerate(variances):
+      expected = make_kalman(*variance).predict()
+      self.assert_estimates_equal((p_est[k], v_est[k], q_est[k], p_cov[k]),
+                                  expected[:3] + (expected[3][-1],))
+
+  def test_covariance_symmetric(self):
+    p_cov = make_kalman().predict()[3]
+    np.testing.assert_allclose(p_cov, np.transpose(p_cov, (0, 2, 1)),
+                               rtol=0, atol=1e-12)
+
+
+if __name__ == '__main__':
+  unittest.main()
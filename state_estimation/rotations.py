@@ -3,6 +3,7 @@
 # Authors: Trevor Ablett and Jonathan Kelly
 # University of Toronto Institute for Aerospace Studies
 import numpy as np
+from math import cos, sin, sqrt
 
 
 def angle_normalize(a):
@@ -50,6 +51,147 @@ def rpy_jacobian_axis_angle(a):
   return Jr @ Ja
 
 
+def _new_out(shape, out):
+  return np.empty(shape) if out is None else out
+
+
+def quat_mult(q, r, out=None):
+  """Hamilton product q*r of wxyz quaternions.
+
+  :param q: Quaternions, of shape (4,) or (N, 4).
+  :param r: Quaternions, of shape (4,) or (N, 4).
+  :param out: Optional output array, which may be q or r.
+  :return: The products, of the broadcast shape of q and r.
+  """
+  q = np.asarray(q, dtype=float)
+  r = np.asarray(r, dtype=float)
+  if q.ndim == 1 and r.ndim == 1:
+    # Single quaternions are multiplied as Python floats, which is much
+    # faster than with numpy scalars.
+    w1, x1, y1, z1 = q.tolist()
+    w2, x2, y2, z2 = r.tolist()
+  else:
+    w1, x1, y1, z1 = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    w2, x2, y2, z2 = r[..., 0], r[..., 1], r[..., 2], r[..., 3]
+  w = w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2
+  x = w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2
+  y = w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2
+  z = w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2
+  out = _new_out(np.broadcast(q[..., 0], r[..., 0]).shape + (4,), out)
+  out[..., 0] = w
+  out[..., 1] = x
+  out[..., 2] = y
+  out[..., 3] = z
+  return out
+
+
+def quat_from_axis_angle(a, out=None):
+  """Exponential map of axis-angle vectors to wxyz quaternions.
+
+  :param a: Axis-angle vectors, of shape (3,) or (N, 3).
+  :param out: Optional output array of shape a.shape[:-1] + (4,).
+  :return: The quaternions.
+  """
+  a = np.asarray(a, dtype=float)
+  if a.ndim == 1:
+    x, y, z = a.tolist()
+    norm = sqrt(x * x + y * y + z * z)
+    scale = sin(norm / 2) / norm if norm >= 1e-50 else 0.0
+    out = _new_out((4,), out)
+    out[0] = cos(norm / 2)
+    out[1] = x * scale
+    out[2] = y * scale
+    out[3] = z * scale
+    return out
+
+  norm = np.sqrt(np.einsum('...i,...i', a, a))
+  # Rotations smaller than this have no imaginary part, to avoid nans.
+  scale = np.divide(np.sin(norm / 2), norm, out=np.zeros_like(norm),
+                    where=norm >= 1e-50)
+  out = _new_out(a.shape[:-1] + (4,), out)
+  out[..., 0] = np.cos(norm / 2)
+  np.multiply(a, scale[..., None], out=out[..., 1:])
+  return out
+
+
+def quat_to_axis_angle(q, out=None):
+  """Logarithmic map of wxyz unit quaternions to axis-angle vectors.
+
+  :param q: Quaternions, of shape (4,) or (N, 4).
+  :param out: Optional output array of shape q.shape[:-1] + (3,).
+  :return: The axis-angle vectors, zero for the identity rotation.
+  """
+  q = np.asarray(q, dtype=float)
+  angle = 2 * np.arccos(np.clip(q[..., 0], -1.0, 1.0))
+  sin_half = np.sin(angle / 2)
+  scale = np.divide(angle, sin_half, out=np.zeros_like(angle),
+                    where=sin_half != 0)
+  out = _new_out(q.shape[:-1] + (3,), out)
+  np.multiply(q[..., 1:], scale[..., None], out=out)
+  return out
+
+
+def quat_to_mat(q, out=None):
+  """Rotation matrices of wxyz quaternions.
+
+  :param q: Quaternions, of shape (4,) or (N, 4).
+  :param out: Optional output array of shape q.shape[:-1] + (3, 3).
+  :return: The rotation matrices.
+  """
+  q = np.asarray(q, dtype=float)
+  w, x, y, z = q.tolist() if q.ndim == 1 else \
+      (q[..., 0], q[..., 1], q[..., 2], q[..., 3])
+  out = _new_out(q.shape[:-1] + (3, 3), out)
+  out[..., 0, 0] = w * w + x * x - y * y - z * z
+  out[..., 0, 1] = 2 * (x * y - w * z)
+  out[..., 0, 2] = 2 * (x * z + w * y)
+  out[..., 1, 0] = 2 * (x * y + w * z)
+  out[..., 1, 1] = w * w - x * x + y * y - z * z
+  out[..., 1, 2] = 2 * (y * z - w * x)
+  out[..., 2, 0] = 2 * (x * z - w * y)
+  out[..., 2, 1] = 2 * (y * z + w * x)
+  out[..., 2, 2] = w * w - x * x - y * y + z * z
+  return out
+
+
+def quat_from_euler(euler, out=None):
+  """wxyz quaternions of XYZ (roll pitch yaw) Euler angles, in the fixed
+  frame.
+
+  :param euler: Euler angles, of shape (3,) or (N, 3).
+  :param out: Optional output array of shape euler.shape[:-1] + (4,).
+  :return: The quaternions.
+  """
+  half = np.asarray(euler, dtype=float) * 0.5
+  cr, cp, cy = np.cos(half[..., 0]), np.cos(half[..., 1]), np.cos(half[..., 2])
+  sr, sp, sy = np.sin(half[..., 0]), np.sin(half[..., 1]), np.sin(half[..., 2])
+  out = _new_out(half.shape[:-1] + (4,), out)
+  out[..., 0] = cr * cp * cy + sr * sp * sy
+  out[..., 1] = sr * cp * cy - cr * sp * sy
+  out[..., 2] = cr * sp * cy + sr * cp * sy
+  out[..., 3] = cr * cp * sy - sr * sp * cy
+  return out
+
+
+def quat_to_euler(q, out=None):
+  """XYZ (roll pitch yaw) Euler angles of wxyz quaternions.
+
+  :param q: Quaternions, of shape (4,) or (N, 4).
+  :param out: Optional output array of shape q.shape[:-1] + (3,).
+  :return: The Euler angles.
+  """
+  q = np.asarray(q, dtype=float)
+  w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+  roll = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+  pitch = np.arcsin(2 * (w * y - z * x))
+  yaw = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+  out = _new_out(q.shape[:-1] + (3,), out)
+  out[..., 0] = roll
+  out[..., 1] = pitch
+  out[..., 2] = yaw
+  return out
+
+
 class Quaternion():
   def __init__(self, w=1., x=0., y=0., z=0., axis_angle=None, euler=None):
     """
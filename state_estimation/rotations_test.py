@@ -0,0 +1,63 @@
+import numpy as np
+import unittest
+
+import rotations
+from rotations import Quaternion
+
+
+class QuaternionKernelTest(unittest.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.quats = rng.normal(size=(20, 4))
+    self.quats /= np.linalg.norm(self.quats, axis=1, keepdims=True)
+    self.axis_angles = rng.normal(size=(20, 3))
+    self.eulers = rng.uniform(-1.0, 1.0, size=(20, 3))
+
+  def test_mult(self):
+    expected = np.array([Quaternion(*q).quat_mult_left(r)
+                         for q, r in zip(self.quats, self.quats[::-1])])
+    np.testing.assert_allclose(
+        rotations.quat_mult(self.quats, self.quats[::-1]), expected, atol=1e-12)
+    np.testing.assert_allclose(
+        rotations.quat_mult(self.quats[0], self.quats[-1]), expected[0],
+        atol=1e-12)
+    # The output may alias an input.
+    quats = self.quats.copy()
+    rotations.quat_mult(quats, self.quats[::-1], out=quats)
+    np.testing.assert_allclose(quats, expected, atol=1e-12)
+
+  def test_axis_angle(self):
+    expected = np.array([Quaternion(axis_angle=a).to_numpy()
+                         for a in self.axis_angles])
+    np.testing.assert_allclose(
+        rotations.quat_from_axis_angle(self.axis_angles), expected, atol=1e-12)
+    out = np.empty(4)
+    rotations.quat_from_axis_angle(self.axis_angles[0], out=out)
+    np.testing.assert_allclose(out, expected[0], atol=1e-12)
+    np.testing.assert_array_equal(
+        rotations.quat_from_axis_angle(np.zeros(3)), [1.0, 0.0, 0.0, 0.0])
+
+    small = self.axis_angles / np.linalg.norm(self.axis_angles, axis=1,
+                                              keepdims=True)
+    np.testing.assert_allclose(
+        rotations.quat_to_axis_angle(rotations.quat_from_axis_angle(small)),
+        small, atol=1e-9)
+
+  def test_to_mat(self):
+    expected = np.array([Quaternion(*q).to_mat() for q in self.quats])
+    np.testing.assert_allclose(rotations.quat_to_mat(self.quats), expected,
+                               atol=1e-12)
+    np.testing.assert_allclose(rotations.quat_to_mat(self.quats[3]),
+                               expected[3], atol=1e-12)
+
+  def test_euler(self):
+    expected = np.array([Quaternion(euler=e).to_numpy() for e in self.eulers])
+    quats = rotations.quat_from_euler(self.eulers)
+    np.testing.assert_allclose(quats, expected, atol=1e-12)
+    np.testing.assert_allclose(rotations.quat_to_euler(quats), self.eulers,
+                               atol=1e-12)
+
+
+if __name__ == '__main__':
+  unittest.main()
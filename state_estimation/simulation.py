@@ -7,7 +7,7 @@ import pickle
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
-from rotations import angle_normalize, rpy_jacobian_axis_angle, Quaternion
+from rotations import angle_normalize, rpy_jacobian_axis_angle, quat_to_axis_angle, quat_to_euler
 
 from kalman import Kalman
 
@@ -51,20 +51,16 @@ def report(p_est, v_est, q_est, p_cov, gt):
   error_fig, ax = plt.subplots(2, 3)
   error_fig.suptitle('Error Plots')
   num_gt = gt.p.shape[0]
-  p_est_euler = []
-  p_cov_euler_std = []
 
   # Convert estimated quaternions to euler angles
-  for i in range(len(q_est)):
-    qc = Quaternion(*q_est[i, :])
-    p_est_euler.append(qc.to_euler())
-
-    # First-order approximation of RPY covariance
-    J = rpy_jacobian_axis_angle(qc.to_axis_angle())
-    p_cov_euler_std.append(np.sqrt(np.diagonal(J @ p_cov[i, 6:, 6:] @ J.T)))
+  p_est_euler = quat_to_euler(q_est)
 
-  p_est_euler = np.array(p_est_euler)
-  p_cov_euler_std = np.array(p_cov_euler_std)
+  # First-order approximation of RPY covariance
+  axis_angles = quat_to_axis_angle(q_est)
+  p_cov_euler_std = np.empty((len(q_est), 3))
+  for i in range(len(q_est)):
+    J = rpy_jacobian_axis_angle(axis_angles[i])
+    p_cov_euler_std[i] = np.sqrt(np.diagonal(J @ p_cov[i, 6:, 6:] @ J.T))
 
   # Get uncertainty estimates from P matrix
   p_cov_std = np.sqrt(np.diagonal(p_cov[:, :6, :6], axis1=1, axis2=2))
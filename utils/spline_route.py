@@ -0,0 +1,160 @@
+import numpy as np
+from math import sqrt
+from scipy.interpolate import CubicSpline
+
+
+class SplineRoute:
+  """Route fitted once with a cubic spline parameterized by arc length.
+
+  The waypoints are first fitted with a spline over their chord length,
+  which is then resampled at uniform steps of its true arc length and
+  fitted again. Since the knots of the final spline are uniformly spaced,
+  the segment holding an arc length is found by a division instead of a
+  search, so position, heading, curvature and reference speed are O(1) to
+  evaluate. The reference speed is linearly interpolated between waypoints
+  so it does not overshoot.
+
+  args:
+      waypoints: Waypoints in the format [[x0, y0, v0], [x1, y1, v1], ...],
+          or an array of shape (N, 2) or (N, 3). At least two distinct
+          points are required.
+      resolution: Approximate arc length (m) between the spline knots.
+  """
+
+  def __init__(self, waypoints, resolution=0.5):
+    waypoints = np.asarray(waypoints, dtype=float)
+    # Drop repeated points, which have no direction.
+    keep = np.ones(len(waypoints), dtype=bool)
+    keep[1:] = np.any(np.diff(waypoints[:, :2], axis=0) != 0, axis=1)
+    waypoints = waypoints[keep]
+    if len(waypoints) < 2:
+      raise ValueError("A route needs at least two distinct waypoints.")
+
+    # Chord length fit, and its true arc length on a fine grid.
+    chord = np.zeros(len(waypoints))
+    np.cumsum(np.hypot(*np.diff(waypoints[:, :2], axis=0).T), out=chord[1:])
+    chord_spline = CubicSpline(chord, waypoints[:, :2])
+    t = np.linspace(0.0, chord[-1], 16 * len(waypoints))
+    speed = np.hypot(*chord_spline(t, 1).T)
+    arc_length = np.zeros(len(t))
+    np.cumsum(0.5 * (speed[1:] + speed[:-1]) * np.diff(t), out=arc_length[1:])
+
+    # Uniform arc length knots.
+    self.length = float(arc_length[-1])
+    num_segments = max(int(np.ceil(self.length / resolution)), 1)
+    self._ds = self.length / num_segments
+    knots = np.linspace(0.0, self.length, num_segments + 1)
+    spline = CubicSpline(knots, chord_spline(np.interp(knots, arc_length, t)))
+    # Polynomial coefficients of each segment, highest degree first, of
+    # shape (num_segments, 4, 2).
+    self._coeffs = np.ascontiguousarray(np.transpose(spline.c, (1, 0, 2)))
+
+    # Reference speed at the knots.
+    if waypoints.shape[1] > 2:
+      self._speeds = np.interp(knots, np.interp(chord, t, arc_length),
+                               waypoints[:, 2])
+    else:
+      self._speeds = np.zeros(len(knots))
+
+    self._last_s = None
+
+  def _segment(self, s):
+    s = np.clip(np.asarray(s, dtype=float), 0.0, self.length)
+    index = np.minimum((s / self._ds).astype(int), len(self._coeffs) - 1)
+    return index, s - index * self._ds
+
+  def position(self, s):
+    """Returns the [x, y] position (m) at arc length s, of shape
+    s.shape + (2,)."""
+    index, u = self._segment(s)
+    c = self._coeffs[index]
+    u = u[..., None]
+    return ((c[..., 0, :] * u + c[..., 1, :]) * u + c[..., 2, :]) * u + \
+        c[..., 3, :]
+
+  def derivatives(self, s):
+    """Returns the first and second derivatives of the position with
+    respect to arc length at s, each of shape s.shape + (2,)."""
+    index, u = self._segment(s)
+    c = self._coeffs[index]
+    u = u[..., None]
+    first = (3.0 * c[..., 0, :] * u + 2.0 * c[..., 1, :]) * u + c[..., 2, :]
+    second = 6.0 * c[..., 0, :] * u + 2.0 * c[..., 1, :]
+    return first, second
+
+  def heading(self, s):
+    """Returns the heading (rad) of the route at arc length s."""
+    first, _ = self.derivatives(s)
+    return np.arctan2(first[..., 1], first[..., 0])
+
+  def curvature(self, s):
+    """Returns the signed curvature (1/m) of the route at arc length s,
+    positive when turning left."""
+    first, second = self.derivatives(s)
+    return (first[..., 0] * second[..., 1] - first[..., 1] * second[..., 0]) / \
+        np.hypot(first[..., 0], first[..., 1])**3
+
+  def speed(self, s):
+    """Returns the reference speed (m/s) at arc length s."""
+    index, u = self._segment(s)
+    ratio = u / self._ds
+    return (1.0 - ratio) * self._speeds[index] + ratio * self._speeds[index + 1]
+
+  def _evaluate(self, s):
+    # Scalar position and derivatives for the projection's Newton steps.
+    index = min(int(s / self._ds), len(self._coeffs) - 1)
+    u = s - index * self._ds
+    (a_x, a_y), (b_x, b_y), (c_x, c_y), (d_x, d_y) = self._coeffs[index].tolist()
+    return (((a_x * u + b_x) * u + c_x) * u + d_x,
+            ((a_y * u + b_y) * u + c_y) * u + d_y,
+            (3.0 * a_x * u + 2.0 * b_x) * u + c_x,
+            (3.0 * a_y * u + 2.0 * b_y) * u + c_y,
+            6.0 * a_x * u + 2.0 * b_x,
+            6.0 * a_y * u + 2.0 * b_y)
+
+  def reset(self):
+    """Forgets the last projection, so the next one starts from a global
+    search."""
+    self._last_s = None
+
+  def project(self, x, y, max_iter=5):
+    """Projects a position onto the route.
+
+    Starts from the last projection and refines it with Newton steps on
+    the squared distance to the route. The first projection (or the first
+    one after reset()) starts from the closest knot instead.
+
+    args:
+        x: x position (m).
+        y: y position (m).
+        max_iter: Maximum number of Newton steps.
+    returns:
+        [s, lateral]:
+            s: arc length (m) of the closest point of the route.
+            lateral: signed distance (m) from the route to the position,
+                positive to the left of the route.
+    """
+    if self._last_s is None:
+      knots = self._coeffs[:, 3, :]
+      index = int(np.argmin(np.hypot(knots[:, 0] - x, knots[:, 1] - y)))
+      s = index * self._ds
+    else:
+      s = self._last_s
+
+    for _ in range(max_iter):
+      p_x, p_y, d_x, d_y, dd_x, dd_y = self._evaluate(s)
+      o_x = p_x - x
+      o_y = p_y - y
+      gradient = o_x * d_x + o_y * d_y
+      hessian = d_x * d_x + d_y * d_y + o_x * dd_x + o_y * dd_y
+      if hessian <= 0.0:
+        hessian = d_x * d_x + d_y * d_y
+      step = gradient / hessian
+      s = min(max(s - step, 0.0), self.length)
+      if abs(step) < 1e-6:
+        break
+
+    self._last_s = s
+    p_x, p_y, d_x, d_y, _, _ = self._evaluate(s)
+    lateral = (d_x * (y - p_y) - d_y * (x - p_x)) / sqrt(d_x * d_x + d_y * d_y)
+    return s, lateral
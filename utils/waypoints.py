@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def densify(waypoints, resolution):
+  """Linearly interpolates between waypoints at a fixed resolution.
+
+  Every segment between two consecutive waypoints is filled with points
+  spaced resolution apart (in x and y) after its first waypoint, stopping
+  before the next waypoint is about to be reached. All of the columns
+  (e.g. the speed) are interpolated along with the position.
+
+  args:
+      waypoints: Waypoints in the format [[x0, y0, v0], [x1, y1, v1], ...],
+          or an array of shape (N, C) with x and y as the first columns.
+      resolution: Distance (m) between interpolated points.
+  returns:
+      [wp_interp, wp_interp_hash]:
+          wp_interp: Array of shape (M, C) of the interpolated waypoints,
+              including the original ones.
+          wp_interp_hash: Integer array of shape (N,) which indexes the
+              waypoints to their index in wp_interp, i.e.
+              wp_interp[wp_interp_hash[i]] is waypoints[i].
+  """
+  waypoints = np.asarray(waypoints, dtype=float)
+  if len(waypoints) == 0:
+    return waypoints.copy(), np.zeros(0, dtype=int)
+
+  wp_vector = np.diff(waypoints, axis=0)
+  wp_distance = np.hypot(wp_vector[:, 0], wp_vector[:, 1])
+  wp_uvector = np.zeros_like(wp_vector)
+  np.divide(wp_vector, wp_distance[:, None], out=wp_uvector,
+            where=wp_distance[:, None] > 0)
+
+  # Each segment holds its first waypoint and the points interpolated up to
+  # the next waypoint.
+  num_pts_to_interp = np.maximum(
+      np.floor(wp_distance / float(resolution)).astype(int) - 1, 0)
+  wp_interp_hash = np.zeros(len(waypoints), dtype=int)
+  np.cumsum(num_pts_to_interp + 1, out=wp_interp_hash[1:])
+
+  # Segment of each point and its step count along the segment, which is 0
+  # for the waypoint itself.
+  segment = np.repeat(np.arange(len(wp_vector)), num_pts_to_interp + 1)
+  step = np.arange(len(segment)) - wp_interp_hash[segment]
+
+  wp_interp = np.empty((len(segment) + 1, waypoints.shape[1]))
+  wp_interp[:-1] = waypoints[segment] + \
+      (resolution * step)[:, None] * wp_uvector[segment]
+  # add last waypoint at the end
+  wp_interp[-1] = waypoints[-1]
+  return wp_interp, wp_interp_hash